@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from abc import abstractmethod
+import asyncio
+import time
+
+import aiohttp
+
+from .abstract_site_ad_parser import AbstractSiteAdParser, NeedPhonesComplete, AD_URL_FORMS_CAPACITY
+from .bloom_filter import ScalableBloomFilter
+from .log import get_logger
+from .http_cache import RESOURCE_CATEGORY, RESOURCE_DEFAULT
+from .http_response import HttpResponse
+from .metrics import REQUESTS_TOTAL, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_CACHE, STAGE_LAST_PAGE
+
+
+logger = get_logger('asaparser_async')
+
+
+class AbstractAsyncSiteAdParser(AbstractSiteAdParser):
+    """Абстрактный асинхронный парсер сайтов-объявлений.
+
+    В отличии от AbstractSiteAdParser, страницы категорий и объявлений запрашиваются
+    одновременно, количество одновременных запросов ограничивается настройками
+    concurrency/max и concurrency/per_host из конфига. Методы get_list_ad_from_category,
+    get_last_page_category и get_phones_ad у наследников должны быть корутинами,
+    а http-запросы выполняться через self.fetch.
+
+    Пример использования:
+
+    parser = FooBar_AsyncSiteAdParser()
+    parser.process_config('config.yaml')
+    parser.run()
+    parser.save()
+
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Максимальное количество одновременных запросов
+        self.max_concurrency = None
+
+        # Максимальное количество одновременных запросов к одному хосту
+        self.max_per_host = None
+
+        # Количество попыток выполнения запроса
+        self.attempts_request = 5
+
+        # Адрес http-прокси, через который выполняются запросы (None -- без прокси)
+        self.proxy = None
+
+        # Http-сессия, создается на время выполнения run
+        self.session = None
+
+        # Запущенные задачи парсера, при наборе нужного количества телефонов они отменяются
+        self._tasks = set()
+
+        # Событие устанавливается, когда набрано нужное количество телефонов
+        self._complete = None
+
+    def process_config(self, file_name):
+        super().process_config(file_name)
+
+        concurrency = self.config['concurrency']
+        self.max_concurrency = concurrency['max']
+        self.max_per_host = concurrency['per_host']
+        self.attempts_request = self.http.attempts
+
+        # aiohttp поддерживает только http-прокси
+        if self.proxy_enabled:
+            if self.proxy_type != 'http':
+                logger.warning('Тип прокси "%s" не поддерживается, используется http.', self.proxy_type)
+
+            self.proxy = self.proxy_url
+
+    def run(self):
+        """Функция запускает асинхронный парсинг сайта"""
+
+        t = time.perf_counter()
+
+        self.page_memo.clear()
+        self.canonical_duplicates = 0
+        self.ad_url_forms = ScalableBloomFilter(initial_capacity=AD_URL_FORMS_CAPACITY)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run_async())
+        finally:
+            loop.close()
+
+            # Даже если парсер упал, найденные телефоны и посещенные объявления должны остаться в файлах
+            self.checkpoint_sink()
+            self.visited_ad_urls.flush()
+
+        logger.debug('Время выполнения парсера %.3f секунд.', time.perf_counter() - t)
+        logger.info('Найдено %s телефонов.', len(self.list_phones))
+        logger.info('Телефоны: %s.', self.list_phones if len(self.list_phones) else 'нет')
+
+        self.log_stats()
+        self.save_metrics()
+
+    async def run_async(self):
+        """Корутина парсинга сайта: запускает разбор адресов объявлений и категорий и ждет,
+        пока они закончатся или наберется нужное количество телефонов
+
+        """
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency or 0, limit_per_host=self.max_per_host or 0)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        self._tasks = set()
+        self._complete = asyncio.Event()
+
+        crawl = self.spawn(self.crawl())
+        complete = asyncio.ensure_future(self._complete.wait())
+
+        try:
+            await asyncio.wait([crawl, complete], return_when=asyncio.FIRST_COMPLETED)
+
+            if self._complete.is_set():
+                logger.info('Найдено нужное количество телефонов, отменяю выполняющиеся задачи (%s).',
+                            len(self._tasks))
+
+        finally:
+            complete.cancel()
+
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.session.close()
+            self.session = None
+
+    def spawn(self, coro):
+        """Функция запускает корутину как задачу парсера, чтобы ее можно было отменить"""
+
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def crawl(self):
+        """Корутина одновременно разбирает адреса объявлений из конфига и категории объявлений"""
+
+        jobs = []
+
+        if self.ad_urls:
+            logger.debug('Начинаю парсить, указанные в конфиге, адреса объявлений (%s).', len(self.ad_urls))
+            jobs.append(self.spawn(self.parse_ad_urls(self.ad_urls, self.need_phones)))
+
+        logger.debug('Начинаю парсить категории объявлений (%s).', len(self.categories_urls))
+
+        for url in self.categories_urls:
+            jobs.append(self.spawn(self.parse_category(url)))
+
+        await asyncio.gather(*jobs)
+
+        logger.debug('Закончен парсинг. Найдено %s телефонов.', len(self.list_phones))
+
+    async def parse_category(self, url):
+        """Корутина разбирает страницы категории объявлений
+
+        :param url: корень категории (первая страница)
+
+        """
+
+        logger.info('Адрес категории: %s.', url)
+
+        try:
+            # Номер последней страницы в категории объявлений
+            with self.metrics.stage(STAGE_LAST_PAGE):
+                last_page_category = await self.get_last_page_category(url)
+            logger.debug('Номер последней страницы в категории объявлений %s: %s.', url, last_page_category)
+
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return
+
+        end_page = min(self.get_end_page(), last_page_category)
+
+        pages = [self.spawn(self.parse_category_page(url, page)) for page in range(self.start_page, end_page + 1)]
+        await asyncio.gather(*pages)
+
+    async def parse_category_page(self, url, page):
+        """Корутина разбирает объявления страницы категории
+
+        :param url: корень категории (первая страница)
+        :param page: номер страницы категории
+
+        """
+
+        try:
+            url_page_cat = self.get_url_page_category(url, page)
+
+            logger.debug('Начинаю парсинг %s страницы категории: %s.', page, url_page_cat)
+
+            urls_ad = await self.get_list_ad_from_category(url_page_cat)
+            logger.info('Найдено адресов объявлений: %s (%s).', len(urls_ad), url_page_cat)
+
+            await self.parse_ad_urls(urls_ad, self.need_phones, url_page_cat)
+            self.checkpoint_sink()
+
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    async def parse_ad_urls(self, ad_urls, need_phones, category_url=None):
+        """Корутина одновременно парсит список адресов объявлений и
+        заполняет список номеров телефонов self.list_phones
+
+        :param ad_urls: список адресов объявлений
+        :param need_phones: количество нужных телефонов
+        :param category_url: адрес страницы категории, на которой найдены объявления
+
+        """
+
+        tasks = []
+
+        for url in ad_urls:
+            url = self.mark_visited(url)
+            if url is None:
+                continue
+
+            tasks.append(self.spawn(self.parse_ad(url, need_phones, category_url)))
+
+        await asyncio.gather(*tasks)
+
+    async def parse_ad(self, url, need_phones, category_url=None):
+        """Корутина парсит объявление и добавляет его телефоны в self.list_phones
+
+        :param url: адрес объявления
+        :param need_phones: количество нужных телефонов
+        :param category_url: адрес страницы категории, на которой найдены объявления
+
+        """
+
+        logger.debug('Выполняю разбор объявления %s.', url)
+
+        try:
+            try:
+                ad_phones = await self.get_phones_ad(url)
+
+            except Exception as e:
+                self.set_ad_outcome(url, error=e)
+                raise
+
+            self.set_ad_outcome(url, ad_phones)
+
+            # Пока объявление парсилось, нужное количество телефонов могли уже набрать
+            if self._complete.is_set():
+                return
+
+            self.process_ad_phones(ad_phones, need_phones, url, category_url)
+
+        except NeedPhonesComplete:
+            self._complete.set()
+
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    async def fetch(self, url, post=None, resource=None):
+        """Корутина выполняет http-запрос (POST, если указан post, иначе GET), повторяя его
+        при сетевых ошибках, и возвращает HttpResponse. Если настроен кэш, ответ сначала
+        ищется в нем
+
+        :param url: адрес запроса
+        :param post: словарь с данными POST-запроса
+        :param resource: тип ресурса, от которого зависит время жизни ответа в кэше
+
+        """
+
+        method = 'GET' if post is None else 'POST'
+        resource = resource or RESOURCE_DEFAULT
+        cache = self.http.cache
+
+        if cache is not None:
+            rs = cache.get(method, url, post, resource)
+            if rs is not None:
+                logger.info('Ответ на запрос к %s, post=%s взят из кэша.', url, post)
+                self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_CACHE)
+                return rs
+
+        logger.info('Отправляю запрос к %s, post=%s.', url, post)
+
+        try:
+            with self.metrics.stage(resource):
+                rs = await self.request(method, url, post)
+
+        except Exception:
+            self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_ERROR)
+            raise
+
+        self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_OK)
+
+        if cache is not None and rs.code == 200:
+            cache.put(method, url, post, resource, rs)
+
+        return rs
+
+    async def request(self, method, url, post=None):
+        """Корутина выполняет запрос или, если архив http-клиента в режиме replay, берет ответ
+        из архива. В режиме record запрос и ответ сохраняются в архив
+
+        """
+
+        archive = self.http.archive
+
+        if archive is not None and archive.replaying:
+            rs, delay = archive.replay(method, url, post)
+            if delay:
+                await asyncio.sleep(delay)
+
+            return rs
+
+        started = time.monotonic()
+        rs = await self.send(method, url, post)
+
+        if archive is not None:
+            archive.record(method, url, post, None, rs, started, time.monotonic() - started)
+
+        return rs
+
+    async def send(self, method, url, post=None):
+        """Корутина выполняет запрос сессией aiohttp, повторяя его при сетевых ошибках"""
+
+        count = self.attempts_request
+
+        while True:
+            try:
+                async with self.session.request(method, url, data=post, proxy=self.proxy) as rs:
+                    body = await rs.text(errors='replace')
+                    rs = HttpResponse(str(rs.url), rs.status, body, rs.headers)
+                    break
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                count -= 1
+                logger.warning('Произошла ошибка "%s" (количество оставшихся попыток %s).', e, count)
+
+                if count <= 0:
+                    raise
+
+        return rs
+
+    async def fetch_category_page(self, url):
+        """Корутина загружает страницу категории, запоминая ее на время run (см. get_category_page)
+
+        :param url: адрес страницы категории
+
+        """
+
+        rs = self.page_memo.get(url)
+        if rs is None:
+            rs = await self.fetch(url, resource=RESOURCE_CATEGORY)
+            self.page_memo.put(url, rs)
+
+        return rs
+
+    @abstractmethod
+    async def get_list_ad_from_category(self, category_page_url):
+        """Корутина возвращает список адресов объявлений со страницы категории.
+
+        :param category_page_url: адрес страницы категорий
+
+        """
+
+    @abstractmethod
+    async def get_last_page_category(self, url):
+        """Корутина возвращает последний номер страницы категории объявлений.
+
+        :param url: Адрес страницы категорий
+
+        """
+
+    @abstractmethod
+    async def get_phones_ad(self, ad_url):
+        """Корутина возвращает список телефонов объявления."""
@@ -29,11 +29,23 @@ __author__ = 'ipetrash'
 
 
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os.path
 import re
 import yaml
 import time
-import logging
-import sys
+import threading
+
+from .bloom_filter import BloomVisitedStore, ScalableBloomFilter
+from .http_archive import HttpArchive
+from .http_cache import HttpCache, RESOURCE_CATEGORY
+from .http_client import HttpClient
+from .log import get_logger, configure_logging
+from .metrics import (MetricsRegistry, ADS_TOTAL, PHONES_TOTAL, STAGE_LAST_PAGE, STAGE_NORMALIZE,
+                      STAGE_SINK)
+from .page_memo import PageMemo, canonical_url
+from .phone_sink import create_phone_sink
+from .visited_store import MemoryVisitedStore, SqliteVisitedStore, get_outcome
 
 
 # Отправляется, когда нужное количество телефонов набрано
@@ -41,33 +53,11 @@ class NeedPhonesComplete(Exception):
     pass
 
 
-# TODO: предусмотреть настройку логера для вывода в консоль и в файл
-# TODO: сделать на примере dict из http://docs.python-guide.org/en/latest/writing/logging/
-
-
-def get_logger(name, file='log.txt', encoding='utf8'):
-    log = logging.getLogger(name)
-    log.setLevel(logging.DEBUG)
-
-    formatter = logging.Formatter('%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s')
-
-    fh = logging.FileHandler(file, encoding=encoding)
-    fh.setLevel(logging.DEBUG)
-
-    ch = logging.StreamHandler(stream=sys.stdout)
-    # ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-
-    log.addHandler(fh)
-    log.addHandler(ch)
-
-    return log
+logger = get_logger('asaparser')
 
 
-logger = get_logger('asaparser')
+# Начальная емкость фильтра неканонических форм адресов объявлений, встреченных за запуск
+AD_URL_FORMS_CAPACITY = 10000
 
 
 class AbstractSiteAdParser(metaclass=ABCMeta):
@@ -92,8 +82,8 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
         # Список найденных парсером телефонов
         self.list_phones = set()
 
-        # Список посещенных страниц объявлений
-        self.visited_ad_urls = []
+        # Посещенные страницы объявлений (хранилище из visited_store, настраивается секцией visited конфига)
+        self.visited_ad_urls = MemoryVisitedStore()
 
         # Адреса отдельных объявлений
         self.ad_urls = []
@@ -118,14 +108,61 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
         # Режим открытия файла (w -- перезапись, a -- добавление в конец)
         self.out_mode = None
 
+        # Потоковая запись найденных телефонов в файл out (PhoneSink, None -- если файл не указан)
+        self.sink = None
+
         # Количество телефонов, которые нужно набрать
         self.need_phones = None
 
+        # Количество потоков, в которых параллельно разбираются объявления (None или 1 -- по очереди)
+        self.max_workers = None
+
+        # Размер очередей конвейера разбора категорий (используется, если max_workers больше 1)
+        self.queue_size = None
+
+        # Настройки прокси, через которую выполняются запросы
+        self.proxy_url = None
+        self.proxy_type = None
+        self.proxy_enabled = None
+
+        # Метрики парсера: количество и время этапов парсинга (см. metrics)
+        self.metrics = MetricsRegistry({'site': type(self).__name__})
+
+        # Файлы, в которые в конце run сохраняются метрики, и через сколько секунд логируется строка прогресса
+        self.metrics_json_file = None
+        self.metrics_prometheus_file = None
+        self.progress_interval = None
+        self._last_progress = time.monotonic()
+
+        # Http-клиент с пулом соединений, через который наследники выполняют запросы
+        self.http = HttpClient(metrics=self.metrics)
+
+        # Кэш http-ответов на диске (HttpCache), None -- если кэш выключен в конфиге
+        self.cache = None
+
+        # Архив http-запросов (HttpArchive), None -- если архив выключен в конфиге
+        self.archive = None
+
+        # Загруженные за время run страницы категорий: корень категории, загруженный
+        # в get_last_page_category, используется повторно как первая страница категории
+        self.page_memo = PageMemo()
+
+        # Количество объявлений, которые отличались от уже найденных только формой адреса
+        # и не были загружены повторно благодаря canonical_ad_url
+        self.canonical_duplicates = 0
+
+        # Неканонические формы адресов объявлений, встреченные за время run. Хранятся в фильтре Блума
+        # (несколько байт на адрес), поэтому память почти не растет и при миллионах объявлений
+        self.ad_url_forms = ScalableBloomFilter(initial_capacity=AD_URL_FORMS_CAPACITY)
+
+        # Блокировка для изменения list_phones и visited_ad_urls из нескольких потоков
+        self.lock = threading.RLock()
+
     def process_config(self, file_name):
         """Функция обрабатывает конфиг, инициализирует поля парсера от параметров конфига"""
 
         stream = open(file_name, encoding='utf8')
-        self.config = yaml.load(stream)
+        self.config = yaml.safe_load(stream)
 
         # Из файла конфига добавляем в парсер список адресов объявлений
         ad_urls = self.config['ad_urls']
@@ -146,25 +183,87 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
             self.categories_urls += cat_urls
 
         self.need_phones = self.config['need_phones']
+        self.max_workers = self.config['max_workers']
+        self.queue_size = self.config['queue_size']
+
+        # Настройка хранилища посещенных объявлений
+        visited = self.config['visited']
+        if visited['store'] == 'sqlite':
+            self.visited_ad_urls = SqliteVisitedStore(visited['file_name'], type(self).__name__,
+                                                      visited['revisit_after'])
+        elif visited['store'] == 'bloom':
+            self.visited_ad_urls = BloomVisitedStore(visited['bloom_file_name'], visited['error_rate'],
+                                                     visited['initial_capacity'], visited['bloom_outcomes'])
+        else:
+            self.visited_ad_urls = MemoryVisitedStore()
+
+        # Настройка прокси и http-клиента
+        proxy = self.config['proxy']
+        self.proxy_url = proxy['url']
+        self.proxy_type = proxy['type']
+        self.proxy_enabled = proxy['enabled']
+
+        # Настройка архива http-запросов
+        archive = self.config['archive']
+        self.archive = None
+        if archive['mode']:
+            self.archive = HttpArchive(archive['file_name'], archive['mode'], archive['latency'],
+                                       archive['ignore_params'])
+
+        # Настройка кэша http-ответов. С архивом кэш не используется: он отдавал бы часть ответов
+        # мимо архива -- при записи они не попали бы в архив, а воспроизведения отличались бы друг от друга
+        cache = self.config['cache']
+        self.cache = None
+        if cache['enabled'] and self.archive is not None:
+            logger.warning('Включен архив http-запросов, кэш http-ответов не используется.')
+
+        elif cache['enabled']:
+            self.cache = HttpCache(
+                os.path.join(cache['dir'], 'http.sqlite'),
+                max_size=cache['max_size_mb'] * 1024 * 1024,
+                ttl=cache['ttl'],
+                offline=cache['offline'],
+            )
+
+        http = self.config['http']
+        self.http = HttpClient(
+            pool_size=http['pool_size'],
+            hosts_pool_size=http['hosts_pool_size'],
+            attempts=http['attempts'],
+            proxy_url=self.proxy_url,
+            proxy_type=self.proxy_type,
+            proxy_enabled=self.proxy_enabled,
+            cache=self.cache,
+            metrics=self.metrics,
+            archive=self.archive,
+        )
+
+        metrics = self.config['metrics']
+        self.metrics_json_file = metrics['json_file']
+        self.metrics_prometheus_file = metrics['prometheus_file']
+        self.progress_interval = metrics['progress_interval']
 
         # Настройка файла, в котором сохраняются результаты парсинга
         out = self.config['out']
         self.out = out['file_name']
         self.out_mode = out['mode']
 
-        # # Настройка логирования
-        # log = self.config['log']
-        # # Файл, в котором логируются события скрипта
-        # log['out']
-        # # Формат логированных сообщений
-        # log['format']
-        #
-        # logger.disable(logging.NOTSET if log['enabled'] else logging.CRITICAL)
+        self.sink = None
+        if self.out:
+            self.sink = create_phone_sink(out['format'], self.out, self.out_mode, type(self).__name__,
+                                          out['batch_size'], out['flush_interval'])
+
+        # Настройка логирования
+        configure_logging(self.config['log'])
 
     def run(self):
         """Функция запускает парсинг сайта"""
 
-        t = time.clock()
+        t = time.perf_counter()
+
+        self.page_memo.clear()
+        self.canonical_duplicates = 0
+        self.ad_url_forms = ScalableBloomFilter(initial_capacity=AD_URL_FORMS_CAPACITY)
 
         try:
             if self.ad_urls:
@@ -174,116 +273,350 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
 
             logger.debug('Начинаю парсить категории объявлений (%s).', len(self.categories_urls))
 
-            for url in self.categories_urls:
-                logger.info('Адрес категории: %s.', url)
+            if self.max_workers is not None and self.max_workers > 1:
+                # Страницы категорий и объявления разбираются одновременно
+                from .pipeline import CategoryPipeline
+
+                pipeline = CategoryPipeline(self, self.max_workers, self.queue_size)
+                pipeline.run(self.categories_urls, self.need_phones)
+            else:
+                self.parse_categories_urls(self.categories_urls, self.need_phones)
+
+            logger.debug('Закончен парсинг категорий объявлений. Найдено %s телефонов.', len(self.list_phones))
+
+        except NeedPhonesComplete:
+            pass
+
+        finally:
+            # Даже если парсер упал, найденные телефоны и посещенные объявления должны остаться в файлах
+            self.checkpoint_sink()
+            self.visited_ad_urls.flush()
+
+        # TODO: больше статистики: сколько была найдено объявлений
+        logger.debug('Время выполнения парсера %.3f секунд.', time.perf_counter() - t)
+        logger.info('Найдено %s телефонов.', len(self.list_phones))
+        logger.info('Телефоны: %s.', self.list_phones if len(self.list_phones) else 'нет')
+
+        self.log_stats()
+        self.save_metrics()
+
+    def log_stats(self):
+        """Функция логирует статистику работы парсера, вызывается в конце run"""
+
+        logger.info('Итог: %s.', self.metrics.get_progress())
+
+        logger.info('Повторных загрузок страниц категорий избежано: %s.', self.page_memo.hits)
+        logger.info('Повторных загрузок объявлений с другой формой адреса избежано: %s.', self.canonical_duplicates)
+
+        if self.cache is not None:
+            self.cache.log_stats()
+
+        if self.archive is not None:
+            self.archive.log_stats()
+
+    def save_metrics(self):
+        """Функция сохраняет метрики в файлы из секции metrics конфига"""
+
+        self.metrics.save(self.metrics_json_file, self.metrics_prometheus_file)
+
+    def log_progress(self):
+        """Функция логирует строку прогресса, если с прошлой прошло progress_interval секунд"""
+
+        if not self.progress_interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            if now - self._last_progress < self.progress_interval:
+                return
+
+            self._last_progress = now
+
+        logger.info('Прогресс: %s.', self.metrics.get_progress())
+
+    def checkpoint_sink(self):
+        """Функция записывает на диск телефоны, найденные к этому моменту"""
+
+        if self.sink is not None:
+            self.sink.checkpoint()
+
+    def get_category_page(self, url):
+        """Функция загружает страницу категории и возвращает HttpResponse. Страница запоминается
+        на время run, поэтому get_last_page_category и get_list_ad_from_category, получая
+        страницы через эту функцию, загружают корень категории только один раз
 
-                # Если последняя страница указана и она меньше или равна стартовой
-                if self.end_page is not None and self.end_page >= self.start_page:
-                    end_page = self.end_page
+        :param url: адрес страницы категории
 
-                # Если указано максимальное количество страниц и оно больше или равно 1
-                elif self.max_page is not None and self.max_page >= 1:
-                    end_page = self.start_page + self.max_page - 1
-                else:
-                    end_page = self.start_page
+        """
+
+        rs = self.page_memo.get(url)
+        if rs is None:
+            rs = self.http.go(url, resource=RESOURCE_CATEGORY)
+            self.page_memo.put(url, rs)
+
+        return rs
+
+    def parse_categories_urls(self, categories_urls, need_phones):
+        """Функция по очереди разбирает страницы категорий объявлений и их объявления
+
+        :param categories_urls: список адресов категорий
+        :param need_phones: количество нужных телефонов
+
+        """
+
+        end_page = self.get_end_page()
 
-                # Номер последней страницы в категории объявлений
+        for url in categories_urls:
+            logger.info('Адрес категории: %s.', url)
+
+            # Номер последней страницы в категории объявлений
+            with self.metrics.stage(STAGE_LAST_PAGE):
                 last_page_category = self.get_last_page_category(url)
-                logger.debug('Номер последней страницы в категории объявлений: {}.'.format(last_page_category))
+            logger.debug('Номер последней страницы в категории объявлений: %s.', last_page_category)
 
-                # Проходим по страницам данной категории
-                for page in range(self.start_page, end_page + 1):
-                    if page > last_page_category:
-                        logger.debug('Превышение максимального количества страниц (текущая страница %s, максимальная '
-                                     'страница %s).', page, last_page_category)
-                        break
+            # Проходим по страницам данной категории
+            for page in range(self.start_page, end_page + 1):
+                if page > last_page_category:
+                    logger.debug('Превышение максимального количества страниц (текущая страница %s, максимальная '
+                                 'страница %s).', page, last_page_category)
+                    break
 
-                    try:
-                        url_page_cat = self.get_url_page_category(url, page)
+                try:
+                    url_page_cat = self.get_url_page_category(url, page)
 
-                        logger.debug('Начинаю парсинг %s страницы категории: %s.', page, url_page_cat)
+                    logger.debug('Начинаю парсинг %s страницы категории: %s.', page, url_page_cat)
 
-                        # Получаем список адресов объявлений данной страницы категории объявлений
-                        # и парсим этот список
-                        urls_ad = self.get_list_ad_from_category(url_page_cat)
-                        logger.info('Найдено адресов объявлений: %s.', len(urls_ad))
+                    # Получаем список адресов объявлений данной страницы категории объявлений
+                    # и парсим этот список
+                    urls_ad = list(self.get_list_ad_from_category(url_page_cat))
+                    logger.info('Найдено адресов объявлений: %s.', len(urls_ad))
 
-                        self.parse_ad_urls(urls_ad, self.need_phones)
+                    self.parse_ad_urls(urls_ad, need_phones, url_page_cat)
+                    self.checkpoint_sink()
 
-                        logger.debug('Закончен парсинг страницы категории.')
+                    logger.debug('Закончен парсинг страницы категории.')
 
-                    except NeedPhonesComplete:
-                        # Пробрасываем выше -- там ожидается это исключение
-                        raise
+                except NeedPhonesComplete:
+                    # Пробрасываем выше -- там ожидается это исключение
+                    raise
 
-                    except Exception as e:
-                        logger.error(e, exc_info=True)
+                except Exception as e:
+                    logger.error(e, exc_info=True)
 
-            logger.debug('Закончен парсинг категорий объявлений. Найдено %s телефонов.', len(self.list_phones))
+    def get_end_page(self):
+        """Функция возвращает номер последней страницы категории, которую нужно распарсить,
+        учитывая настройки start_page, end_page и max_page
 
-        except NeedPhonesComplete:
-            pass
+        """
 
-        # TODO: больше статистики: сколько была найдено объявлений
-        logger.debug('Время выполнения парсера {0:.3f} секунд.'.format(time.clock() - t))
-        logger.info('Найдено %s телефонов.', len(self.list_phones))
-        logger.info('Телефоны: %s.', self.list_phones if len(self.list_phones) else 'нет')
+        # Если последняя страница указана и она меньше или равна стартовой
+        if self.end_page is not None and self.end_page >= self.start_page:
+            return self.end_page
+
+        # Если указано максимальное количество страниц и оно больше или равно 1
+        if self.max_page is not None and self.max_page >= 1:
+            return self.start_page + self.max_page - 1
 
-    def parse_ad_urls(self, ad_urls, need_phones):
+        return self.start_page
+
+    def parse_ad_urls(self, ad_urls, need_phones, category_url=None):
         """Функция принимает список адресов объявлений, парсит его и
         заполняет список номеров телефонов self.list_phones
 
+        Если в конфиге max_workers больше 1, объявления разбираются параллельно в пуле потоков.
+
         :param ad_urls: список адресов объявлений
         :param need_phones: количество нужных телефонов
+        :param category_url: адрес страницы категории, на которой найдены объявления
 
         """
 
+        if self.max_workers is not None and self.max_workers > 1:
+            self.parse_ad_urls_in_pool(ad_urls, need_phones, category_url)
+            return
+
         for url in ad_urls:
             try:
-                if url in self.visited_ad_urls:
-                    logger.info('Объявление {} уже было распарсено.'.format(url))
+                url = self.mark_visited(url)
+                if url is None:
+                    continue
+
+                logger.debug('Выполняю разбор объявления %s.', url)
+
+                try:
+                    ad_phones = self.get_phones_ad(url)
+
+                except Exception as e:
+                    self.set_ad_outcome(url, error=e)
+                    raise
+
+                self.set_ad_outcome(url, ad_phones)
+                self.process_ad_phones(ad_phones, need_phones, url, category_url)
+
+            except NeedPhonesComplete:
+                # Пробрасываем выше -- там ожидается это исключение
+                raise
+
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+    def parse_ad_urls_in_pool(self, ad_urls, need_phones, category_url=None):
+        """Функция разбирает объявления в пуле из self.max_workers потоков: в потоках выполняется
+        get_phones_ad, а телефоны обрабатываются по мере завершения задач. Когда набрано нужное
+        количество телефонов, еще не начатые задачи отменяются и пробрасывается NeedPhonesComplete
+
+        :param ad_urls: список адресов объявлений
+        :param need_phones: количество нужных телефонов
+        :param category_url: адрес страницы категории, на которой найдены объявления
+
+        """
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        # Словарь задача -> адрес объявления
+        futures = dict()
+
+        try:
+            for url in ad_urls:
+                url = self.mark_visited(url)
+                if url is None:
                     continue
 
                 logger.debug('Выполняю разбор объявления %s.', url)
-                self.visited_ad_urls.append(url)
+                futures[executor.submit(self.get_phones_ad, url)] = url
 
-                ad_phones = self.get_phones_ad(url)
-                logger.info('Найдено %s телефонов.', len(ad_phones))
+            for future in as_completed(futures):
+                url = futures[future]
 
-                for phone in ad_phones:
+                try:
                     try:
-                        if phone in self.list_phones:
-                            logger.info('Телефон "%s" уже есть в списке.', phone)
-                        else:
+                        ad_phones = future.result()
+
+                    except Exception as e:
+                        self.set_ad_outcome(url, error=e)
+                        raise
+
+                    self.set_ad_outcome(url, ad_phones)
+                    self.process_ad_phones(ad_phones, need_phones, url, category_url)
+
+                except NeedPhonesComplete:
+                    # Пробрасываем выше -- там ожидается это исключение
+                    raise
+
+                except Exception as e:
+                    logger.error('Ошибка разбора объявления %s: %s', url, e, exc_info=True)
+
+        finally:
+            # Отменяем задачи, которые еще не начали выполняться, и ждем завершения выполняющихся
+            for future in futures:
+                future.cancel()
+
+            executor.shutdown(wait=True)
+
+    def canonical_ad_url(self, url):
+        """Функция приводит адрес объявления к каноническому виду, чтобы одно объявление,
+        найденное по разным адресам, разбиралось один раз. По умолчанию отбрасывается
+        фрагмент (#...) и нормализуется хост, наследники добавляют правила своего сайта
+
+        """
+
+        return canonical_url(url)
+
+    def mark_visited(self, url):
+        """Функция приводит адрес объявления к каноническому виду и отмечает его в хранилище
+        посещенных. Возвращает канонический адрес, который нужно разбирать, или None, если
+        объявление уже было распарсено (или, для хранилища sqlite, распарсено недавно)
+
+        """
+
+        ad_url = self.canonical_ad_url(url)
+
+        # Повтор считается избежанным благодаря canonical_ad_url, только если адрес отличается
+        # от канонического и в такой форме за этот запуск еще не встречался: тот же адрес
+        # отсеялся бы и без приведения
+        new_form = False
+        if url != ad_url:
+            with self.lock:
+                new_form = self.ad_url_forms.add(url)
+
+        if not self.visited_ad_urls.add(ad_url):
+            if new_form:
+                with self.lock:
+                    self.canonical_duplicates += 1
+
+            logger.info('Объявление %s уже было распарсено.', url)
+            return
+
+        return ad_url
+
+    def set_ad_outcome(self, url, ad_phones=None, error=None):
+        """Функция запоминает в хранилище посещенных объявлений результат разбора объявления
+
+        :param url: адрес объявления
+        :param ad_phones: найденные телефоны
+        :param error: исключение, если при разборе произошла ошибка
+
+        """
+
+        outcome = get_outcome(ad_phones, error)
+        self.visited_ad_urls.set_outcome(url, outcome)
+
+        self.metrics.inc(ADS_TOTAL, outcome=outcome)
+        self.log_progress()
+
+    def process_ad_phones(self, ad_phones, need_phones, ad_url=None, category_url=None):
+        """Функция обрабатывает телефоны объявления и добавляет новые в self.list_phones.
+        Если набрано нужное количество телефонов, бросает исключение NeedPhonesComplete
+
+        :param ad_phones: список телефонов объявления
+        :param need_phones: количество нужных телефонов
+        :param ad_url: адрес объявления (сохраняется вместе с телефонами в файле результатов)
+        :param category_url: адрес страницы категории, на которой найдено объявление
+
+        """
+
+        logger.info('Найдено %s телефонов.', len(ad_phones))
+
+        for phone in ad_phones:
+            try:
+                with self.lock:
+                    if phone in self.list_phones:
+                        logger.info('Телефон "%s" уже есть в списке.', phone)
+                    else:
+                        raw_phone = phone
+                        with self.metrics.stage(STAGE_NORMALIZE):
                             phone = self.processing_phones(phone)
-                            self.list_phones.add(phone)
 
-                            logger.info('Номер телефона: %s.', phone)
+                        self.list_phones.add(phone)
+                        self.metrics.inc(PHONES_TOTAL)
 
-                            # Если need_phones указано и набрано нужное количество телефонов
-                            if isinstance(need_phones, int) and need_phones == len(self.list_phones):
-                                logger.info('Найдено нужное количество телефонов.')
-                                raise NeedPhonesComplete()
+                        if self.sink is not None:
+                            with self.metrics.stage(STAGE_SINK):
+                                self.sink.write(phone, raw_phone, ad_url, category_url)
 
-                    except NeedPhonesComplete:
-                        # Пробрасываем выше -- там ожидается это исключение
-                        raise
+                        logger.info('Номер телефона: %s.', phone)
 
-                    except Exception as e:
-                        logger.error(str(e) + '\n', exc_info=True)
+                        # Если need_phones указано и набрано нужное количество телефонов
+                        if isinstance(need_phones, int) and need_phones == len(self.list_phones):
+                            logger.info('Найдено нужное количество телефонов.')
+                            raise NeedPhonesComplete()
 
             except NeedPhonesComplete:
                 # Пробрасываем выше -- там ожидается это исключение
                 raise
 
             except Exception as e:
-                logger.error(e, exc_info=True)
+                logger.error(str(e) + '\n', exc_info=True)
 
     def save(self, out=None, mode=None):
         """Функция сохранения найденных номеров в файл out.
         Если вызывать функцию без параметров, то файл будет браться из
         параметра конфига out
 
+        Телефоны из конфига уже записаны в файл во время run, поэтому для него функция
+        только дописывает остаток буфера и закрывает файл. В другой файл (out) записываются
+        все найденные телефоны.
+
         :param out: путь к файлу конфига
 
         """
@@ -292,20 +625,23 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
         if out is not None:
             file_name = out
 
-        if file_name:
-            logger.debug('Сохраняю номера телефонов в файл: %s.', file_name)
+        out_mode = self.out_mode
+        if mode is not None:
+            out_mode = mode
 
-            out_mode = self.out_mode
-            if mode is not None:
-                out_mode = mode
+        if not file_name:
+            raise Exception('Не указано имя файла (out и self.out).')
 
-            # TODO: настройка сохранения файла: создать новый / переписать или добавлять в конец
-            with open(file_name, mode=out_mode) as f:
-                for phone in self.list_phones:
-                    f.write(phone + '\n')
+        if self.sink is not None and file_name == self.sink.file_name:
+            logger.debug('Дописываю номера телефонов в файл: %s.', file_name)
+            self.sink.close()
+            return
 
-        else:
-            raise Exception('Не указано имя файла (out и self.out).')
+        logger.debug('Сохраняю номера телефонов в файл: %s.', file_name)
+
+        with open(file_name, mode=out_mode) as f:
+            for phone in self.list_phones:
+                f.write(phone + '\n')
 
     @abstractmethod
     def get_url_page_category(self, url, page):
@@ -319,6 +655,8 @@ class AbstractSiteAdParser(metaclass=ABCMeta):
     @abstractmethod
     def get_list_ad_from_category(self, category_page_url):
         """Функция возвращает список адресов объявлений со страницы категории.
+        Функция может быть генератором -- тогда объявления начнут разбираться
+        сразу, как только будут найдены.
 
         :param category_page_url: адрес страницы категорий
 
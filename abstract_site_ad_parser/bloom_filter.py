@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+import hashlib
+import math
+import os
+import struct
+import threading
+
+from .visited_store import OUTCOME_PHONE, OUTCOME_NONE
+
+
+# Сигнатура и версия формата файла фильтра
+FILE_MAGIC = b'SBF1'
+
+# Во сколько раз растет емкость каждого следующего фильтра
+GROWTH = 2
+
+# Во сколько раз уменьшается вероятность ложного срабатывания каждого следующего фильтра
+TIGHTENING_RATIO = 0.5
+
+
+def get_hashes(item):
+    """Функция возвращает два 64-битных хэша строки, из которых строятся индексы битов фильтра"""
+
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+    return struct.unpack('<QQ', digest)
+
+
+class BloomFilter:
+    """Фильтр Блума фиксированной емкости"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # Количество бит и хэш-функций, при которых на capacity элементов
+        # вероятность ложного срабатывания будет error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def indexes(self, hashes):
+        h1, h2 = hashes
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def contains(self, hashes):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self.indexes(hashes))
+
+    def add(self, hashes):
+        bits = self.bits
+        for i in self.indexes(hashes):
+            bits[i >> 3] |= 1 << (i & 7)
+
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """Масштабируемый фильтр Блума (Almeida et al., "Scalable Bloom Filters").
+
+    Когда очередной фильтр заполняется, добавляется новый, в GROWTH раз больше
+    и с более строгой вероятностью ложного срабатывания, поэтому общая вероятность
+    ложного срабатывания не превышает error_rate при любом количестве элементов.
+    Память на элемент -- около 1.44 * log2(1 / error_rate) бит (для 0.001 -- около 2 байт)
+    вместо сотен байт на строку адреса.
+
+    """
+
+    def __init__(self, error_rate=0.001, initial_capacity=100000):
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.filters = []
+
+    def __contains__(self, item):
+        hashes = get_hashes(item)
+        return any(f.contains(hashes) for f in self.filters)
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def add(self, item):
+        """Функция добавляет элемент. Возвращает False, если элемент (возможно) уже был"""
+
+        hashes = get_hashes(item)
+        if any(f.contains(hashes) for f in self.filters):
+            return False
+
+        if not self.filters or self.filters[-1].is_full:
+            i = len(self.filters)
+            capacity = self.initial_capacity * GROWTH ** i
+            error_rate = self.error_rate * (1 - TIGHTENING_RATIO) * TIGHTENING_RATIO ** i
+            self.filters.append(BloomFilter(capacity, error_rate))
+
+        self.filters[-1].add(hashes)
+        return True
+
+    @property
+    def size_in_bytes(self):
+        return sum(len(f.bits) for f in self.filters)
+
+    def save(self, file_name):
+        """Функция сохраняет фильтр в бинарный файл. Файл сначала пишется во временный,
+        поэтому при падении во время записи старый файл не портится
+
+        """
+
+        tmp_file_name = file_name + '.tmp'
+
+        with open(tmp_file_name, 'wb') as f:
+            f.write(FILE_MAGIC)
+            f.write(struct.pack('<dQI', self.error_rate, self.initial_capacity, len(self.filters)))
+
+            for bf in self.filters:
+                f.write(struct.pack('<dQQQI', bf.error_rate, bf.capacity, bf.count, bf.num_bits, bf.num_hashes))
+                f.write(bf.bits)
+
+        os.replace(tmp_file_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """Функция загружает фильтр из файла, сохраненного функцией save"""
+
+        with open(file_name, 'rb') as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise Exception('Файл "{}" не является файлом фильтра Блума.'.format(file_name))
+
+            error_rate, initial_capacity, number = struct.unpack('<dQI', f.read(struct.calcsize('<dQI')))
+            sbf = cls(error_rate, initial_capacity)
+
+            header_size = struct.calcsize('<dQQQI')
+
+            for _ in range(number):
+                bf_error_rate, capacity, count, num_bits, num_hashes = struct.unpack('<dQQQI', f.read(header_size))
+
+                bf = BloomFilter(capacity, bf_error_rate)
+                bf.count = count
+                bf.num_bits = num_bits
+                bf.num_hashes = num_hashes
+                bf.bits = bytearray(f.read((num_bits + 7) // 8))
+                sbf.filters.append(bf)
+
+        return sbf
+
+
+class BloomVisitedStore:
+    """Хранилище посещенных объявлений на масштабируемом фильтре Блума.
+
+    Занимает несколько байт на объявление и сохраняется между запусками в бинарный файл.
+    С вероятностью error_rate новое объявление будет принято за посещенное и пропущено.
+    Время посещения не хранится, поэтому повторно объявления с окончательным результатом
+    разбора не разбираются.
+
+    Во время запуска объявления отмечаются во втором фильтре Блума в памяти (адреса не хранятся,
+    поэтому память не растет с количеством адресов), а в сохраняемый фильтр попадают только
+    после окончательного результата разбора (outcomes, по умолчанию телефон найден или его нет).
+    Объявления с ошибкой, не разобранные из-за остановки парсера (набрано need_phones, падение)
+    в фильтр не попадают и будут разобраны при следующем запуске -- как объявления без результата
+    в SqliteVisitedStore.
+
+    """
+
+    def __init__(self, file_name, error_rate=0.001, initial_capacity=100000, outcomes=(OUTCOME_PHONE, OUTCOME_NONE)):
+        self.file_name = file_name
+        self.outcomes = set(outcomes)
+        self._lock = threading.Lock()
+
+        if file_name and os.path.exists(file_name):
+            self.filter = ScalableBloomFilter.load(file_name)
+        else:
+            self.filter = ScalableBloomFilter(error_rate, initial_capacity)
+
+        # Фильтр объявлений, отмеченных за этот запуск, и количество тех из них, что еще не попали
+        # в сохраняемый фильтр
+        self._run_filter = ScalableBloomFilter(error_rate, initial_capacity)
+        self._unsaved = 0
+
+    def add(self, url):
+        with self._lock:
+            if url in self.filter or not self._run_filter.add(url):
+                return False
+
+            self._unsaved += 1
+            return True
+
+    def set_outcome(self, url, outcome):
+        if outcome not in self.outcomes:
+            return
+
+        with self._lock:
+            if self.filter.add(url) and self._unsaved > 0:
+                self._unsaved -= 1
+
+    def flush(self):
+        if not self.file_name:
+            return
+
+        dir_name = os.path.dirname(self.file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        with self._lock:
+            self.filter.save(self.file_name)
+
+    def __contains__(self, url):
+        return url in self._run_filter or url in self.filter
+
+    def __len__(self):
+        return len(self.filter) + self._unsaved
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from .http_cache import get_request_key
+from .http_response import HttpResponse
+from .log import get_logger
+
+
+logger = get_logger('asaparser_http_archive')
+
+
+# Режимы архива
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+MODES = [MODE_RECORD, MODE_REPLAY]
+
+# Параметры адреса, которые не учитываются при поиске запроса в архиве: случайные числа против
+# кэширования, например rand у запроса телефона barahla.net (/ajax/getPhones.php?rand=0.123)
+DEFAULT_IGNORE_PARAMS = ('rand', '_')
+
+
+class ArchiveMissError(Exception):
+    """Отправляется в режиме replay, если запроса нет в архиве"""
+
+
+def strip_params(url, params):
+    """Функция убирает из адреса параметры запроса params"""
+
+    if not params:
+        return url
+
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in params]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class HttpArchive:
+    """Архив http-запросов для воспроизводимых запусков парсера без сети.
+
+    В режиме record каждый выполненный запрос (метод, адрес, тело POST-запроса, заголовки)
+    сохраняется вместе с ответом и временем ответа в базу sqlite, тело ответа и заголовки
+    сжимаются zlib. Архив перезаписывается при каждом запуске в режиме record.
+
+    В режиме replay запросы в сеть не выполняются: ответ ищется в архиве по тому же ключу,
+    что и в кэше (метод + адрес + тело запроса), только из адреса убираются параметры ignore_params,
+    значения которых меняются от запуска к запуску. Если один запрос выполнялся несколько раз
+    (например, повторные запросы телефона после ответа с ошибкой), ответы возвращаются в порядке
+    записи, а после последнего повторяется последний. Время ответа можно воспроизводить:
+    ответ задерживается на записанное время, умноженное на latency (0 -- без задержки).
+
+    """
+
+    def __init__(self, file_name, mode, latency=0.0, ignore_params=DEFAULT_IGNORE_PARAMS):
+        if mode not in MODES:
+            raise Exception('Неизвестный режим архива http-запросов "{}", допустимые: {}.'.format(
+                mode, ', '.join(MODES)))
+
+        self.file_name = file_name
+        self.mode = mode
+        self.latency = latency or 0.0
+        self.ignore_params = set(ignore_params or [])
+
+        # Статистика: сколько запросов записано, воспроизведено и не найдено в архиве
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        if self.mode == MODE_REPLAY and not os.path.exists(file_name):
+            raise Exception('Нет файла архива http-запросов для воспроизведения: {}.'.format(file_name))
+
+        dir_name = os.path.dirname(file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connect = sqlite3.connect(file_name, check_same_thread=False)
+        self._connect.execute('''
+            CREATE TABLE IF NOT EXISTS exchanges (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                method TEXT NOT NULL,
+                url TEXT NOT NULL,
+                post TEXT,
+                code INTEGER NOT NULL,
+                started REAL NOT NULL,
+                elapsed REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+
+        if self.mode == MODE_RECORD:
+            self._connect.execute('DELETE FROM exchanges')
+
+        self._connect.commit()
+
+        # Время начала записи, от него считается время отправки каждого запроса (started)
+        self._started = time.monotonic()
+
+        # Для воспроизведения: ключ запроса -> номера записей в порядке записи, и сколько из них уже отдано.
+        # Сами ответы читаются из базы по мере надобности, чтобы не держать архив в памяти
+        self._ids = dict()
+        self._positions = dict()
+
+        if self.mode == MODE_REPLAY:
+            for id_, key in self._connect.execute('SELECT id, key FROM exchanges ORDER BY id'):
+                self._ids.setdefault(key, []).append(id_)
+
+            logger.info('Архив http-запросов %s: %s запросов.', file_name, sum(map(len, self._ids.values())))
+
+    def get_key(self, method, url, post=None):
+        return get_request_key(method, strip_params(url, self.ignore_params), post)
+
+    @property
+    def recording(self):
+        return self.mode == MODE_RECORD
+
+    @property
+    def replaying(self):
+        return self.mode == MODE_REPLAY
+
+    def record(self, method, url, post, headers, rs, started, elapsed):
+        """Функция сохраняет запрос и ответ на него
+
+        :param started: время отправки запроса (time.monotonic())
+        :param elapsed: время ответа в секундах
+
+        """
+
+        if isinstance(post, dict):
+            post = urlencode(sorted(post.items()))
+
+        data = {'headers': dict(headers or {}), 'url': rs.url, 'response_headers': rs.headers, 'body': rs.body}
+        data = zlib.compress(json.dumps(data).encode('utf-8'))
+
+        with self._lock:
+            self._connect.execute(
+                'INSERT INTO exchanges (key, method, url, post, code, started, elapsed, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.get_key(method, url, post), method, url, post, rs.code, started - self._started, elapsed,
+                 data)
+            )
+            self._connect.commit()
+            self.recorded += 1
+
+    def replay(self, method, url, post=None):
+        """Функция возвращает записанный ответ на запрос и задержку ответа в секундах.
+        Если запроса нет в архиве, отправляет ArchiveMissError
+
+        """
+
+        key = self.get_key(method, url, post)
+
+        with self._lock:
+            ids = self._ids.get(key)
+            if not ids:
+                self.misses += 1
+                raise ArchiveMissError('Запроса {} {}, post={} нет в архиве {}.'.format(method, url, post,
+                                                                                       self.file_name))
+
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+
+            code, elapsed, data = self._connect.execute('SELECT code, elapsed, data FROM exchanges WHERE id = ?',
+                                                        (ids[min(position, len(ids) - 1)],)).fetchone()
+            self.replayed += 1
+
+        data = json.loads(zlib.decompress(data).decode('utf-8'))
+        rs = HttpResponse(data['url'], code, data['body'], data['response_headers'])
+        return rs, elapsed * self.latency
+
+    def close(self):
+        with self._lock:
+            self._connect.close()
+
+    def log_stats(self):
+        if self.recording:
+            logger.info('Архив http-запросов: записано %s запросов в %s.', self.recorded, self.file_name)
+        else:
+            logger.info('Архив http-запросов: воспроизведено %s запросов, не найдено в архиве %s '
+                        '(задержка ответов x%s).', self.replayed, self.misses, self.latency)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from urllib.parse import urlencode
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from .http_response import HttpResponse
+from .log import get_logger
+
+
+logger = get_logger('asaparser_http_cache')
+
+
+# Типы ресурсов, у каждого в конфиге свое время жизни в кэше
+RESOURCE_CATEGORY = 'category'
+RESOURCE_AD = 'ad'
+RESOURCE_PHONE = 'phone'
+RESOURCE_DEFAULT = 'default'
+
+
+class CacheMissError(Exception):
+    """Отправляется в режиме offline, если ответа на запрос нет в кэше"""
+
+
+def get_request_key(method, url, post=None):
+    """Функция возвращает ключ запроса в кэше: хэш от метода, адреса и тела запроса"""
+
+    if isinstance(post, dict):
+        post = urlencode(sorted(post.items()))
+
+    body_hash = hashlib.sha1((post or '').encode('utf-8')).hexdigest()
+    return hashlib.sha1('\n'.join((method, url, body_hash)).encode('utf-8')).hexdigest()
+
+
+class HttpCache:
+    """Кэш http-ответов на диске.
+
+    Ответы хранятся сжатыми zlib в базе sqlite по ключу: метод + адрес + хэш тела запроса.
+    У каждого типа ресурса (страница категории, объявление, запрос телефона) свое время
+    жизни ttl в секундах. Ответ ресурса с ttl 0 не берется из кэша, но все равно сохраняется,
+    иначе в режиме offline на его запрос всегда был бы промах. Когда размер кэша превышает
+    max_size байт, удаляются давно не использованные ответы.
+
+    В режиме offline запросы в сеть не выполняются: ответы берутся из кэша, даже
+    устаревшие и с ttl 0, а при отсутствии ответа отправляется CacheMissError.
+
+    """
+
+    def __init__(self, file_name, max_size, ttl, offline=False):
+        self.file_name = file_name
+        self.max_size = max_size
+        self.offline = offline
+
+        # Время жизни ответов по типам ресурсов: {тип ресурса: секунды}
+        self.ttl = dict(ttl)
+
+        # Статистика обращений к кэшу
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        dir_name = os.path.dirname(file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connect = sqlite3.connect(file_name, check_same_thread=False)
+        self._connect.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        self._connect.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._connect.commit()
+
+        self._size = self._connect.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get_ttl(self, resource):
+        return self.ttl.get(resource or RESOURCE_DEFAULT, self.ttl.get(RESOURCE_DEFAULT, 0))
+
+    def get(self, method, url, post=None, resource=None):
+        """Функция возвращает HttpResponse из кэша или None, если ответа нет или он устарел.
+        В режиме offline при отсутствии ответа отправляет CacheMissError
+
+        """
+
+        ttl = self.get_ttl(resource)
+        if not ttl and not self.offline:
+            return
+
+        key = get_request_key(method, url, post)
+
+        with self._lock:
+            row = self._connect.execute('SELECT created, data FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is not None and (self.offline or row[0] + ttl >= time.time()):
+                self._connect.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+                self._connect.commit()
+                self.hits += 1
+
+                data = json.loads(zlib.decompress(row[1]).decode('utf-8'))
+                return HttpResponse(data['url'], data['code'], data['body'], data['headers'])
+
+            self.misses += 1
+
+        if self.offline:
+            raise CacheMissError('Ответа на запрос {} {} нет в кэше (режим offline).'.format(method, url))
+
+    def put(self, method, url, post, resource, rs):
+        """Функция сохраняет ответ в кэш. Http-клиенты сохраняют только успешные ответы (код 200)"""
+
+        key = get_request_key(method, url, post)
+
+        data = {'url': rs.url, 'code': rs.code, 'body': rs.body, 'headers': rs.headers}
+        data = zlib.compress(json.dumps(data).encode('utf-8'))
+
+        now = time.time()
+
+        with self._lock:
+            row = self._connect.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+
+            self._connect.execute(
+                'INSERT OR REPLACE INTO responses (key, url, resource, created, accessed, size, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, resource or RESOURCE_DEFAULT, now, now, len(data), data)
+            )
+            self._size += len(data)
+
+            self.evict()
+            self._connect.commit()
+
+    def evict(self):
+        """Функция удаляет давно не использованные ответы, пока размер кэша больше max_size"""
+
+        if not self.max_size or self._size <= self.max_size:
+            return
+
+        rows = self._connect.execute('SELECT key, size FROM responses ORDER BY accessed')
+
+        keys = []
+        for key, size in rows:
+            if self._size <= self.max_size:
+                break
+
+            keys.append((key,))
+            self._size -= size
+
+        self._connect.executemany('DELETE FROM responses WHERE key = ?', keys)
+        self.evicted += len(keys)
+
+    def close(self):
+        with self._lock:
+            self._connect.close()
+
+    def log_stats(self):
+        total = self.hits + self.misses
+
+        logger.info('Кэш http-ответов: попаданий %s, промахов %s (%.1f%% попаданий), вытеснено %s, '
+                    'размер %.1f Мб.', self.hits, self.misses, 100.0 * self.hits / total if total else 0.0,
+                    self.evicted, self._size / 1024 / 1024)
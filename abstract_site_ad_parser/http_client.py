@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from contextlib import contextmanager
+from http.cookiejar import CookieJar
+from urllib.parse import urlsplit
+import threading
+import time
+
+from grab import Grab
+from grab.error import GrabNetworkError
+
+from .http_cache import RESOURCE_DEFAULT
+from .log import get_logger
+from .http_response import HttpResponse
+from .metrics import MetricsRegistry, REQUESTS_TOTAL, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_CACHE
+
+
+logger = get_logger('asaparser_http')
+
+
+class HttpClient:
+    """Http-клиент парсера с пулом соединений.
+
+    Для каждого хоста держится пул объектов Grab: объект после запроса не выбрасывается,
+    а возвращается в пул, поэтому следующие запросы к тому же хосту используют уже
+    открытое keep-alive соединение и TLS-сессию. Куки у объектов пула общие: перед запросом
+    объект получает куки хоста, а после запроса отдает полученные, поэтому кука сессии,
+    выданная одному объекту, видна остальным. Прокси настраивается один раз
+    при создании объекта Grab. Одновременно к хосту выполняется не больше запросов,
+    чем размер его пула, поэтому клиент можно использовать из нескольких потоков.
+
+    """
+
+    def __init__(self, pool_size=8, hosts_pool_size=None, attempts=5,
+                 proxy_url=None, proxy_type=None, proxy_enabled=False, cache=None, metrics=None,
+                 archive=None):
+        # Размер пула соединений для хоста по умолчанию
+        self.pool_size = pool_size
+
+        # Размеры пулов для отдельных хостов: {хост: размер пула}
+        self.hosts_pool_size = dict(hosts_pool_size) if hosts_pool_size else dict()
+
+        # Количество попыток выполнения запроса при сетевых ошибках
+        self.attempts = attempts
+
+        self.proxy_url = proxy_url
+        self.proxy_type = proxy_type
+        self.proxy_enabled = proxy_enabled
+
+        # Кэш ответов на диске (HttpCache), None -- без кэша
+        self.cache = cache
+
+        # Метрики: количество и время запросов по типам ресурсов
+        self.metrics = metrics or MetricsRegistry()
+
+        # Архив запросов (HttpArchive): запись запросов и ответов или их воспроизведение без сети,
+        # None -- запросы просто выполняются
+        self.archive = archive
+
+        # Пулы хостов: {хост: (семафор, список свободных объектов Grab, куки хоста)}
+        self._pools = dict()
+        self._lock = threading.Lock()
+
+    def get_pool(self, host):
+        """Функция возвращает пул хоста, создавая его при первом обращении"""
+
+        with self._lock:
+            pool = self._pools.get(host)
+            if pool is None:
+                size = self.hosts_pool_size.get(host, self.pool_size)
+                pool = threading.BoundedSemaphore(size), [], CookieJar()
+                self._pools[host] = pool
+
+            return pool
+
+    def create_grab(self):
+        """Функция создает и настраивает новый объект Grab"""
+
+        g = Grab()
+        if self.proxy_enabled:
+            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+
+        return g
+
+    @contextmanager
+    def acquire(self, url):
+        """Контекстный менеджер выдает объект Grab из пула хоста url с куками хоста и
+        после использования возвращает его обратно в пул, сохранив полученные куки
+
+        """
+
+        semaphore, idle, cookies = self.get_pool(urlsplit(url).netloc)
+
+        with semaphore:
+            with self._lock:
+                g = idle.pop() if idle else None
+
+            if g is None:
+                g = self.create_grab()
+
+            # Куки копируются под блокировкой: CookieJar нельзя обходить, пока в него пишет другой поток
+            with self._lock:
+                for cookie in cookies:
+                    g.cookies.cookiejar.set_cookie(cookie)
+
+            try:
+                yield g
+            finally:
+                with self._lock:
+                    for cookie in g.cookies.cookiejar:
+                        cookies.set_cookie(cookie)
+
+                    idle.append(g)
+
+    def go(self, url, post=None, resource=None, headers=None):
+        """Функция выполняет http-запрос (POST, если указан post, иначе GET), повторяя его
+        при сетевых ошибках, и возвращает HttpResponse. Если настроен кэш, ответ сначала
+        ищется в нем
+
+        :param url: адрес запроса
+        :param post: словарь с данными POST-запроса
+        :param resource: тип ресурса, от которого зависит время жизни ответа в кэше
+        (RESOURCE_CATEGORY, RESOURCE_AD, RESOURCE_PHONE из http_cache)
+        :param headers: словарь с дополнительными заголовками запроса, например Referer
+
+        """
+
+        method = 'GET' if post is None else 'POST'
+        resource = resource or RESOURCE_DEFAULT
+
+        if self.cache is not None:
+            rs = self.cache.get(method, url, post, resource)
+            if rs is not None:
+                logger.info('Ответ на запрос к %s, post=%s взят из кэша.', url, post)
+                self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_CACHE)
+                return rs
+
+        logger.info('Отправляю запрос к %s, post=%s.', url, post)
+
+        try:
+            with self.metrics.stage(resource):
+                rs = self.request(method, url, post, headers)
+
+        except Exception:
+            self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_ERROR)
+            raise
+
+        self.metrics.inc(REQUESTS_TOTAL, resource=resource, outcome=OUTCOME_OK)
+
+        if self.cache is not None and rs.code == 200:
+            self.cache.put(method, url, post, resource, rs)
+
+        return rs
+
+    def request(self, method, url, post=None, headers=None):
+        """Функция выполняет запрос или, если архив в режиме replay, берет ответ из архива.
+        В режиме record запрос и ответ сохраняются в архив
+
+        """
+
+        archive = self.archive
+
+        if archive is not None and archive.replaying:
+            rs, delay = archive.replay(method, url, post)
+            if delay:
+                time.sleep(delay)
+
+            return rs
+
+        started = time.monotonic()
+        rs = self.send(method, url, post, headers)
+
+        if archive is not None:
+            archive.record(method, url, post, headers, rs, started, time.monotonic() - started)
+
+        return rs
+
+    def send(self, method, url, post=None, headers=None):
+        """Функция выполняет запрос объектом Grab из пула, повторяя его при сетевых ошибках"""
+
+        count = self.attempts
+
+        with self.acquire(url) as g:
+            # Объект Grab вернется в пул, поэтому заголовки этого запроса после него сбрасываются
+            if headers:
+                g.setup(headers=headers)
+
+            try:
+                while True:
+                    try:
+                        if post is None:
+                            g.go(url)
+                        else:
+                            g.go(url, post=post)
+                        break
+
+                    except GrabNetworkError as e:
+                        count -= 1
+                        logger.warning('Произошла ошибка "%s" (количество оставшихся попыток %s).', e, count)
+
+                        if count <= 0:
+                            raise
+
+            finally:
+                if headers:
+                    g.setup(headers={})
+
+            rs = g.response
+            return HttpResponse(rs.url, rs.code, rs.unicode_body(), rs.headers)
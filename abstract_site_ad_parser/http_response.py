@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+import lxml.html
+
+
+class HttpResponse:
+    """Ответ на http-запрос, не зависящий от http-клиента, которым он был получен"""
+
+    def __init__(self, url, code, body, headers=None):
+        # Адрес, с которого пришел ответ (после всех редиректов)
+        self.url = url
+
+        # Код ответа
+        self.code = code
+
+        # Тело ответа в виде строки
+        self.body = body
+
+        # Заголовки ответа
+        self.headers = dict(headers) if headers else dict()
+
+        # Дерево html-документа, создается при первом обращении к self.tree
+        self._tree = None
+
+    @property
+    def tree(self):
+        """Дерево lxml html-документа из тела ответа"""
+
+        if self._tree is None:
+            # Тело ответа перед разбором кодируется в utf8, т.к. lxml не разбирает строки,
+            # в которых указана кодировка (например, <?xml version="1.0" encoding="windows-1251"?>).
+            # Парсер создается на каждый разбор -- парсеры lxml нельзя делить между потоками
+            parser = lxml.html.HTMLParser(encoding='utf-8')
+            self._tree = lxml.html.fromstring(self.body.encode('utf-8'), parser=parser)
+
+        return self._tree
+
+    def __repr__(self):
+        return '<HttpResponse {} {}>'.format(self.code, self.url)
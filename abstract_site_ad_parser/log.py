@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import multiprocessing
+import queue
+import sys
+import threading
+
+
+# Формат логированных сообщений по умолчанию
+DEFAULT_FORMAT = '%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s'
+
+
+# Типы аргументов сообщения, которые не могут измениться, пока запись ждет в очереди
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def is_immutable(value):
+    """Функция проверяет, что значение (или все элементы кортежа) не может измениться"""
+
+    if isinstance(value, tuple):
+        return all(is_immutable(item) for item in value)
+
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+class LazyQueueHandler(QueueHandler):
+    """Обработчик, который кладет запись лога в очередь, не форматируя ее: сообщение собирается
+    из аргументов уже в потоке записи. Очередь живет в том же процессе, поэтому запись
+    не нужно готовить к сериализации, как это делает QueueHandler.prepare.
+
+    Откладывается только сборка сообщения с неизменяемыми аргументами (строки, числа, None
+    и кортежи из них). Список, словарь или объект могут измениться, пока запись ждет в очереди,
+    и в лог попало бы уже новое значение, поэтому такое сообщение, как и в QueueHandler.prepare,
+    собирается сразу
+
+    """
+
+    def prepare(self, record):
+        if record.args and not is_immutable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Фильтр пропускает только каждое rate-е отладочное сообщение одного места вызова
+    (файл и строка), остальные уровни пропускаются всегда. Частые отладочные сообщения
+    (по несколько на объявление) остаются в логе, но не забивают его и не тормозят парсер
+
+    """
+
+    def __init__(self, rate=1):
+        super().__init__()
+        self.rate = max(1, int(rate))
+
+        # Количество отладочных сообщений по местам вызова
+        self._counts = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate == 1 or record.levelno != logging.DEBUG:
+            return True
+
+        key = record.pathname, record.lineno
+
+        with self._lock:
+            number = self._counts.get(key, 0)
+            self._counts[key] = number + 1
+
+        return number % self.rate == 0
+
+
+class ProcessRecordHandler(logging.Handler):
+    """Обработчик записей, пришедших из процессов пула: запись передается логеру родителя
+    с тем же именем, поэтому к ней применяются уровни и обработчики, настроенные в конфиге
+
+    """
+
+    def emit(self, record):
+        log = logging.getLogger(record.name)
+        if log.isEnabledFor(record.levelno):
+            log.handle(record)
+
+
+class LogManager:
+    """Настройка логирования скрипта.
+
+    Все логеры, полученные через get_logger, пишут в одну очередь, а в файл и в консоль
+    записи выводит отдельный поток (QueueListener). Поэтому парсер не ждет записи на диск
+    и в консоль, а форматирование сообщений (кроме сообщений с изменяемыми аргументами,
+    см. LazyQueueHandler) тоже выполняется в потоке записи. Уровни, файл
+    и формат задаются секцией log конфига (функция configure).
+
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(-1)
+        self.handler = LazyQueueHandler(self.queue)
+        self.sampling = SamplingFilter()
+        self.handler.addFilter(self.sampling)
+
+        self.loggers = dict()
+        self.listener = None
+
+        # Очередь, в которую пишут процессы пула, и поток, передающий их записи логерам родителя
+        self.process_queue = None
+        self.process_listener = None
+
+        # Логирование процесса пула: записи уходят родителю, свой поток записи не запускается
+        self.in_worker = False
+
+        # Минимальный уровень логеров: сообщения ниже него отбрасываются еще до создания записи
+        self.level = logging.DEBUG
+        self.enabled = True
+
+        self._lock = threading.Lock()
+
+    def get_logger(self, name, file='log.txt', encoding='utf8'):
+        with self._lock:
+            log = self.loggers.get(name)
+            if log is not None:
+                return log
+
+            if self.listener is None and not self.in_worker:
+                self.start(file, encoding)
+
+            log = logging.getLogger(name)
+            log.addHandler(self.handler)
+            log.propagate = False
+            self.set_level(log)
+
+            self.loggers[name] = log
+            return log
+
+    def set_level(self, log):
+        log.setLevel(self.level if self.enabled else logging.CRITICAL + 1)
+
+    def start(self, file='log.txt', encoding='utf8', format=None, file_level=logging.DEBUG,
+              console_level=logging.DEBUG):
+        """Функция запускает поток записи с обработчиками для файла file (None -- не писать в файл)
+        и для консоли
+
+        """
+
+        formatter = logging.Formatter(format or DEFAULT_FORMAT)
+        handlers = []
+
+        if file:
+            # Файл открывается при первой записи: процесс, который не пишет в лог, его не трогает
+            fh = logging.FileHandler(file, encoding=encoding, delay=True)
+            fh.setLevel(file_level)
+            fh.setFormatter(formatter)
+            handlers.append(fh)
+
+        ch = logging.StreamHandler(stream=sys.stdout)
+        ch.setLevel(console_level)
+        ch.setFormatter(formatter)
+        handlers.append(ch)
+
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Функция дописывает оставшиеся в очереди записи и останавливает поток записи"""
+
+        if self.listener is None:
+            return
+
+        self.listener.stop()
+
+        for handler in self.listener.handlers:
+            handler.close()
+
+        self.listener = None
+
+    def get_process_queue(self):
+        """Функция возвращает очередь, которую нужно передать процессам пула (configure_worker_logging),
+        и запускает поток, который передает их записи логерам этого процесса. Поэтому файл лога
+        пишет только главный процесс, а процессы пула не открывают его сами
+
+        """
+
+        with self._lock:
+            if self.process_queue is None:
+                self.process_queue = multiprocessing.get_context('spawn').Queue(-1)
+                self.process_listener = QueueListener(self.process_queue, ProcessRecordHandler())
+                self.process_listener.start()
+
+            return self.process_queue
+
+    def stop_process_listener(self):
+        """Функция останавливает поток, передающий записи процессов пула"""
+
+        if self.process_listener is None:
+            return
+
+        self.process_listener.stop()
+        self.process_listener = None
+
+    def configure_worker(self, process_queue):
+        """Функция настраивает логирование в процессе пула: поток записи (и файл лога), запущенный
+        при импорте модулей, останавливается, а записи собираются сразу и уходят в process_queue
+
+        """
+
+        with self._lock:
+            self.stop()
+            self.in_worker = True
+
+            handler = QueueHandler(process_queue)
+            handler.addFilter(self.sampling)
+
+            for log in self.loggers.values():
+                log.removeHandler(self.handler)
+                log.addHandler(handler)
+
+            self.handler = handler
+            self.queue = process_queue
+
+    def configure(self, config):
+        """Функция настраивает логирование по секции log конфига"""
+
+        file_level = logging.getLevelName(config['level'])
+        console_level = logging.getLevelName(config['console_level'])
+
+        with self._lock:
+            self.stop()
+            self.start(config['out'], format=config['format'], file_level=file_level,
+                       console_level=console_level)
+
+            self.sampling.rate = max(1, int(config['debug_sample']))
+            self.enabled = config['enabled']
+            self.level = min(file_level, console_level) if config['out'] else console_level
+
+            for log in self.loggers.values():
+                self.set_level(log)
+
+
+manager = LogManager()
+atexit.register(manager.stop)
+atexit.register(manager.stop_process_listener)
+
+
+def get_logger(name, file='log.txt', encoding='utf8'):
+    return manager.get_logger(name, file, encoding)
+
+
+def configure_logging(config):
+    manager.configure(config)
+
+
+def get_process_log_queue():
+    return manager.get_process_queue()
+
+
+def configure_worker_logging(process_queue):
+    manager.configure_worker(process_queue)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+# Метрики парсера
+STAGE_SECONDS = 'asap_stage_seconds'
+REQUESTS_TOTAL = 'asap_requests_total'
+ADS_TOTAL = 'asap_ads_total'
+PHONES_TOTAL = 'asap_phones_total'
+
+DESCRIPTIONS = {
+    STAGE_SECONDS: 'Время этапов парсинга в секундах',
+    REQUESTS_TOTAL: 'Количество http-запросов по типам ресурсов',
+    ADS_TOTAL: 'Количество разобранных объявлений по результатам разбора',
+    PHONES_TOTAL: 'Количество новых телефонов',
+}
+
+# Этапы парсинга (значения метки stage)
+STAGE_LAST_PAGE = 'last_page'
+STAGE_CATEGORY = 'category'
+STAGE_AD = 'ad'
+STAGE_PHONE = 'phone'
+STAGE_OCR = 'ocr'
+STAGE_NORMALIZE = 'normalize'
+STAGE_SINK = 'sink'
+
+# Результаты этапов и запросов (значения метки outcome)
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+OUTCOME_CACHE = 'cache'
+
+# Границы корзин гистограмм времени в секундах
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(labels):
+    """Функция возвращает метки в формате Prometheus: {site="...",stage="..."}"""
+
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+        # Значения: кортеж пар (метка, значение) -> число
+        self.values = dict()
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self, **labels):
+        """Функция возвращает сумму значений, у которых есть указанные метки"""
+
+        labels = set(labels.items())
+        return sum(v for k, v in self.values.items() if labels <= set(k))
+
+    def to_dict(self):
+        return [{'labels': dict(k), 'value': v} for k, v in sorted(self.values.items())]
+
+    def to_prometheus(self):
+        return ['{}{} {}'.format(self.name, format_labels(k), v) for k, v in sorted(self.values.items())]
+
+
+class Histogram:
+    """Гистограмма значений (времени этапов) с метками"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+
+        # Значения: кортеж пар (метка, значение) -> [счетчики корзин, сумма, количество]
+        self.values = dict()
+
+    def observe(self, labels, value):
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+        counts = item[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+
+        item[1] += value
+        item[2] += 1
+
+    def count(self, **labels):
+        """Функция возвращает количество значений, у которых есть указанные метки"""
+
+        labels = set(labels.items())
+        return sum(v[2] for k, v in self.values.items() if labels <= set(k))
+
+    def to_dict(self):
+        result = []
+
+        for k, (counts, value_sum, count) in sorted(self.values.items()):
+            result.append({
+                'labels': dict(k),
+                'buckets': dict(zip(map(str, self.buckets), counts)),
+                'sum': value_sum,
+                'count': count,
+            })
+
+        return result
+
+    def to_prometheus(self):
+        lines = []
+
+        for k, (counts, value_sum, count) in sorted(self.values.items()):
+            # В Prometheus корзины накопительные: le="1" -- количество значений <= 1
+            cumulative = 0
+            for bound, number in zip(self.buckets, counts):
+                cumulative += number
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(k + (('le', bound),)), cumulative))
+
+            lines.append('{}_bucket{} {}'.format(self.name, format_labels(k + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(k), value_sum))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(k), count))
+
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик парсера: счетчики и гистограммы времени этапов.
+
+    Ко всем значениям добавляются метки labels реестра (например, site -- имя класса парсера),
+    поэтому метрики разных парсеров можно складывать в одну базу Prometheus. Реестр можно
+    использовать из нескольких потоков.
+
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.metrics = dict()
+        self._lock = threading.Lock()
+
+        # Время создания реестра, от него считается скорость в строке прогресса
+        self.started = time.monotonic()
+
+    def get_metric(self, cls, name):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, DESCRIPTIONS.get(name, ''))
+
+            return metric
+
+    def make_labels(self, labels):
+        return tuple(sorted(dict(self.labels, **labels).items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Функция увеличивает счетчик name с метками labels"""
+
+        metric = self.get_metric(Counter, name)
+        labels = self.make_labels(labels)
+
+        with self._lock:
+            metric.inc(labels, amount)
+
+    def observe(self, name, value, **labels):
+        """Функция добавляет значение в гистограмму name с метками labels"""
+
+        metric = self.get_metric(Histogram, name)
+        labels = self.make_labels(labels)
+
+        with self._lock:
+            metric.observe(labels, value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Контекстный менеджер добавляет в гистограмму name время выполнения блока. Метка outcome --
+        error, если в блоке было исключение, иначе ok
+
+        """
+
+        outcome = OUTCOME_OK
+        t = time.perf_counter()
+
+        try:
+            yield
+
+        except BaseException:
+            outcome = OUTCOME_ERROR
+            raise
+
+        finally:
+            self.observe(name, time.perf_counter() - t, outcome=outcome, **labels)
+
+    def stage(self, stage):
+        """Контекстный менеджер замеряет время этапа парсинга stage"""
+
+        return self.time(STAGE_SECONDS, stage=stage)
+
+    def total(self, name, **labels):
+        """Функция возвращает сумму значений счетчика (или количество значений гистограммы) name,
+        у которых есть метки labels
+
+        """
+
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                return 0
+
+            return metric.total(**labels) if isinstance(metric, Counter) else metric.count(**labels)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: {'type': metric.type_name, 'description': metric.description, 'values': metric.to_dict()}
+                    for name, metric in sorted(self.metrics.items())}
+
+    def to_prometheus(self):
+        """Функция возвращает метрики в текстовом формате Prometheus"""
+
+        lines = []
+
+        with self._lock:
+            for name, metric in sorted(self.metrics.items()):
+                if metric.description:
+                    lines.append('# HELP {} {}'.format(name, metric.description))
+
+                lines.append('# TYPE {} {}'.format(name, metric.type_name))
+                lines += metric.to_prometheus()
+
+        return '\n'.join(lines) + '\n'
+
+    def get_progress(self):
+        """Функция возвращает строку прогресса: объявлений и телефонов в секунду, запросов
+        на телефон и долю объявлений с ошибкой с момента создания реестра
+
+        """
+
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+
+        ads = self.total(ADS_TOTAL)
+        errors = self.total(ADS_TOTAL, outcome=OUTCOME_ERROR)
+        phones = self.total(PHONES_TOTAL)
+        requests = self.total(REQUESTS_TOTAL)
+
+        return ('объявлений {} ({:.2f}/с), телефонов {} ({:.2f}/с), запросов на телефон {}, '
+                'ошибок {:.1f}%'.format(ads, ads / elapsed, phones, phones / elapsed,
+                                        '{:.1f}'.format(requests / phones) if phones else '-',
+                                        100.0 * errors / ads if ads else 0.0))
+
+    def save(self, json_file=None, prometheus_file=None):
+        """Функция сохраняет метрики в файл json и/или в текстовый файл формата Prometheus"""
+
+        for file_name, text in ((json_file, lambda: json.dumps(self.to_dict(), ensure_ascii=False, indent=4)),
+                                (prometheus_file, self.to_prometheus)):
+            if not file_name:
+                continue
+
+            dir_name = os.path.dirname(file_name)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+
+            with open(file_name, 'w', encoding='utf-8') as f:
+                f.write(text())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+import threading
+
+
+def canonical_url(url, drop_query=False):
+    """Функция приводит адрес к каноническому виду: схема и хост в нижнем регистре,
+    без порта по умолчанию, без фрагмента (#...) и с непустым путем
+
+    :param drop_query: True -- отбросить и параметры запроса (?...), например у сайтов,
+    где объявление определяется путем, а параметры служат для отслеживания переходов
+
+    """
+
+    split = urlsplit(url)
+
+    scheme = split.scheme.lower()
+    netloc = split.netloc.lower()
+
+    default_port = {'http': ':80', 'https': ':443'}.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+
+    return urlunsplit((scheme, netloc, split.path or '/', '' if drop_query else split.query, ''))
+
+
+class PageMemo:
+    """Память загруженных за время run страниц с LRU вытеснением.
+
+    Хранит ответы (HttpResponse вместе с уже разобранным деревом документа) по
+    каноническому адресу. Нужна, чтобы корень категории, загруженный для
+    определения номера последней страницы, не загружался второй раз как первая
+    страница категории.
+
+    """
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Количество запросов, которые удалось не выполнять
+        self.hits = 0
+
+    def get(self, url):
+        """Функция возвращает сохраненный ответ для адреса или None"""
+
+        key = canonical_url(url)
+
+        with self._lock:
+            rs = self._pages.get(key)
+            if rs is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+
+            return rs
+
+    def put(self, url, rs):
+        """Функция сохраняет ответ для адреса, вытесняя самый давно использованный"""
+
+        key = canonical_url(url)
+
+        with self._lock:
+            self._pages[key] = rs
+            self._pages.move_to_end(key)
+
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.hits = 0
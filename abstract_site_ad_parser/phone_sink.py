@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from abc import ABCMeta, abstractmethod
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Форматы файла результатов
+FORMAT_TEXT = 'text'
+FORMAT_JSONL = 'jsonl'
+FORMAT_SQLITE = 'sqlite'
+
+
+class PhoneSink(metaclass=ABCMeta):
+    """Потоковая запись телефонов в файл результатов.
+
+    Телефоны записываются по мере нахождения, а не в конце парсинга, поэтому при падении
+    или остановке парсера найденные телефоны остаются в файле. Чтобы не обращаться к диску
+    на каждый телефон, они копятся в буфере и сбрасываются в файл пачкой, когда в буфере
+    batch_size телефонов или с прошлого сброса прошло flush_interval секунд. На контрольных
+    точках (checkpoint) файл еще и принудительно записывается на диск.
+
+    Вместе с телефоном запоминается, откуда он: исходный номер, адрес объявления, адрес
+    страницы категории, сайт (имя класса парсера) и время. Как это сохраняется, определяют
+    наследники в функциях open_file, write_rows, sync_file и close_file.
+
+    """
+
+    def __init__(self, file_name, mode='w', site=None, batch_size=100, flush_interval=5.0):
+        self.file_name = file_name
+        self.mode = mode
+        self.site = site
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Буфер строк: (телефон, исходный телефон, адрес объявления, адрес категории, сайт, время)
+        self._buffer = []
+        self._opened = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Статистика: сколько телефонов записано и сколько раз буфер сбрасывался в файл
+        self.written = 0
+        self.flushes = 0
+
+    def open(self):
+        """Функция открывает файл. Вызывается при первой записи, поэтому режим w
+        перезаписывает файл только когда парсер действительно начал сохранять результаты
+
+        """
+
+        if self._opened:
+            return
+
+        dir_name = os.path.dirname(self.file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self.open_file()
+        self._opened = True
+
+    def write(self, phone, raw_phone=None, ad_url=None, category_url=None):
+        """Функция добавляет телефон в буфер и сбрасывает буфер в файл, если пора
+
+        :param phone: обработанный телефон
+        :param raw_phone: телефон, как он был найден в объявлении
+        :param ad_url: адрес объявления
+        :param category_url: адрес страницы категории, на которой нашлось объявление
+
+        """
+
+        with self._lock:
+            self._buffer.append((phone, raw_phone, ad_url, category_url, self.site, time.time()))
+
+            if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self.open()
+
+        if self._buffer:
+            self.write_rows(self._buffer)
+            self.written += len(self._buffer)
+            self._buffer = []
+
+        self.flushes += 1
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """Функция сбрасывает буфер в файл"""
+
+        with self._lock:
+            self._flush()
+
+    def checkpoint(self):
+        """Функция сбрасывает буфер в файл и записывает файл на диск"""
+
+        with self._lock:
+            self._flush()
+            self.sync_file()
+
+    def close(self):
+        """Функция записывает оставшиеся телефоны и закрывает файл"""
+
+        with self._lock:
+            self._flush()
+            self.sync_file()
+            self.close_file()
+            self._opened = False
+
+            # Повторное открытие (следующий run) должно дописывать, а не перезаписывать файл
+            self.mode = 'a'
+
+    @abstractmethod
+    def open_file(self):
+        """Функция открывает файл в режиме self.mode"""
+
+    @abstractmethod
+    def write_rows(self, rows):
+        """Функция записывает в файл строки буфера"""
+
+    @abstractmethod
+    def sync_file(self):
+        """Функция записывает файл на диск"""
+
+    @abstractmethod
+    def close_file(self):
+        """Функция закрывает файл"""
+
+
+class TextPhoneSink(PhoneSink):
+    """Запись телефонов в текстовый файл, по телефону на строку. Откуда телефон, не сохраняется"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file = None
+
+    def open_file(self):
+        self._file = open(self.file_name, mode=self.mode, encoding='utf-8')
+
+    def format_row(self, row):
+        return row[0] + '\n'
+
+    def write_rows(self, rows):
+        self._file.write(''.join(self.format_row(row) for row in rows))
+        self._file.flush()
+
+    def sync_file(self):
+        os.fsync(self._file.fileno())
+
+    def close_file(self):
+        self._file.close()
+        self._file = None
+
+
+class JsonlPhoneSink(TextPhoneSink):
+    """Запись телефонов в файл JSON Lines: по json-объекту на строку, например
+    {"phone": "89615750404", "raw_phone": "8 961 575-04-04", "ad_url": "...", "category_url": "...",
+     "site": "IrrRu_SiteAdParser", "time": 1445412345.5}
+
+    """
+
+    def format_row(self, row):
+        phone, raw_phone, ad_url, category_url, site, timestamp = row
+
+        return json.dumps({
+            'phone': phone,
+            'raw_phone': raw_phone,
+            'ad_url': ad_url,
+            'category_url': category_url,
+            'site': site,
+            'time': timestamp,
+        }, ensure_ascii=False) + '\n'
+
+
+class SqlitePhoneSink(PhoneSink):
+    """Запись телефонов в базу sqlite, в таблицу phones. Пачка телефонов вставляется одним
+    executemany в одной транзакции. По телефону и сайту построены индексы.
+
+    В одну базу могут писать парсеры разных сайтов, поэтому режим w удаляет только
+    телефоны сайта этого парсера.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connect = None
+
+    def open_file(self):
+        self._connect = sqlite3.connect(self.file_name, check_same_thread=False)
+
+        with self._connect:
+            self._connect.execute('''
+                CREATE TABLE IF NOT EXISTS phones (
+                    id INTEGER PRIMARY KEY,
+                    phone TEXT NOT NULL,
+                    raw_phone TEXT,
+                    ad_url TEXT,
+                    category_url TEXT,
+                    site TEXT,
+                    time REAL NOT NULL
+                )
+            ''')
+            self._connect.execute('CREATE INDEX IF NOT EXISTS phones_phone ON phones (phone)')
+            self._connect.execute('CREATE INDEX IF NOT EXISTS phones_site ON phones (site)')
+
+            if self.mode == 'w':
+                self._connect.execute('DELETE FROM phones WHERE site IS ?', (self.site,))
+
+    def write_rows(self, rows):
+        with self._connect:
+            self._connect.executemany('INSERT INTO phones (phone, raw_phone, ad_url, category_url, site, time) '
+                                      'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def sync_file(self):
+        # Закоммиченная транзакция sqlite уже на диске
+        pass
+
+    def close_file(self):
+        self._connect.close()
+        self._connect = None
+
+
+SINKS = {
+    FORMAT_TEXT: TextPhoneSink,
+    FORMAT_JSONL: JsonlPhoneSink,
+    FORMAT_SQLITE: SqlitePhoneSink,
+}
+
+
+def create_phone_sink(out_format, file_name, mode='w', site=None, batch_size=100, flush_interval=5.0):
+    """Функция создает запись телефонов в файл результатов формата out_format (text, jsonl или sqlite)"""
+
+    if out_format not in SINKS:
+        raise Exception('Неизвестный формат файла результатов "{}", допустимые: {}.'.format(
+            out_format, ', '.join(sorted(SINKS))))
+
+    return SINKS[out_format](file_name, mode, site, batch_size, flush_interval)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+import queue
+import threading
+
+from .abstract_site_ad_parser import NeedPhonesComplete
+from .log import get_logger
+from .metrics import STAGE_LAST_PAGE
+
+
+logger = get_logger('asaparser_pipeline')
+
+
+# Метка конца потока данных в очереди
+_DONE = object()
+
+# Возвращается из get, если все потоки, которые кладут элементы в очередь, завершились,
+# не положив метку конца (например, упали)
+_DEAD = object()
+
+# Метка конца страницы категории в очереди результатов: (_PAGE_DONE, адрес страницы, количество объявлений)
+_PAGE_DONE = object()
+
+# Через сколько секунд заблокированные put/get проверяют, не остановлен ли конвейер
+_POLL_TIMEOUT = 0.1
+
+
+class CategoryPipeline:
+    """Конвейер разбора категорий объявлений.
+
+    Этапы конвейера работают одновременно:
+        1. Поток категорий проходит по страницам категорий и кладет адреса объявлений
+           в ограниченную очередь, как только они найдены (get_list_ad_from_category
+           может быть генератором).
+        2. Потоки объявлений (max_workers) берут адреса из очереди, вызывают get_phones_ad
+           и кладут телефоны в очередь результатов.
+        3. Вызвавший run поток забирает телефоны и добавляет их в список телефонов парсера.
+           Когда получены результаты всех объявлений страницы категории, найденные телефоны
+           записываются на диск (checkpoint_sink), как после страницы в последовательном разборе.
+
+    Очереди ограничены размером queue_size: если потоки объявлений не успевают, поток
+    категорий ждет, поэтому память не растет (0 или None -- очереди без ограничения). Когда набрано нужное количество телефонов,
+    конвейер останавливается, а NeedPhonesComplete пробрасывается из run.
+
+    """
+
+    def __init__(self, parser, max_workers, queue_size):
+        self.parser = parser
+        self.max_workers = max(1, max_workers)
+
+        # Очередь адресов объявлений: (адрес, адрес страницы категории)
+        # и очередь результатов: (адрес, адрес страницы категории, телефоны)
+        # (queue.Queue не принимает maxsize=None, а без ограничения он ждет 0)
+        queue_size = queue_size or 0
+        self.url_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+
+        # Событие устанавливается при остановке конвейера
+        self.stop_event = threading.Event()
+
+    def run(self, categories_urls, need_phones):
+        """Функция запускает конвейер и ждет, пока он разберет все категории
+        или наберется нужное количество телефонов
+
+        :param categories_urls: список адресов категорий
+        :param need_phones: количество нужных телефонов
+
+        """
+
+        producer = threading.Thread(target=self.produce, args=(categories_urls,), name='pipeline-categories')
+        threads = [producer]
+        threads += [threading.Thread(target=self.consume, args=(producer,), name='pipeline-ads-{}'.format(i))
+                    for i in range(self.max_workers)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Количество полученных результатов объявлений по страницам категорий и количество
+        # объявлений страниц, которые поток категорий уже разобрал до конца
+        drained = dict()
+        expected = dict()
+
+        try:
+            done_workers = 0
+
+            while done_workers < self.max_workers:
+                # Ждем с таймаутом: так Ctrl+C прерывает ожидание, а если потоки конвейера упали,
+                # не отправив метку конца, run не зависнет
+                item = self.get(self.result_queue, threads)
+                if item is _DEAD:
+                    logger.error('Потоки конвейера завершились, не закончив разбор категорий.')
+                    break
+
+                if item is _DONE:
+                    done_workers += 1
+                    continue
+
+                if item[0] is _PAGE_DONE:
+                    _, category_url, number = item
+                    expected[category_url] = number
+                    self.checkpoint_page(category_url, drained, expected)
+                    continue
+
+                url, category_url, ad_phones = item
+                drained[category_url] = drained.get(category_url, 0) + 1
+
+                try:
+                    # Объявление, которое не удалось разобрать, приходит без телефонов (None)
+                    if ad_phones is not None:
+                        self.parser.process_ad_phones(ad_phones, need_phones, url, category_url)
+
+                except NeedPhonesComplete:
+                    # Пробрасываем выше -- там ожидается это исключение
+                    raise
+
+                except Exception as e:
+                    logger.error('Ошибка обработки телефонов объявления %s: %s', url, e, exc_info=True)
+
+                self.checkpoint_page(category_url, drained, expected)
+
+        finally:
+            self.stop_event.set()
+
+            for thread in threads:
+                thread.join()
+
+    def checkpoint_page(self, category_url, drained, expected):
+        """Функция записывает найденные телефоны на диск, если страница категории разобрана
+        потоком категорий и получены результаты всех ее объявлений
+
+        """
+
+        number = expected.get(category_url)
+        if number is None or drained.get(category_url, 0) < number:
+            return
+
+        del expected[category_url]
+        drained.pop(category_url, None)
+
+        self.parser.checkpoint_sink()
+
+    def put(self, q, item):
+        """Функция кладет элемент в очередь, ожидая свободного места. Возвращает False,
+        если конвейер остановили раньше, чем место освободилось
+
+        """
+
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=_POLL_TIMEOUT)
+                return True
+
+            except queue.Full:
+                pass
+
+        return False
+
+    def get(self, q, sources=()):
+        """Функция берет элемент из очереди. Возвращает _DONE, если конвейер остановили,
+        и _DEAD, если все потоки sources, которые кладут элементы в очередь, завершились,
+        а очередь пуста
+
+        """
+
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=_POLL_TIMEOUT)
+
+            except queue.Empty:
+                pass
+
+            if sources and not any(thread.is_alive() for thread in sources):
+                # Поток мог положить элемент перед самым завершением
+                try:
+                    return q.get_nowait()
+
+                except queue.Empty:
+                    return _DEAD
+
+        return _DONE
+
+    def produce(self, categories_urls):
+        """Функция потока категорий: проходит по страницам категорий и кладет
+        в очередь адреса еще не разобранных объявлений
+
+        """
+
+        parser = self.parser
+        end_page = parser.get_end_page()
+
+        try:
+            for url in categories_urls:
+                logger.info('Адрес категории: %s.', url)
+
+                try:
+                    # Номер последней страницы в категории объявлений
+                    with parser.metrics.stage(STAGE_LAST_PAGE):
+                        last_page_category = parser.get_last_page_category(url)
+                    logger.debug('Номер последней страницы в категории объявлений: %s.', last_page_category)
+
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                    continue
+
+                for page in range(parser.start_page, min(end_page, last_page_category) + 1):
+                    # Количество объявлений страницы, отданных потокам объявлений
+                    queued = 0
+
+                    try:
+                        url_page_cat = parser.get_url_page_category(url, page)
+                        logger.debug('Начинаю парсинг %s страницы категории: %s.', page, url_page_cat)
+
+                        number = 0
+
+                        for ad_url in parser.get_list_ad_from_category(url_page_cat):
+                            number += 1
+
+                            ad_url = parser.mark_visited(ad_url)
+                            if ad_url is None:
+                                continue
+
+                            if not self.put(self.url_queue, (ad_url, url_page_cat)):
+                                return
+
+                            queued += 1
+
+                        logger.info('Найдено адресов объявлений: %s.', number)
+
+                    except Exception as e:
+                        logger.error(e, exc_info=True)
+
+                    if queued and not self.put(self.result_queue, (_PAGE_DONE, url_page_cat, queued)):
+                        return
+
+                    if self.stop_event.is_set():
+                        return
+
+        finally:
+            # Каждому потоку объявлений своя метка конца очереди
+            for _ in range(self.max_workers):
+                if not self.put(self.url_queue, _DONE):
+                    break
+
+    def consume(self, producer):
+        """Функция потока объявлений: разбирает объявления из очереди адресов, которую заполняет
+        поток категорий producer, и кладет их телефоны в очередь результатов
+
+        """
+
+        try:
+            while True:
+                item = self.get(self.url_queue, (producer,))
+                if item is _DEAD:
+                    logger.error('Поток категорий завершился, не отправив метку конца очереди адресов.')
+                    return
+
+                if item is _DONE:
+                    return
+
+                url, category_url = item
+
+                logger.debug('Выполняю разбор объявления %s.', url)
+
+                try:
+                    ad_phones = self.parser.get_phones_ad(url)
+
+                except Exception as e:
+                    logger.error('Ошибка разбора объявления %s: %s', url, e, exc_info=True)
+                    self.parser.set_ad_outcome(url, error=e)
+                    ad_phones = None
+
+                else:
+                    self.parser.set_ad_outcome(url, ad_phones)
+
+                if not self.put(self.result_queue, (url, category_url, ad_phones)):
+                    return
+
+        finally:
+            self.put(self.result_queue, _DONE)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+import os
+import sqlite3
+import threading
+import time
+
+
+# Результаты разбора объявления
+OUTCOME_PHONE = 'phone'
+OUTCOME_NONE = 'none'
+OUTCOME_ERROR = 'error'
+
+
+def get_outcome(ad_phones=None, error=None):
+    """Функция возвращает результат разбора объявления по найденным телефонам или ошибке"""
+
+    if error is not None:
+        return OUTCOME_ERROR
+
+    return OUTCOME_PHONE if ad_phones else OUTCOME_NONE
+
+
+class MemoryVisitedStore:
+    """Хранилище посещенных объявлений в памяти, живет только во время запуска парсера.
+    Проверка, было ли объявление посещено, -- поиск в словаре
+
+    """
+
+    def __init__(self):
+        # Словарь: адрес объявления -> (время посещения, результат разбора)
+        self._visits = dict()
+        self._lock = threading.Lock()
+
+    def add(self, url):
+        """Функция отмечает объявление посещенным. Возвращает False, если объявление
+        уже было посещено и разбирать его не нужно
+
+        """
+
+        with self._lock:
+            if url in self._visits:
+                return False
+
+            self._visits[url] = time.time(), None
+            return True
+
+    def set_outcome(self, url, outcome):
+        with self._lock:
+            self._visits[url] = time.time(), outcome
+
+    def flush(self):
+        pass
+
+    def __contains__(self, url):
+        return url in self._visits
+
+    def __len__(self):
+        return len(self._visits)
+
+
+class SqliteVisitedStore:
+    """Хранилище посещенных объявлений в базе sqlite, сохраняется между запусками парсера.
+
+    Для объявления хранится адрес, сайт (имя класса парсера), время последнего посещения
+    и результат разбора. Повторно объявление разбирается, если с последнего посещения прошло
+    больше revisit_after[результат] секунд (None -- никогда). Объявления без результата
+    (например, парсер остановили во время разбора) разбираются повторно всегда.
+
+    """
+
+    # Через сколько изменений они записываются в файл
+    COMMIT_EVERY = 100
+
+    def __init__(self, file_name, site, revisit_after=None):
+        self.file_name = file_name
+        self.site = site
+
+        # Через сколько секунд объявление разбирается повторно: {результат разбора: секунды}
+        self.revisit_after = dict(revisit_after) if revisit_after else dict()
+
+        dir_name = os.path.dirname(file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._changes = 0
+
+        # Адреса, посещенные в этом запуске -- их не разбираем повторно независимо от revisit_after
+        self._run_visits = set()
+
+        self._connect = sqlite3.connect(file_name, check_same_thread=False)
+        self._connect.execute('''
+            CREATE TABLE IF NOT EXISTS visited (
+                url TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                visited REAL NOT NULL,
+                outcome TEXT
+            )
+        ''')
+        self._connect.commit()
+
+    def is_fresh(self, visited, outcome):
+        """Функция возвращает True, если объявление посещено недавно и повторно его разбирать не нужно"""
+
+        if outcome is None:
+            return False
+
+        age = self.revisit_after.get(outcome)
+        return age is None or time.time() - visited < age
+
+    def add(self, url):
+        """Функция отмечает объявление посещенным. Возвращает False, если объявление
+        уже было посещено недавно и разбирать его не нужно
+
+        """
+
+        with self._lock:
+            if url in self._run_visits:
+                return False
+
+            row = self._connect.execute('SELECT visited, outcome FROM visited WHERE url = ?', (url,)).fetchone()
+            if row is not None and self.is_fresh(*row):
+                self._run_visits.add(url)
+                return False
+
+            self._run_visits.add(url)
+            self.write(url, None)
+            return True
+
+    def set_outcome(self, url, outcome):
+        with self._lock:
+            self.write(url, outcome)
+
+    def write(self, url, outcome):
+        self._connect.execute('INSERT OR REPLACE INTO visited (url, site, visited, outcome) VALUES (?, ?, ?, ?)',
+                              (url, self.site, time.time(), outcome))
+
+        self._changes += 1
+        if self._changes >= self.COMMIT_EVERY:
+            self._connect.commit()
+            self._changes = 0
+
+    def flush(self):
+        """Функция записывает изменения в файл"""
+
+        with self._lock:
+            self._connect.commit()
+            self._changes = 0
+
+    def __contains__(self, url):
+        with self._lock:
+            if url in self._run_visits:
+                return True
+
+            row = self._connect.execute('SELECT visited, outcome FROM visited WHERE url = ?', (url,)).fetchone()
+            return row is not None and self.is_fresh(*row)
+
+    def __len__(self):
+        with self._lock:
+            return self._connect.execute('SELECT COUNT(*) FROM visited WHERE site = ?', (self.site,)).fetchone()[0]
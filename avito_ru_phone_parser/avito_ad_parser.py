@@ -4,12 +4,18 @@
 __author__ = 'ipetrash'
 
 
-from PySide.QtCore import QObject, Signal, QEventLoop
-from PySide.QtWebKit import QWebPage, QWebSettings
-from PySide.QtNetwork import QNetworkProxyFactory
+from PySide.QtCore import QObject, Signal, QEventLoop, QUrl, QTimer
+from PySide.QtWebKit import QWebPage, QWebSettings, QWebFrame
+from PySide.QtNetwork import QNetworkProxyFactory, QNetworkAccessManager, QNetworkDiskCache, QNetworkRequest
 from PySide.QtGui import QApplication
 
-from avito_im_phone_parser import AvitoPhoneImgParser
+from avito_im_phone_parser import AvitoPhoneImgParser, init_worker, parse_in_worker
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from phone_image_memo import PhoneImageMemo
+from resource_filter import TYPE_XHR, ResourceStats, get_resource_type
+import multiprocessing
 import time
 import base64
 
@@ -17,116 +23,785 @@ import sys
 
 
 from abstract_site_ad_parser import get_logger
+from abstract_site_ad_parser.log import get_process_log_queue
+from abstract_site_ad_parser.metrics import MetricsRegistry, STAGE_SECONDS, STAGE_OCR, OUTCOME_OK, OUTCOME_ERROR
 logger = get_logger('avitoru_ad_parser')
 
 
-class AvitoAdParser(QObject):
-    """Парсер страницы объявления сайта avito.ru"""
+# Этап метрик: разбор объявления страницей QtWebKit от начала загрузки до телефона
+STAGE_WEBKIT = 'webkit'
 
-    def __init__(self):
-        super().__init__()
 
-        self.app = QApplication(sys.argv)
+def get_raw_header(request, name):
+    """Функция возвращает значение заголовка запроса строкой"""
 
-        QNetworkProxyFactory.setUseSystemConfiguration(True)
+    return request.rawHeader(name).data().decode('latin-1')
+
+
+# Этапы разбора объявления страницей: загрузка, клик по "Показать телефон", появление изображения телефона
+# и разбор изображения в пуле процессов (STAGE_OCR)
+STAGE_LOAD = 'load'
+STAGE_CLICK = 'click'
+STAGE_IMAGE = 'image'
+STAGES = STAGE_LOAD, STAGE_CLICK, STAGE_IMAGE, STAGE_OCR
+
+# Время на этапы по умолчанию в секундах
+DEFAULT_BUDGETS = {STAGE_LOAD: 30, STAGE_CLICK: 5, STAGE_IMAGE: 10, STAGE_OCR: 10}
+
+# Интервалы в миллисекундах, через которые после клика проверяется, появилось ли изображение телефона.
+# Дальше проверки идут с последним интервалом, пока не выйдет время этапа STAGE_IMAGE
+POLL_INTERVALS = (25, 50, 100, 200, 400)
+
+# Причины, по которым телефон объявления не получен (сигнал failed). Только FAIL_NO_BUTTON значит,
+# что телефона у объявления нет, остальные -- ошибка разбора, объявление стоит разобрать позже
+FAIL_TIMEOUT = 'timeout'
+FAIL_LOAD = 'load'
+FAIL_SCRIPT = 'script'
+FAIL_NO_BUTTON = 'no_button'
+FAIL_OCR = 'ocr'
+
+
+def percentile(values, percent):
+    """Функция возвращает перцентиль отсортированного списка значений"""
+
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class CachedNetworkAccessManager(QNetworkAccessManager):
+    """Менеджер запросов страницы объявления: считает ответы, пришедшие из кэша,
+    а в режиме offline берет ответы только из кэша, не обращаясь к сети
+
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.offline = False
+
+        # Статистика обращений к кэшу
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.finished.connect(self.count_reply)
+
+    def createRequest(self, op, request, outgoing_data=None):
+        if self.offline:
+            request = QNetworkRequest(request)
+            request.setAttribute(QNetworkRequest.CacheLoadControlAttribute, QNetworkRequest.AlwaysCache)
+
+        return super().createRequest(op, request, outgoing_data)
+
+    def count_reply(self, reply):
+        if self.cache() is None:
+            return
+
+        if reply.attribute(QNetworkRequest.SourceIsFromCacheAttribute):
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+
+class FilteringNetworkAccessManager(CachedNetworkAccessManager):
+    """Менеджер запросов страницы объявления, который пропускает в сеть только запросы,
+    разрешенные фильтром (ResourceFilter): html объявления и скрипты, нужные для показа телефона.
+    Остальные запросы (стили, шрифты, счетчики, реклама) сразу завершаются ошибкой.
+
+    Для каждой загрузки страницы считает разрешенные и заблокированные запросы и полученные байты,
+    а о завершении ajax-запросов страницы сообщает сигналом xhr_finished.
+
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        # Фильтр запросов (None -- разрешены все запросы)
+        self.resource_filter = None
+
+        # Статистика текущих загрузок: QWebPage -> ResourceStats
+        self.page_stats = dict()
+
+        # Статистика всех загрузок
+        self.total_stats = ResourceStats()
+
+    # Сигнал вызывается, когда завершился ajax-запрос страницы (QWebPage)
+    xhr_finished = Signal(object)
+
+    def start_load(self, web_page):
+        """Функция начинает подсчет запросов новой загрузки страницы"""
+
+        self.page_stats[web_page] = ResourceStats()
+
+    def finish_load(self, web_page):
+        """Функция заканчивает подсчет запросов загрузки страницы и возвращает ее статистику"""
+
+        stats = self.page_stats.pop(web_page, None) or ResourceStats()
+        self.total_stats.add(stats)
+        return stats
+
+    @staticmethod
+    def get_page(request):
+        """Функция возвращает страницу (QWebPage), которая отправила запрос"""
+
+        frame = request.originatingObject()
+        if not isinstance(frame, QWebFrame):
+            return None
+
+        return frame.page()
+
+    def createRequest(self, op, request, outgoing_data=None):
+        url = request.url().toString()
+        web_page = self.get_page(request)
+        stats = self.page_stats.get(web_page)
+
+        resource_type = get_resource_type(url, get_raw_header(request, 'Accept'),
+                                          get_raw_header(request, 'X-Requested-With'))
+
+        if self.resource_filter is not None:
+            if not self.resource_filter.is_allowed(url, resource_type):
+                logger.debug('Запрос заблокирован (%s): %s', resource_type, url)
+
+                if stats is not None:
+                    stats.blocked += 1
+                    stats.blocked_types[resource_type] = stats.blocked_types.get(resource_type, 0) + 1
+
+                # Запрос с пустым адресом сразу завершается ошибкой, не обращаясь к сети
+                return super().createRequest(QNetworkAccessManager.GetOperation, QNetworkRequest(QUrl()))
+
+        reply = super().createRequest(op, request, outgoing_data)
+
+        if stats is not None:
+            stats.allowed += 1
+
+            # Последнее значение downloadProgress -- сколько байт получено
+            received = [0]
+
+            def progress(bytes_received, bytes_total):
+                received[0] = bytes_received
+
+            def finished():
+                stats.allowed_bytes += received[0]
+
+                if resource_type == TYPE_XHR:
+                    self.xhr_finished.emit(web_page)
+
+            reply.downloadProgress.connect(progress)
+            reply.finished.connect(finished)
+
+        return reply
+
+
+class AvitoAdPage(QObject):
+    """Страница объявления из пула страниц AvitoAdParser.
+
+    Загружает объявление, кликает "Показать телефон" и сообщает сигналом image_found байты
+    изображения телефона, а сигналом failed -- что телефон получить не удалось.
+
+    После клика страница не ждет изображение телефона вслепую: DOM проверяется по расписанию
+    POLL_INTERVALS и сразу после завершения каждого ajax-запроса страницы, поэтому телефон
+    читается, как только изображение появилось.
+
+    На каждый этап разбора дается время budgets[этап] секунд. Если этап не уложился, загрузка
+    останавливается, страница сообщает failed и освобождается для следующего объявления,
+    поэтому одно объявление не может остановить весь парсинг.
+
+    """
+
+    def __init__(self, network_manager, budgets=None, parent=None):
+        super().__init__(parent)
+
+        self.network_manager = network_manager
 
         self.web_page = QWebPage(self)
+        self.web_page.setNetworkAccessManager(network_manager)
         self.web_page.settings().setAttribute(QWebSettings.AutoLoadImages, False)
         self.web_page.loadFinished.connect(self.load_finished)
 
-        # Адрес страницы объявления
+        network_manager.xhr_finished.connect(self.xhr_finished)
+
+        # Адрес загружаемого объявления (None -- страница свободна)
         self.url = None
 
-        # Переменная нужна для замера времени выполнения
-        self.t = None
+        # True, когда с объявлением закончено: найдено изображение телефона или не удалось его получить
+        self.done = False
 
-        self.phone_img_parser = AvitoPhoneImgParser()
+        # Время начала загрузки объявления (time.perf_counter) для лога и метрик
+        self.started = None
 
-        # Строка с номером телефона
-        self.phone = None
+        # Время на этапы в секундах, текущий этап и таймер, который срабатывает, когда время этапа вышло
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.stage = None
 
-        self.proxy_url = None
-        self.proxy_type = None
-        self.proxy_enabled = None
+        self.deadline = QTimer(self)
+        self.deadline.setSingleShot(True)
+        self.deadline.timeout.connect(self.deadline_expired)
 
-    # Сигнал вызывается, когда закончен парсинг сотового из объявления
-    parse_phone_finished = Signal(str)
+        # Таймер проверки, появилось ли изображение телефона, количество проверок и время клика
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setSingleShot(True)
+        self.poll_timer.timeout.connect(self.get_phone)
+        self.polls = 0
+        self.click_t = None
 
-    def run(self, url):
-        """Функция выполняет парсинг страницы объявления"""
+        # Таймер клика: клик выполняется отдельным событием после начала этапа STAGE_CLICK,
+        # поэтому, пока клик ждет своей очереди в цикле событий, время этапа может выйти
+        self.click_timer = QTimer(self)
+        self.click_timer.setSingleShot(True)
+        self.click_timer.timeout.connect(self.click)
+        self.click_stage_t = None
 
-        self.url = url
-        self.phone = None
+        # Статистика: сколько раз вышло время каждого этапа и сколько загрузок закончилось ошибкой
+        self.timeouts = dict.fromkeys(STAGES, 0)
+        self.load_errors = 0
+
+        # Время от клика до появления изображения телефона в секундах
+        self.image_latencies = []
 
-        self.t = time.clock()
+        # Разбор изображения телефона в пуле процессов, которого ждет страница (Future)
+        self.ocr_future = None
 
-        # Загружаем страницу объявления
+    # Сигналы вызываются, когда найдено изображение телефона (страница, байты изображения)
+    # и когда получить его не удалось (страница, причина FAIL_*)
+    image_found = Signal(object, object)
+    failed = Signal(object, str)
+
+    def load(self, url):
+        """Функция начинает загрузку страницы объявления"""
+
+        self.url = url
+        self.done = False
+        self.started = time.perf_counter()
+
+        self.network_manager.start_load(self.web_page)
+        self.start_stage(STAGE_LOAD)
         self.web_page.mainFrame().load(url)
 
-        logger.debug('Начало выполнения загрузки "{}" {:.3f} секунд'.format(url, time.clock() - self.t))
+        logger.debug('Начало выполнения загрузки "%s" %.3f секунд', url, time.perf_counter() - self.started)
+
+    def release(self):
+        """Функция освобождает страницу для следующего объявления"""
+
+        logger.debug('Время выполнения парсера %.3f секунд', time.perf_counter() - self.started)
+
+        stats = self.network_manager.finish_load(self.web_page)
+        logger.debug('Запросы страницы %s: %s.', self.url, stats)
+
+        self.url = None
+        self.started = None
+
+    def finish(self, data=None, reason=None):
+        """Функция заканчивает работу с объявлением: отправляет image_found, если изображение телефона
+        найдено, иначе failed с причиной reason
+
+        """
+
+        if self.done:
+            return
+
+        self.done = True
+
+        self.deadline.stop()
+        self.poll_timer.stop()
+        self.click_timer.stop()
+        self.stage = None
+
+        if data is None:
+            self.failed.emit(self, reason)
+        else:
+            self.image_found.emit(self, data)
+
+    def start_stage(self, stage):
+        """Функция начинает этап разбора объявления и заводит таймер на его время"""
+
+        self.stage = stage
+        self.deadline.start(int(self.budgets[stage] * 1000))
+
+    def start_ocr(self, future):
+        """Функция заводит таймер на разбор изображения телефона в пуле процессов"""
+
+        self.ocr_future = future
+        self.start_stage(STAGE_OCR)
+
+    def finish_ocr(self, future):
+        """Функция останавливает таймер разбора изображения телефона. Возвращает False, если страница
+        уже не ждет этот разбор: вышло его время или страница перешла к другому объявлению
+
+        """
 
-        # Ждем тут, пока закончится парсинг объявления -- все из-за ассинхронности webpage и моей лени -- хочется
-        # просто в цикле запустить обработку и url, но из-за асинхронности с сигналами это не сработает -- какая-то
-        # лажа происходит -- падает приложение с ошибкой где-то в QtCore.dll
-        loop = QEventLoop()
-        self.parse_phone_finished.connect(loop.quit)
-        loop.exec_()
+        if future is not self.ocr_future:
+            return False
 
-        logger.debug('Время выполнения парсера {:.3f} секунд'.format(time.clock() - self.t))
-        self.t = None
+        self.ocr_future = None
+        self.deadline.stop()
+        self.stage = None
+        return True
+
+    def deadline_expired(self):
+        """Функция вызывается таймером, когда время текущего этапа вышло"""
+
+        # Разбор изображения начинается, когда с загрузкой страницы уже закончено (done)
+        if self.url is None or (self.done and self.stage != STAGE_OCR):
+            return
+
+        logger.warning('Время этапа "%s" (%s секунд) вышло, объявление %s пропускается.', self.stage,
+                       self.budgets[self.stage], self.url)
+
+        self.timeouts[self.stage] += 1
+
+        if self.stage == STAGE_OCR:
+            # Страница уже остановлена, осталось только не ждать результата разбора
+            self.ocr_future = None
+            self.stage = None
+            self.failed.emit(self, FAIL_TIMEOUT)
+            return
+
+        self.abort(FAIL_TIMEOUT)
+
+    def abort(self, reason):
+        """Функция останавливает загрузку страницы и заканчивает объявление без телефона с причиной reason"""
+
+        if self.done:
+            return
+
+        # Объявление отмечается законченным до остановки загрузки, чтобы loadFinished(False) от нее
+        # был проигнорирован, а failed отправляется после, чтобы остановка не задела следующее объявление
+        self.done = True
+        self.deadline.stop()
+        self.poll_timer.stop()
+        self.click_timer.stop()
+        self.stage = None
+
+        self.web_page.triggerAction(QWebPage.Stop)
+        self.failed.emit(self, reason)
+
+    def xhr_finished(self, web_page):
+        """Функция вызывается, когда завершился ajax-запрос одной из страниц. Если это запрос
+        этой страницы и она ждет изображение телефона, изображение проверяется сразу
+
+        """
+
+        if web_page is self.web_page and self.stage == STAGE_IMAGE:
+            self.poll_timer.start(0)
 
     def get_phone(self):
-        """Функция выполняет поиск картинки с номером телефона, получает его адрес, скачивает, а после
-        парсит картинку с номером и записывает в self.phone номер телефона. После парсинга вызывает сигнал
-        parse_phone_finished, в котором передается номер телефона.
+        """Функция выполняет поиск картинки с номером телефона и получает ее байты из атрибута src.
+        Байты картинки передаются сигналом image_found. Если картинки еще нет, следующая проверка
+        назначается по расписанию POLL_INTERVALS
 
         """
 
+        if self.stage != STAGE_IMAGE:
+            return
+
         # Ищем элемент с картинкой телефона
         el = self.web_page.mainFrame().findFirstElement("img[class='description__phone-img']")
+        src = el.attribute('src') if not el.isNull() else ''
 
-        logger.debug('Поиск изображения телефона {:.3f} секунд'.format(time.clock() - self.t))
+        if not src.startswith('data:image/png;base64,'):
+            interval = POLL_INTERVALS[min(self.polls, len(POLL_INTERVALS) - 1)]
+            self.polls += 1
+            self.poll_timer.start(interval)
+            return
 
-        ok = not el.isNull()
-        if ok:
-            src = el.attribute('src')
-            logger.debug('Атрибут src картинки с телефоном: "%s".', src)
-            src = src.replace('data:image/png;base64,', '')
-            logger.debug('Данные картинки с телефоном: "%s".', src)
-            data = base64.b64decode(src)
+        latency = time.perf_counter() - self.click_t
+        self.image_latencies.append(latency)
 
-            # TODO: вызывать исключение, если номер не найден
-            # TODO: вызывать исключение, если номер не 11 символов (нормальный номер: 89615750404)
-            phone_number = self.phone_img_parser.parse_from_data(data)
-            logger.debug('Телефон получен: %s', phone_number)
-            logger.debug('Парсинг номера телефона из картинки {:.3f} секунд'.format(time.clock() - self.t))
+        logger.debug('Изображение телефона появилось через %.3f секунд после клика (проверок: %s).', latency,
+                     self.polls + 1)
 
-            self.phone = phone_number
-            self.parse_phone_finished.emit(phone_number)
+        self.finish(base64.b64decode(src.replace('data:image/png;base64,', '')))
 
     def find_and_click_element(self):
+        """Функция начинает этап клика по элементу 'Показать телефон'. Сам клик (click) выполняется
+        следующим событием цикла, чтобы таймер этапа мог сработать, если клик до него не дошел
+
+        """
+
+        self.start_stage(STAGE_CLICK)
+        self.click_stage_t = time.perf_counter()
+        self.click_timer.start(0)
+
+    def click(self):
         """Функция ищет на странице объявления элемент 'Показать телефон' и кликает его, чтобы
         выполнились страшные скрипты и загрузилась картинка с номером телефона
 
         """
 
+        if self.stage != STAGE_CLICK:
+            return
+
+        # Результат скрипта -- количество найденных кнопок
         code = """
         span_phone = $("span[class='description__phone-insert js-phone-show__insert'] span[class='btn__text']")
         span_phone.click()
+        span_phone.length
         """
 
         logger.debug('Выполняю программный клик по кнопке "Получить телефон"')
         ok = self.web_page.mainFrame().evaluateJavaScript(code)
         if ok is None:
             logger.warn('Выполнение js скрипта неудачно. Code:\n%s', code)
+            self.finish(reason=FAIL_SCRIPT)
+            return
+
+        if not ok:
+            logger.warn('Кнопка "Показать телефон" на странице %s не найдена.', self.url)
+            self.finish(reason=FAIL_NO_BUTTON)
+            return
+
+        logger.debug('Время выполнения js скрипта %.3f секунд', time.perf_counter() - self.started)
+
+        # Скрипт выполняется синхронно, и пока он работает, таймер этапа сработать не может
+        if time.perf_counter() - self.click_stage_t > self.budgets[STAGE_CLICK]:
+            self.deadline_expired()
             return
 
-        logger.debug('Время выполнения js скрипта {:.3f} секунд'.format(time.clock() - self.t))
+        self.start_stage(STAGE_IMAGE)
+        self.polls = 0
+        self.click_t = time.perf_counter()
         self.get_phone()
 
     def load_finished(self, x):
-        """Функция вызывается, когда QWebView отсылает сигнал loadFinished"""
+        """Функция вызывается, когда QWebPage отсылает сигнал loadFinished"""
+
+        if self.url is None or self.done:
+            return
+
+        if not x:
+            logger.warn('Загрузка страницы %s завершилась ошибкой.', self.url)
+            self.load_errors += 1
+            self.finish(reason=FAIL_LOAD)
+            return
+
+        logger.info('Загрузка завершена %.3f секунд', time.perf_counter() - self.started)
+        self.find_and_click_element()
+
+
+class AvitoAdParser(QObject):
+    """Парсер страниц объявлений сайта avito.ru.
+
+    Держит пул из нескольких страниц QWebPage, которые работают в одном цикле событий Qt:
+    run_batch раздает адреса объявлений свободным страницам и сообщает телефоны по мере
+    их получения, поэтому одновременно загружается несколько объявлений.
+
+    """
+
+    def __init__(self, pages=1, budgets=None):
+        super().__init__()
+
+        self.app = QApplication(sys.argv)
+
+        QNetworkProxyFactory.setUseSystemConfiguration(True)
+
+        self.network_manager = FilteringNetworkAccessManager(self)
+
+        # Время на этапы разбора объявления в секундах
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+
+        # Пул страниц объявлений
+        self.pages = []
+        self.set_pages(pages)
+
+        # Статистика страниц, удаленных из пула
+        self.timeouts = dict.fromkeys(STAGES, 0)
+        self.load_errors = 0
+        self.image_latencies = []
+
+        self.phone_img_parser = AvitoPhoneImgParser()
+
+        # Пул процессов для разбора изображений телефонов (None -- разбор в главном потоке),
+        # количество его процессов и способ сопоставления изображений, чтобы пересоздать упавший пул
+        self.ocr_executor = None
+        self.ocr_workers = 0
+        self.ocr_engine = None
+
+        self.ocr_finished.connect(self.ocr_done)
+
+        # Очередь адресов объявлений, результаты и функция обратного вызова текущего run_batch
+        self.queue = deque()
+        self.results = dict()
+        self.callback = None
+
+        # Строка с номером телефона последнего объявления, разобранного run
+        self.phone = None
+
+        # Метрики: время разбора объявлений страницами и разбора изображений в пуле процессов
+        self.metrics = MetricsRegistry()
+
+        self.proxy_url = None
+        self.proxy_type = None
+        self.proxy_enabled = None
+
+    # Сигнал вызывается, когда закончен парсинг объявления: адрес и номер телефона (пустая
+    # строка, если телефон не получен)
+    parse_phone_finished = Signal(str, str)
+
+    # Сигнал вызывается, когда закончены все объявления run_batch
+    batch_finished = Signal()
+
+    # Сигнал вызывается из потока пула процессов, когда разобрано изображение телефона: страница,
+    # адрес объявления, байты изображения и Future с результатом разбора. Обрабатывается в потоке Qt
+    ocr_finished = Signal(object, str, object, object)
+
+    def set_pages(self, number):
+        """Функция задает количество страниц в пуле -- сколько объявлений загружается одновременно"""
+
+        for page in self.pages:
+            for stage in STAGES:
+                self.timeouts[stage] += page.timeouts[stage]
+
+            self.load_errors += page.load_errors
+            self.image_latencies += page.image_latencies
+            page.network_manager.xhr_finished.disconnect(page.xhr_finished)
+            page.deleteLater()
+
+        self.pages = []
+
+        for _ in range(max(1, number)):
+            page = AvitoAdPage(self.network_manager, self.budgets, self)
+            page.image_found.connect(self.phone_image_found)
+            page.failed.connect(self.page_failed)
+            self.pages.append(page)
+
+    def set_budgets(self, budgets):
+        """Функция задает время на этапы разбора объявления: словарь этап -> секунды"""
+
+        self.budgets.update(budgets)
+
+        for page in self.pages:
+            page.budgets.update(budgets)
+
+    def log_stats(self):
+        timeouts = {stage: self.timeouts[stage] + sum(page.timeouts[stage] for page in self.pages)
+                    for stage in STAGES}
+        load_errors = self.load_errors + sum(page.load_errors for page in self.pages)
+
+        logger.info('Страницы объявлений: вышло время загрузки %s, клика %s, появления изображения %s, '
+                    'разбора изображения %s; ошибок загрузки %s.', timeouts[STAGE_LOAD], timeouts[STAGE_CLICK],
+                    timeouts[STAGE_IMAGE], timeouts[STAGE_OCR], load_errors)
+
+        latencies = sorted(self.image_latencies + [t for page in self.pages for t in page.image_latencies])
+        if latencies:
+            logger.info('Время от клика до изображения телефона: медиана %.3f, p90 %.3f, p99 %.3f, '
+                        'максимум %.3f секунд (%s объявлений).', percentile(latencies, 50), percentile(latencies, 90),
+                        percentile(latencies, 99), latencies[-1], len(latencies))
+
+    def run(self, url):
+        """Функция выполняет парсинг страницы объявления и записывает телефон в self.phone"""
+
+        self.phone = self.run_batch([url]).get(url)
+
+    def run_batch(self, urls, callback=None):
+        """Функция разбирает объявления страницами из пула и ждет, пока все они будут разобраны
+
+        :param urls: список адресов объявлений
+        :param callback: функция, которая вызывается для каждого разобранного объявления
+        с адресом, телефоном (None, если телефон не получен) и причиной FAIL_*, по которой
+        телефон не получен (None, если получен)
+        :return: словарь адрес объявления -> телефон или None
+
+        """
+
+        self.queue = deque(urls)
+        self.results = dict()
+        self.callback = callback
+
+        for page in self.pages:
+            self.load_next(page)
+
+        # Ждем тут, пока закончится парсинг объявлений -- все из-за асинхронности webpage
+        if any(page.url is not None for page in self.pages):
+            loop = QEventLoop()
+            self.batch_finished.connect(loop.quit)
+            loop.exec_()
+            self.batch_finished.disconnect(loop.quit)
+
+        self.callback = None
+        return self.results
+
+    def cancel(self):
+        """Функция убирает из очереди run_batch еще не начатые объявления"""
+
+        self.queue.clear()
+
+    def load_next(self, page):
+        """Функция дает свободной странице следующий адрес из очереди. Когда очередь пуста и
+        все страницы свободны, отправляет batch_finished
+
+        """
+
+        if self.queue:
+            page.load(self.queue.popleft())
+            return
+
+        if all(page.url is None for page in self.pages):
+            self.batch_finished.emit()
+
+    def ad_finished(self, page, phone_number, reason=None):
+        """Функция запоминает результат объявления страницы, освобождает ее и дает следующий адрес"""
+
+        url = page.url
+
+        self.metrics.observe(STAGE_SECONDS, time.perf_counter() - page.started, stage=STAGE_WEBKIT,
+                             outcome=OUTCOME_OK if phone_number else OUTCOME_ERROR)
+        page.release()
+
+        self.results[url] = phone_number
+        self.parse_phone_finished.emit(url, phone_number or '')
+
+        if self.callback is not None:
+            try:
+                self.callback(url, phone_number, reason)
+
+            except Exception as e:
+                # Исключения из обработчиков сигналов Qt не пробрасываются, поэтому только логируем
+                logger.error(e, exc_info=True)
+
+        self.load_next(page)
+
+    def page_failed(self, page, reason):
+        self.ad_finished(page, None, reason)
+
+    def set_cache(self, directory, max_size, offline=False):
+        """Функция включает кэш на диске для запросов страницы объявления. Ответы кэшируются
+        по правилам http-заголовков, при превышении max_size байт удаляются старые ответы
+
+        :param directory: папка кэша
+        :param max_size: максимальный размер кэша в байтах
+        :param offline: True -- ответы берутся только из кэша
+
+        """
+
+        cache = QNetworkDiskCache(self)
+        cache.setCacheDirectory(directory)
+        cache.setMaximumCacheSize(max_size)
+
+        self.network_manager.setCache(cache)
+        self.network_manager.offline = offline
+
+    def set_resource_filter(self, resource_filter):
+        """Функция задает фильтр запросов страниц объявлений (None -- загружать все)"""
+
+        self.network_manager.resource_filter = resource_filter
+
+    def set_ocr_workers(self, workers, engine):
+        """Функция включает разбор изображений телефонов в пуле из workers процессов, чтобы цикл событий
+        Qt не останавливался на время разбора. Процессы переиспользуются между объявлениями, изображения
+        цифр загружаются в каждом процессе один раз.
+
+        Процессы запускаются через spawn, а не fork: копия процесса с QApplication и потоками Qt
+        может зависнуть на блокировке, захваченной в момент fork другим потоком.
+        Инициализация процессов пула (initializer) требует Python 3.7 или новее
+
+        """
+
+        self.ocr_workers = workers
+        self.ocr_engine = engine
+
+        self.ocr_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=init_worker, initargs=(engine, get_process_log_queue()))
+
+    def restart_ocr_workers(self, executor):
+        """Функция пересоздает пул процессов разбора изображений после падения процесса пула
+        (BrokenProcessPool): упавший пул больше не принимает изображения. Пул пересоздается один раз,
+        даже если о его падении сообщили несколько разборов
+
+        """
+
+        if executor is not self.ocr_executor:
+            return
+
+        logger.warning('Пул процессов разбора изображений телефонов упал, запускаю новый.')
+
+        self.ocr_executor.shutdown(wait=False)
+        self.set_ocr_workers(self.ocr_workers, self.ocr_engine)
+
+    def phone_image_found(self, page, data):
+        """Функция разбирает изображение телефона, найденное страницей. Если включен пул процессов,
+        изображение разбирается в нем, а страница ждет результата в ocr_done
+
+        """
+
+        # TODO: вызывать исключение, если номер не найден
+        # TODO: вызывать исключение, если номер не 11 символов (нормальный номер: 89615750404)
+        if self.ocr_executor is None:
+            self.set_phone(page, self.phone_img_parser.parse_from_data(data))
+            return
+
+        memo = self.phone_img_parser if isinstance(self.phone_img_parser, PhoneImageMemo) else None
+
+        phone_number = memo.get(data) if memo is not None else None
+        if phone_number is not None:
+            self.set_phone(page, phone_number)
+            return
+
+        # Разбор в процессе пула, результат придет в ocr_done через сигнал ocr_finished
+        url = page.url
+
+        try:
+            future = self.ocr_executor.submit(parse_in_worker, data)
+
+        except BrokenProcessPool:
+            # Изображение разбирается в главном потоке, а следующие -- уже в новом пуле
+            self.restart_ocr_workers(self.ocr_executor)
+            self.set_phone(page, self.phone_img_parser.parse_from_data(data))
+            return
+
+        future.submitted = time.perf_counter()
+        future.executor = self.ocr_executor
+        page.start_ocr(future)
+        future.add_done_callback(lambda future: self.ocr_callback(page, url, data, future))
+
+    def ocr_callback(self, page, url, data, future):
+        """Функция вызывается в потоке пула процессов, когда разбор изображения закончен, и передает
+        результат в поток Qt сигналом ocr_finished
+
+        """
+
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            logger.error('Процесс пула разбора изображений телефонов упал при разборе %s: %s', url, error)
+
+        self.ocr_finished.emit(page, url, data, future)
+
+    def ocr_done(self, page, url, data, future):
+        """Функция вызывается в потоке Qt, когда процесс пула разобрал изображение телефона"""
+
+        # Пока изображение разбиралось, могло выйти время разбора, а страница -- перейти к другому объявлению
+        if not page.finish_ocr(future):
+            if isinstance(future.exception(), BrokenProcessPool):
+                self.restart_ocr_workers(future.executor)
+            return
+
+        # Время разбора в пуле -- вместе с ожиданием свободного процесса
+        elapsed = time.perf_counter() - future.submitted
+
+        error = future.exception()
+        if error is not None:
+            logger.error('Ошибка разбора изображения телефона: %s', error, exc_info=error)
+            self.metrics.observe(STAGE_SECONDS, elapsed, stage=STAGE_OCR, outcome=OUTCOME_ERROR)
+
+            if isinstance(error, BrokenProcessPool):
+                self.restart_ocr_workers(future.executor)
+
+            self.ad_finished(page, None, FAIL_OCR)
+            return
+
+        phone_number = future.result()
+
+        self.metrics.observe(STAGE_SECONDS, elapsed, stage=STAGE_OCR, outcome=OUTCOME_OK)
+
+        if isinstance(self.phone_img_parser, PhoneImageMemo):
+            self.phone_img_parser.put(data, phone_number)
+
+        self.set_phone(page, phone_number)
+
+    def set_phone(self, page, phone_number):
+        """Функция запоминает номер телефона объявления страницы и сообщает об окончании его парсинга"""
+
+        logger.debug('Телефон получен: %s', phone_number)
+        logger.debug('Парсинг номера телефона из картинки %.3f секунд', time.perf_counter() - page.started)
 
-        if x and self.phone is None:
-            logger.info('Загрузка завершена {:.3f} секунд'.format(time.clock() - self.t))
-            self.find_and_click_element()
+        self.ad_finished(page, phone_number)
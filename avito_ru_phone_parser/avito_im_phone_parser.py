@@ -6,37 +6,36 @@ __author__ = 'ipetrash'
 
 from PIL import Image
 from io import BytesIO
+from numpy.lib.stride_tricks import sliding_window_view
 import glob
+import numpy as np
 import time
 
 
 BLACK_PXL = 0
 
 
-def get_margins(im):
-    """Функция для определения границ номера сотового"""
+def binarize(im):
+    """Функция возвращает массив изображения, в котором True -- черные пиксели"""
 
-    w, h = im.size
-    left, right, top, bottom = w, -1, h, -1
+    return np.asarray(im) == BLACK_PXL
 
-    for y in range(h):
-        for x in range(w):
-            pxl = im.getpixel((x, y))
 
-            if pxl == BLACK_PXL:
-                if left > x:
-                    left = x
+def get_margins(im):
+    """Функция для определения границ номера сотового. Строки и столбцы с черными пикселями
+    ищутся сразу по всему изображению (im -- изображение или массив от binarize)
 
-                if right < x:
-                    right = x
+    """
 
-                if top > y:
-                    top = y
+    black = im if isinstance(im, np.ndarray) else binarize(im)
+    h, w = black.shape
 
-                if bottom < y:
-                    bottom = y
+    columns = np.flatnonzero(black.any(axis=0))
+    if not len(columns):
+        return w, -1, h, -1
 
-    return left, right, top, bottom
+    rows = np.flatnonzero(black.any(axis=1))
+    return int(columns[0]), int(columns[-1]), int(rows[0]), int(rows[-1])
 
 
 def crop_im_phone(im):
@@ -46,19 +45,62 @@ def crop_im_phone(im):
     return im.crop((left, top, right+1, bottom+1))
 
 
+def crop_phone(black):
+    """Функция вырезает номер сотового из массива от binarize и возвращает срез массива (без копирования)"""
+
+    left, right, top, bottom = get_margins(black)
+    return black[top:bottom+1, left:right+1]
+
+
 from abstract_site_ad_parser import get_logger
+from abstract_site_ad_parser.log import configure_worker_logging
 logger = get_logger('avitoru_image_phone_parser')
 
 
 NUMBERS_DIR = 'numbers'
 
 
+# Способы сопоставления изображения телефона с изображениями цифр:
+#   pixel -- попиксельное сравнение через getpixel (медленное, оставлено для сверки и замеров)
+#   numpy -- сравнение всех смещений каждой цифры операциями над массивами
+#   glyph -- изображение делится на символы по пустым столбцам, каждый символ ищется по своему
+#            изображению в словаре цифр, а слипшиеся символы разбираются как в numpy
+ENGINE_PIXEL = 'pixel'
+ENGINE_NUMPY = 'numpy'
+ENGINE_GLYPH = 'glyph'
+
+ENGINES = [ENGINE_PIXEL, ENGINE_NUMPY, ENGINE_GLYPH]
+
+
 class AvitoPhoneImgParser:
     """Класс для разбора изображения номера телефона, который дает авито"""
 
-    def __init__(self):
+    # Сколько результатов разбора неизвестных символов запоминается для engine glyph
+    MAX_UNKNOWN_GLYPHS = 10000
+
+    def __init__(self, engine=ENGINE_GLYPH):
+        if engine not in ENGINES:
+            raise Exception('Неизвестный способ разбора изображения телефона: "{}".'.format(engine))
+
+        self.engine = engine
+
         self.num_img_list = dict()
 
+        # Изображения цифр в виде массивов от binarize, для engine numpy и glyph
+        self.num_arr_list = dict()
+
+        # Словарь для engine glyph: (высота, ширина, байты изображения цифры без пустых столбцов по краям) ->
+        # (цифра, количество пустых столбцов слева, есть ли пустые столбцы по краям)
+        self.glyph_index = dict()
+
+        # Высоты изображений цифр и наибольшее количество пустых столбцов по краям изображения цифры
+        self.glyph_heights = set()
+        self.glyph_margin = 0
+
+        # Результаты разбора символов, которых нет в glyph_index (дефисы, слипшиеся цифры):
+        # байты области символа -> найденные цифры
+        self.unknown_glyphs = dict()
+
         logger.debug('Получаю список картинок цифр из папки "%s"', NUMBERS_DIR)
         num_file_list = glob.glob("{}/*.png".format(NUMBERS_DIR))
         num_file_list = sorted(num_file_list)
@@ -73,6 +115,20 @@ class AvitoPhoneImgParser:
         for i, path in enumerate(num_file_list):
             num_im = Image.open(path).convert('L')
             self.num_img_list[i] = num_im
+            self.num_arr_list[i] = binarize(num_im)
+
+        for num, num_arr in self.num_arr_list.items():
+            black_columns = np.flatnonzero(num_arr.any(axis=0))
+            left, right = black_columns[0], black_columns[-1] + 1
+
+            num_h, num_w = num_arr.shape
+            has_margins = left > 0 or right < num_w
+
+            glyph = num_arr[:, left:right]
+            self.glyph_index[glyph.shape + (glyph.tobytes(),)] = num, left, has_margins
+
+            self.glyph_heights.add(num_h)
+            self.glyph_margin = max(self.glyph_margin, left, num_w - right)
 
         logger.debug('Закончена загрузка файлов изображений и заполнение словаря изображений цифр')
 
@@ -85,17 +141,40 @@ class AvitoPhoneImgParser:
         logger.debug('Открываю изображение телефона от байтового массива')
 
         ph_im = Image.open(BytesIO(byte_data)).convert('L')
-        ph_im = crop_im_phone(ph_im)
+
+        if self.engine == ENGINE_PIXEL:
+            ph_im = crop_im_phone(ph_im)
+        else:
+            # Изображение один раз переводится в массив черных пикселей, дальше работа только с ним
+            ph_arr = crop_phone(binarize(ph_im))
 
         logger.debug('Закончена подготовка изображения')
 
-        ph_w, ph_h = ph_im.size
+        logger.debug('Начинаю разбор изображения телефона')
 
-        phone_number = ""
+        t = time.perf_counter()
 
-        logger.debug('Начинаю разбор изображения телефона')
+        if self.engine == ENGINE_GLYPH:
+            phone_number = self.match_glyphs(ph_arr)
+        elif self.engine == ENGINE_NUMPY:
+            phone_number = self.match_numpy(ph_arr)
+        else:
+            phone_number = self.match_pixels(ph_im)
+
+        logger.debug('Разбор изображения телефона закончено за %.3f секунд', time.perf_counter() - t)
+
+        logger.debug('Закончил разбор, телефон: "%s", длина %s символов', phone_number, len(phone_number))
+        return phone_number
+
+    def match_pixels(self, ph_im):
+        """Функция ищет цифры в изображении телефона попиксельным сравнением
+        и возвращает строку с найденными цифрами
+
+        """
 
-        t = time.clock()
+        ph_w, ph_h = ph_im.size
+
+        phone_number = ""
 
         # Перебираем каждый x картинки с телефоном
         for offset in range(ph_w + 1):
@@ -122,7 +201,129 @@ class AvitoPhoneImgParser:
                 if find:
                     phone_number += str(num)
 
-        logger.debug('Разбор изображения телефона закончено за {:.3f} секунд'.format(time.clock() - t))
+        return phone_number
+
+    def match_numpy(self, ph_arr):
+        """Функция ищет цифры в массиве изображения телефона (от binarize) и возвращает строку
+        с найденными цифрами.
+
+        Для каждой цифры сразу для всех смещений по x сравниваются окна изображения телефона
+        с изображением цифры -- результат тот же, что у match_pixels, но без циклов по пикселям
+
+        """
+
+        ph_h, ph_w = ph_arr.shape
+
+        # Совпадения: found[смещение по x, цифра]
+        found = np.zeros((ph_w + 1, len(self.num_arr_list)), dtype=bool)
+
+        for num, num_arr in self.num_arr_list.items():
+            num_h, num_w = num_arr.shape
+
+            # Цифра не помещается в изображение телефона
+            if num_w > ph_w or num_h > ph_h:
+                continue
+
+            # Окна изображения телефона размером с цифру для каждого смещения по x
+            windows = sliding_window_view(ph_arr[:num_h], (num_h, num_w))[0]
+            found[:ph_w - num_w + 1, num] = (windows == num_arr).all(axis=(1, 2))
+
+        # Цифры в порядке смещений, а на одном смещении -- в порядке цифр, как в match_pixels
+        _, nums = np.nonzero(found)
+        return ''.join(str(num) for num in nums)
+
+    def find_glyph(self, ph_arr, left, right):
+        """Функция ищет в словаре цифр символ изображения телефона, занимающий столбцы с left по right
+        (не включая). Возвращает цифру или None, если символа нет в словаре
+
+        """
+
+        ph_h, ph_w = ph_arr.shape
+
+        for num_h in self.glyph_heights:
+            if num_h > ph_h:
+                continue
+
+            glyph = ph_arr[:num_h, left:right]
+            found = self.glyph_index.get(glyph.shape + (glyph.tobytes(),))
+            if found is None:
+                continue
+
+            num, num_left, has_margins = found
+            if not has_margins:
+                return num
+
+            # Пустые столбцы по краям изображения цифры тоже должны совпасть, как в match_numpy
+            num_arr = self.num_arr_list[num]
+            offset = left - num_left
+
+            if offset >= 0 and offset + num_arr.shape[1] <= ph_w \
+                    and (ph_arr[:num_h, offset:offset + num_arr.shape[1]] == num_arr).all():
+                return num
+
+    def match_glyphs(self, ph_arr):
+        """Функция делит массив изображения телефона (от binarize) на символы по пустым столбцам и ищет
+        каждый символ в словаре цифр. Символы, которых нет в словаре (слипшиеся цифры, дефисы), разбираются
+        match_numpy вместе с пустыми столбцами вокруг, результат запоминается. Результат тот же, что
+        у match_numpy (изображения цифр не должны содержать пустых столбцов внутри)
+
+        """
+
+        ph_h, ph_w = ph_arr.shape
+
+        # Начала и концы (не включая) групп непустых столбцов
+        black_columns = ph_arr.any(axis=0).astype(np.int8)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], black_columns, [0]))))
+        starts, ends = edges[::2], edges[1::2]
+
+        phone_number = ""
+
+        for i, (left, right) in enumerate(zip(starts, ends)):
+            num = self.find_glyph(ph_arr, left, right)
+            if num is not None:
+                phone_number += str(num)
+                continue
+
+            # Область символа с пустыми столбцами вокруг, в которую может попасть изображение цифры:
+            # не дальше пустых столбцов по краям изображения цифры и не дальше соседних символов
+            area_left = max(ends[i - 1] if i > 0 else 0, left - self.glyph_margin)
+            area_right = min(starts[i + 1] if i + 1 < len(starts) else ph_w, right + self.glyph_margin)
+
+            area = ph_arr[:, area_left:area_right]
+            key = area.shape + (area.tobytes(),)
+
+            nums = self.unknown_glyphs.get(key)
+            if nums is None:
+                nums = self.match_numpy(area)
+
+                if len(self.unknown_glyphs) >= self.MAX_UNKNOWN_GLYPHS:
+                    self.unknown_glyphs.clear()
+
+                self.unknown_glyphs[key] = nums
+
+            phone_number += nums
 
-        logger.debug('Закончил разбор, телефон: "%s", длина %s символов', phone_number, len(phone_number))
         return phone_number
+
+
+# Парсер изображений процесса из пула ProcessPoolExecutor: создается один раз при запуске процесса
+# (init_worker), поэтому загрузка изображений цифр не повторяется для каждого телефона
+_worker_img_parser = None
+
+
+def init_worker(engine, log_queue):
+    """Функция инициализации процесса пула разбора изображений телефонов. Записи лога процесса
+    уходят в log_queue главного процесса (get_process_log_queue), файл лога пишет только он
+
+    """
+
+    configure_worker_logging(log_queue)
+
+    global _worker_img_parser
+    _worker_img_parser = AvitoPhoneImgParser(engine)
+
+
+def parse_in_worker(byte_data):
+    """Функция разбирает изображение телефона в процессе пула, инициализированном init_worker"""
+
+    return _worker_img_parser.parse_from_data(byte_data)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from urllib.parse import urljoin
+import base64
+import json
+import re
+
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
+
+
+from abstract_site_ad_parser import get_logger
+logger = get_logger('avitoru_phone_fast_path')
+
+
+# Адрес, по которому виджет "Показать телефон" запрашивает изображение телефона
+PHONE_URL = '/items/phone/{}?pkey={}'
+
+
+def get_pkey(item_id, phone_key):
+    """Функция вычисляет ключ запроса изображения телефона так же, как js-скрипт страницы объявления:
+    шестнадцатеричные куски ключа со страницы склеиваются (для четного номера объявления -- в обратном
+    порядке) и берется каждый третий символ
+
+    """
+
+    parts = re.findall('[0-9a-f]+', phone_key)
+    if int(item_id) % 2 == 0:
+        parts.reverse()
+
+    return ''.join(parts)[::3]
+
+
+class AvitoPhoneFastPath:
+    """Получение телефона объявления авито без браузера.
+
+    Загружается html страницы объявления, из него берутся номер объявления и ключ,
+    по которым виджет телефона запрашивает изображение, изображение запрашивается
+    напрямую и разбирается img_parser. Если что-то не получилось, отправляется
+    исключение -- тогда телефон нужно получать через QtWebKit (AvitoAdParser).
+
+    Пока объявления идут через этот путь, страницы QtWebKit простаивают, поэтому после
+    max_failures неудач подряд (например, сайт изменил виджет телефона) путь выключается
+    до конца запуска, и все объявления сразу идут в QtWebKit.
+
+    """
+
+    def __init__(self, http, img_parser, max_failures=None):
+        # Http-клиент парсера (HttpClient)
+        self.http = http
+
+        # Парсер изображений телефонов (AvitoPhoneImgParser или PhoneImageMemo)
+        self.img_parser = img_parser
+
+        self.re_item_id = re.compile(r"avito\.item\.id\s*=\s*'(\d+)'")
+        self.re_phone_key = re.compile(r"avito\.item\.phone\s*=\s*'([^']+)'")
+
+        # Статистика: сколько телефонов получено без браузера и сколько раз пришлось обращаться к браузеру
+        self.successes = 0
+        self.failures = 0
+
+        # Сколько неудач подряд выключают путь (0 или None -- не выключать) и сколько их сейчас подряд
+        self.max_failures = max_failures
+        self.consecutive_failures = 0
+
+    @property
+    def enabled(self):
+        return not self.max_failures or self.consecutive_failures < self.max_failures
+
+    def get_phone(self, ad_url):
+        """Функция возвращает строку с номером телефона объявления или отправляет исключение"""
+
+        try:
+            phone = self.get_phone_from_ad(ad_url)
+
+        except Exception:
+            self.failures += 1
+            self.consecutive_failures += 1
+
+            if self.max_failures and self.consecutive_failures == self.max_failures:
+                logger.warning('Не удалось получить телефон без браузера %s раз подряд, дальше телефоны '
+                               'получаются только через QtWebKit.', self.consecutive_failures)
+            raise
+
+        self.successes += 1
+        self.consecutive_failures = 0
+        return phone
+
+    def get_phone_from_ad(self, ad_url):
+        rs = self.http.go(ad_url, resource=RESOURCE_AD)
+        if rs.code != 200:
+            raise Exception('Страница объявления вернула код {}.'.format(rs.code))
+
+        item_id, phone_key = self.parse_phone_tokens(rs.body)
+
+        url = urljoin(rs.url, PHONE_URL.format(item_id, get_pkey(item_id, phone_key)))
+        rs = self.http.go(url, resource=RESOURCE_PHONE,
+                          headers={'Referer': ad_url, 'X-Requested-With': 'XMLHttpRequest'})
+        if rs.code != 200:
+            raise Exception('Запрос изображения телефона вернул код {}.'.format(rs.code))
+
+        phone = self.img_parser.parse_from_data(self.parse_phone_image(rs.body))
+        if not phone:
+            raise Exception('В изображении телефона не найдено цифр.')
+
+        return phone
+
+    def parse_phone_tokens(self, body):
+        """Функция вытаскивает из html страницы объявления номер объявления и ключ телефона"""
+
+        item_id = self.re_item_id.search(body)
+        phone_key = self.re_phone_key.search(body)
+
+        if item_id is None or phone_key is None:
+            raise Exception('На странице объявления не найдены номер объявления и ключ телефона. '
+                            'Регулярки: {}, {}.'.format(self.re_item_id.pattern, self.re_phone_key.pattern))
+
+        return item_id.group(1), phone_key.group(1)
+
+    @staticmethod
+    def parse_phone_image(body):
+        """Функция вытаскивает байты изображения телефона из ответа вида {"image64": "data:image/png;base64,..."}"""
+
+        src = json.loads(body)['image64']
+        return base64.b64decode(src.replace('data:image/png;base64,', ''))
+
+    def log_stats(self):
+        total = self.successes + self.failures
+
+        logger.info('Телефоны без браузера: получено %s, не получено %s (%.1f%% успешно)%s.', self.successes,
+                    self.failures, 100.0 * self.successes / total if total else 0.0,
+                    '' if self.enabled else ', выключено после неудач подряд')
@@ -4,64 +4,81 @@
 __author__ = 'ipetrash'
 
 
-from grab import Grab
-from grab.error import GrabNetworkError
 from abstract_site_ad_parser import AbstractSiteAdParser, get_logger
+from abstract_site_ad_parser.abstract_site_ad_parser import NeedPhonesComplete
+from abstract_site_ad_parser.page_memo import canonical_url
 from urllib.parse import urljoin
-from avito_ad_parser import AvitoAdParser
+from avito_ad_parser import AvitoAdParser, FAIL_NO_BUTTON
+from avito_phone_fast_path import AvitoPhoneFastPath
+from avito_im_phone_parser import AvitoPhoneImgParser
+from phone_image_memo import PhoneImageMemo
+from resource_filter import ResourceFilter
 import os.path
 import re
+import sys
 
 
 logger = get_logger('avitoru_site_parser')
 
 
-# По-моему, костыль, нужно какой-то метод из коробки использовать
-def grab_go(g, url, **kwargs):
-    """Функция повторяет запросы, если во время выполнения случаются ошибки grab"""
-
-    logger.info('Отправляю запрос к ' + url + ', kwargs=%s', kwargs)
-
-    count = 5
-
-    while count:
-        try:
-            g.go(url, **kwargs)
-            break
-        except GrabNetworkError as e:
-            count -= 1
-            logger.warn('Произошла ошибка "%s" (количество оставшихся попыток %s)', e, count)
-
-
 class AvitoRu_SiteAdParser(AbstractSiteAdParser):
     """Парсер сайта avito.ru"""
 
     def __init__(self):
         super().__init__()
 
-        self.proxy_url = None
-        self.proxy_type = None
-        self.proxy_enabled = None
-
         # Парсер объявлений
         self.ad_parser = AvitoAdParser()
 
+        # Получение телефонов без браузера (None -- выключено в конфиге)
+        self.fast_path = None
+
         # Регулярка для получения номера последней страницы из url
         self.re_page = re.compile('.+\?p=(\d+)')
 
     def process_config(self, file_name):
         super().process_config(file_name)
 
-        proxy = self.config['proxy']
-
-        self.proxy_url = proxy['url']
-        self.proxy_type = proxy['type']
-        self.proxy_enabled = proxy['enabled']
-
         self.ad_parser.proxy_url = self.proxy_url
         self.ad_parser.proxy_type = self.proxy_type
         self.ad_parser.proxy_enabled = self.proxy_enabled
 
+        ocr = self.config['ocr']
+        self.ad_parser.phone_img_parser = PhoneImageMemo(AvitoPhoneImgParser(ocr['engine']),
+                                                         ocr['memo']['max_size'], ocr['memo']['file_name'],
+                                                         self.metrics)
+        self.ad_parser.metrics = self.metrics
+
+        if ocr['workers']:
+            # ProcessPoolExecutor с mp_context и initializer появился в Python 3.7
+            if sys.version_info < (3, 7):
+                logger.warn('Пул процессов разбора изображений требует Python 3.7 или новее (запущен %s.%s), '
+                            'изображения разбираются в главном потоке.', *sys.version_info[:2])
+            else:
+                self.ad_parser.set_ocr_workers(ocr['workers'], ocr['engine'])
+
+        webkit = self.config['webkit']
+        self.ad_parser.set_pages(webkit['pages'])
+        self.ad_parser.set_budgets(webkit['timeouts'])
+
+        if webkit['filter']['enabled']:
+            self.ad_parser.set_resource_filter(ResourceFilter.from_config(webkit['filter']))
+
+        if self.config['fast_path']['enabled']:
+            self.fast_path = AvitoPhoneFastPath(self.http, self.ad_parser.phone_img_parser,
+                                                self.config['fast_path']['max_failures'])
+
+        # Страницы объявлений загружает QtWebKit, поэтому у него свой кэш, рядом с кэшем http-клиента
+        cache = self.config['cache']
+        if cache['enabled']:
+            self.ad_parser.set_cache(os.path.join(cache['dir'], 'webkit'), cache['max_size_mb'] * 1024 * 1024,
+                                     cache['offline'])
+
+        # QWebPage можно использовать только из главного потока, поэтому пул потоков не используем
+        if self.max_workers is not None and self.max_workers > 1:
+            logger.warn('Для avito.ru max_workers может быть только 1 (указано %s).', self.max_workers)
+            self.max_workers = 1
+
     def get_url_page_category(self, url, page):
         # Примеры страниц категорий сайта avito.ru:
         # Первая страница (корень) может быть так представлена:
@@ -77,42 +94,47 @@ class AvitoRu_SiteAdParser(AbstractSiteAdParser):
 
         return url if page == 1 else url + '?p={}'.format(page)
 
+    def canonical_ad_url(self, url):
+        # Объявление определяется путем, а параметры запроса нужны для отслеживания переходов:
+        #   https://www.avito.ru/moskva/telefony/iphone_6_16gb_123456789?slocation=...
+        return canonical_url(url, drop_query=True)
+
     def get_list_ad_from_category(self, category_page_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, rs.url)
 
-        grab_go(g, category_page_url)
+    def parse_list_ad_from_category(self, tree, category_page_url):
+        """Функция вытаскивает адреса объявлений из дерева страницы категории"""
 
         # Список адресов объявлений
         ad_urls = []
 
         xpath = '//div[contains(@class, "catalog")]//div[contains(@class, "item_table")]'
-        select = g.doc.select(xpath)
-        if select.count() == 0:
+        select = tree.xpath(xpath)
+        if not select:
             raise Exception('Не нашлось объявлений! (xpath="{}")'.format(xpath))
 
         for sel in select:
-            a = sel.select('div[@class="description"]/h3/a')
-            ad_url = urljoin(g.response.url, a.attr('href'))
+            a = sel.xpath('div[@class="description"]/h3/a')
+            ad_url = urljoin(category_page_url, a[0].get('href'))
             ad_urls.append(ad_url)
 
         return ad_urls
 
     def get_last_page_category(self, url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
 
-        grab_go(g, url)
+    def parse_last_page_category(self, tree, url):
+        """Функция вытаскивает номер последней страницы из дерева страницы категории"""
 
         # Запрос для получения последней страницы данной категории
         xpath = '(//div[@class="pagination js-pages"]//a[@class="pagination__page"])[last()]'
-        a = g.doc.select(xpath)
-        if a.count() == 0:
+        a = tree.xpath(xpath)
+        if not a:
             raise Exception('Не удалось получить url последней страницы данной категории! (xpath="{}")'.format(xpath))
 
-        last_page_url = urljoin(g.response.url, a.attr('href'))
+        last_page_url = urljoin(url, a[0].get('href'))
 
         page = os.path.split(last_page_url)[-1]
         match = self.re_page.search(page)
@@ -124,16 +146,141 @@ class AvitoRu_SiteAdParser(AbstractSiteAdParser):
         return int(page)
 
     def get_phones_ad(self, ad_url):
-        logger.debug('Выполняю разбор объявления ' + ad_url)
-        self.ad_parser.run(ad_url)
+        errors = []
+
+        def callback(url, phones, error=None):
+            if error is not None:
+                errors.append(error)
+
+        ad_phones = self.get_phones_ads([ad_url], callback)
+        if errors:
+            raise errors[0]
+
+        return ad_phones[ad_url]
+
+    def get_phones_ads(self, ad_urls, callback=None):
+        """Функция возвращает словарь адрес объявления -> список телефонов. Телефоны сначала
+        запрашиваются без браузера, а оставшиеся объявления одновременно загружаются страницами
+        пула QtWebKit
+
+        :param ad_urls: список адресов объявлений
+        :param callback: функция, которая вызывается для каждого разобранного объявления с адресом,
+        списком телефонов и исключением, если телефон не получен из-за ошибки (вышло время этапа,
+        ошибка загрузки, скрипта или разбора изображения). Если она бросит исключение, разбор
+        оставшихся объявлений останавливается, а исключение пробрасывается
+
+        """
+
+        ad_phones = dict()
+
+        def done(ad_url, phones, error=None):
+            ad_phones[ad_url] = phones
+            if callback is not None:
+                callback(ad_url, phones, error)
+
+        # Объявления, телефоны которых нужно получать через QtWebKit
+        webkit_urls = []
+
+        for ad_url in ad_urls:
+            logger.debug('Выполняю разбор объявления %s', ad_url)
+
+            if self.fast_path is not None and self.fast_path.enabled:
+                try:
+                    phone = self.fast_path.get_phone(ad_url)
+
+                except Exception as e:
+                    logger.warning('Не удалось получить телефон без браузера: %s. Загружаю страницу объявления.', e)
+                    webkit_urls.append(ad_url)
+                    continue
+
+                done(ad_url, [phone])
+                continue
+
+            webkit_urls.append(ad_url)
+
+        if not webkit_urls:
+            return ad_phones
+
+        # Исключения нельзя бросать из цикла событий Qt, поэтому запоминаем первое
+        # и убираем из очереди еще не начатые объявления
+        errors = []
+
+        def webkit_done(ad_url, phone, reason=None):
+            if errors:
+                return
+
+            # Телефона нет только у объявления без кнопки "Показать телефон", остальные
+            # причины -- ошибка разбора, а не объявление без телефона
+            error = None
+            if phone is None:
+                if reason == FAIL_NO_BUTTON:
+                    logger.warn('Телефон не найден: %s', ad_url)
+                else:
+                    error = Exception('Не удалось получить телефон страницей объявления {} '
+                                      '(причина: {}).'.format(ad_url, reason))
+
+            try:
+                done(ad_url, [phone] if phone is not None else [], error)
+
+            except Exception as e:
+                errors.append(e)
+                self.ad_parser.cancel()
+
+        self.ad_parser.run_batch(webkit_urls, webkit_done)
+
+        if errors:
+            raise errors[0]
+
+        return ad_phones
+
+    def parse_ad_urls(self, ad_urls, need_phones, category_url=None):
+        # Объявления разбираются пачкой: страницы пула QtWebKit загружают их одновременно,
+        # а телефоны обрабатываются по мере получения
+        urls = []
+
+        for url in ad_urls:
+            url = self.mark_visited(url)
+            if url is not None:
+                urls.append(url)
+
+        # Ошибкой отмечаются только объявления, которые не удалось разобрать. Объявления, до которых
+        # разбор не дошел (набрано need_phones, парсер остановлен), остаются без результата
+        # и будут разобраны при следующем запуске, как в parse_ad_urls_in_pool
+        def process(url, ad_phones, error=None):
+            self.set_ad_outcome(url, ad_phones, error)
+
+            if error is not None:
+                logger.error(error)
+                return
+
+            try:
+                self.process_ad_phones(ad_phones, need_phones, url, category_url)
+
+            except NeedPhonesComplete:
+                # Пробрасываем выше -- там ожидается это исключение
+                raise
+
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+        self.get_phones_ads(urls, process)
+
+    def log_stats(self):
+        super().log_stats()
+
+        manager = self.ad_parser.network_manager
+        if manager.cache() is not None:
+            logger.info('Кэш страниц объявлений: попаданий %s, промахов %s.', manager.cache_hits,
+                        manager.cache_misses)
 
-        phone = self.ad_parser.phone
+        logger.info('Запросы страниц объявлений: %s.', manager.total_stats)
+        self.ad_parser.log_stats()
 
-        if phone is None:
-            logger.warn('Телефон не найден')
-            return []
+        if isinstance(self.ad_parser.phone_img_parser, PhoneImageMemo):
+            self.ad_parser.phone_img_parser.log_stats()
 
-        return [phone]
+        if self.fast_path is not None:
+            self.fast_path.log_stats()
 
     def processing_phones(self, phone):
         # Не вызываю родительскую функцию и без изменений передаю номер, т.к. обработка
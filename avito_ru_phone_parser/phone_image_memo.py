@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+
+
+from abstract_site_ad_parser import get_logger
+from abstract_site_ad_parser.metrics import MetricsRegistry, STAGE_OCR
+logger = get_logger('avitoru_phone_image_memo')
+
+
+class PhoneImageMemo:
+    """Память разобранных изображений телефонов перед AvitoPhoneImgParser.
+
+    У продавца с многими объявлениями на каждом объявлении одно и то же изображение телефона,
+    поэтому результат разбора запоминается по хэшу байтов изображения: в памяти последние
+    max_size изображений (LRU), а если указан file_name -- еще и в базе sqlite между запусками.
+    Повторное изображение стоит поиска по хэшу, а не обрезки и сопоставления с цифрами.
+
+    После изменения изображений цифр (папка numbers) файл file_name нужно удалить.
+
+    """
+
+    def __init__(self, img_parser, max_size=1000, file_name=None, metrics=None):
+        self.img_parser = img_parser
+        self.max_size = max_size
+        self.file_name = file_name
+
+        # Метрики: время разбора изображений, которых не было в памяти
+        self.metrics = metrics or MetricsRegistry()
+
+        self._phones = OrderedDict()
+
+        # Статистика обращений
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._connect = None
+
+        if file_name:
+            dir_name = os.path.dirname(file_name)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+
+            self._connect = sqlite3.connect(file_name)
+            self._connect.execute('CREATE TABLE IF NOT EXISTS phones (key TEXT PRIMARY KEY, phone TEXT NOT NULL)')
+            self._connect.commit()
+
+    def parse_from_data(self, byte_data):
+        """Функция возвращает строку с номером телефона из изображения, как AvitoPhoneImgParser.parse_from_data,
+        разбирая изображение, только если его нет в памяти
+
+        """
+
+        phone = self.get(byte_data)
+        if phone is None:
+            with self.metrics.stage(STAGE_OCR):
+                phone = self.img_parser.parse_from_data(byte_data)
+
+            self.put(byte_data, phone)
+
+        return phone
+
+    def get(self, byte_data):
+        """Функция возвращает запомненный телефон изображения или None, если изображения нет в памяти"""
+
+        key = hashlib.sha1(byte_data).hexdigest()
+
+        phone = self._phones.get(key)
+        if phone is not None:
+            self._phones.move_to_end(key)
+            self.memory_hits += 1
+            return phone
+
+        if self._connect is not None:
+            row = self._connect.execute('SELECT phone FROM phones WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                self.remember(key, row[0])
+                return row[0]
+
+        self.misses += 1
+
+    def put(self, byte_data, phone):
+        """Функция запоминает телефон, разобранный из изображения"""
+
+        key = hashlib.sha1(byte_data).hexdigest()
+        self.remember(key, phone)
+
+        if self._connect is not None:
+            self._connect.execute('INSERT OR REPLACE INTO phones (key, phone) VALUES (?, ?)', (key, phone))
+            self._connect.commit()
+
+    def remember(self, key, phone):
+        """Функция запоминает телефон в памяти, вытесняя самый давно использованный"""
+
+        self._phones[key] = phone
+        self._phones.move_to_end(key)
+
+        while len(self._phones) > self.max_size:
+            self._phones.popitem(last=False)
+
+    def log_stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+
+        logger.info('Память изображений телефонов: попаданий в памяти %s, на диске %s, промахов %s '
+                    '(%.1f%% попаданий).', self.memory_hits, self.disk_hits, self.misses,
+                    100.0 * hits / total if total else 0.0)
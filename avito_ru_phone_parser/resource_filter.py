@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from urllib.parse import urlsplit
+import os.path
+import re
+
+
+# Типы ресурсов страницы
+TYPE_DOCUMENT = 'document'
+TYPE_SCRIPT = 'script'
+TYPE_STYLESHEET = 'stylesheet'
+TYPE_IMAGE = 'image'
+TYPE_FONT = 'font'
+TYPE_XHR = 'xhr'
+TYPE_OTHER = 'other'
+
+# Тип ресурса по расширению файла в адресе
+EXTENSION_TYPES = {
+    '.js': TYPE_SCRIPT,
+    '.css': TYPE_STYLESHEET,
+    '.png': TYPE_IMAGE, '.jpg': TYPE_IMAGE, '.jpeg': TYPE_IMAGE, '.gif': TYPE_IMAGE, '.svg': TYPE_IMAGE,
+    '.webp': TYPE_IMAGE, '.ico': TYPE_IMAGE,
+    '.woff': TYPE_FONT, '.woff2': TYPE_FONT, '.ttf': TYPE_FONT, '.eot': TYPE_FONT, '.otf': TYPE_FONT,
+    '.html': TYPE_DOCUMENT, '.htm': TYPE_DOCUMENT,
+}
+
+
+def get_resource_type(url, accept=None, requested_with=None):
+    """Функция определяет тип ресурса запроса по заголовкам и расширению файла в адресе
+
+    :param url: адрес запроса
+    :param accept: значение заголовка Accept
+    :param requested_with: значение заголовка X-Requested-With
+
+    """
+
+    if requested_with == 'XMLHttpRequest':
+        return TYPE_XHR
+
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    if extension in EXTENSION_TYPES:
+        return EXTENSION_TYPES[extension]
+
+    if accept and 'text/html' in accept:
+        return TYPE_DOCUMENT
+
+    return TYPE_OTHER
+
+
+def match_host(host, hosts):
+    """Функция возвращает True, если host -- один из hosts или их поддомен"""
+
+    return any(host == h or host.endswith('.' + h) for h in hosts)
+
+
+class ResourceFilter:
+    """Фильтр запросов страницы объявления по хосту, пути и типу ресурса.
+
+    Запрос блокируется, если подходит под любой из списков deny_*. Иначе запрос разрешается,
+    если подходит под все непустые списки allow_* (пустой список allow_* ничего не ограничивает).
+    Пути задаются регулярками, хосты учитываются вместе с поддоменами.
+
+    """
+
+    def __init__(self, allow_hosts=None, deny_hosts=None, allow_paths=None, deny_paths=None,
+                 allow_types=None, deny_types=None):
+        self.allow_hosts = list(allow_hosts or [])
+        self.deny_hosts = list(deny_hosts or [])
+        self.allow_paths = [re.compile(p) for p in allow_paths or []]
+        self.deny_paths = [re.compile(p) for p in deny_paths or []]
+        self.allow_types = set(allow_types or [])
+        self.deny_types = set(deny_types or [])
+
+    @classmethod
+    def from_config(cls, config):
+        """Функция создает фильтр из секции webkit/filter конфига"""
+
+        return cls(config.get('allow_hosts'), config.get('deny_hosts'), config.get('allow_paths'),
+                   config.get('deny_paths'), config.get('allow_types'), config.get('deny_types'))
+
+    def is_allowed(self, url, resource_type):
+        parts = urlsplit(url)
+
+        # Локальные ресурсы страницы (data:, about:blank) не нагружают сеть
+        if parts.scheme not in ('http', 'https'):
+            return True
+
+        host = (parts.hostname or '').lower()
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+
+        if match_host(host, self.deny_hosts) or resource_type in self.deny_types \
+                or any(p.search(path) for p in self.deny_paths):
+            return False
+
+        if self.allow_hosts and not match_host(host, self.allow_hosts):
+            return False
+
+        if self.allow_types and resource_type not in self.allow_types:
+            return False
+
+        if self.allow_paths and not any(p.search(path) for p in self.allow_paths):
+            return False
+
+        return True
+
+
+class ResourceStats:
+    """Счетчики разрешенных и заблокированных запросов и полученных байт"""
+
+    def __init__(self):
+        self.allowed = 0
+        self.blocked = 0
+        self.allowed_bytes = 0
+
+        # Количество заблокированных запросов по типам ресурсов
+        self.blocked_types = dict()
+
+    def add(self, other):
+        self.allowed += other.allowed
+        self.blocked += other.blocked
+        self.allowed_bytes += other.allowed_bytes
+
+        for resource_type, number in other.blocked_types.items():
+            self.blocked_types[resource_type] = self.blocked_types.get(resource_type, 0) + number
+
+    def __str__(self):
+        blocked_types = ', '.join('{} {}'.format(k, v) for k, v in sorted(self.blocked_types.items()))
+
+        return 'разрешено {} ({:.1f} КБ), заблокировано {}{}'.format(
+            self.allowed, self.allowed_bytes / 1024, self.blocked,
+            ' ({})'.format(blocked_types) if blocked_types else '')
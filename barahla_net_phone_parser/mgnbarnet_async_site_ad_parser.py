@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+import asyncio
+
+from abstract_site_ad_parser.abstract_async_site_ad_parser import AbstractAsyncSiteAdParser
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
+from mgnbarnet_site_ad_parser import MgnBarNet_SiteAdParser, logger
+
+
+class MgnBarNet_AsyncSiteAdParser(AbstractAsyncSiteAdParser, MgnBarNet_SiteAdParser):
+    """Асинхронный парсер сайта magnitogorsk.barahla.net"""
+
+    async def get_list_ad_from_category(self, category_page_url):
+        rs = await self.fetch_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
+
+    async def get_last_page_category(self, url):
+        rs = await self.fetch_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
+
+    async def get_phones_ad(self, ad_url):
+        rs = await self.fetch(ad_url, resource=RESOURCE_AD)
+
+        post_data = self.parse_phone_post_data(rs.tree, rs.url)
+        if post_data is None:
+            return []
+
+        post_phone_url, post = post_data
+
+        # Не всегда приходит телефон от сервера, поэтому запрос повторяется до self.attempts раз
+        for count in reversed(range(self.attempts)):
+            rs = await self.fetch(post_phone_url, post=post, resource=RESOURCE_PHONE)
+
+            phones = self.parse_phone_response(rs.body)
+            if phones is not None:
+                return phones
+
+            logger.info('Телефон не получен, осталось попыток: %s.', count)
+
+            # Перед отправкой следующего запроса подождем секунду, не блокируя остальные запросы
+            if count:
+                await asyncio.sleep(1)
+
+        logger.warn('Закончилось количество попыток, заканчиваю попытки получить телефон.')
+        return []
@@ -4,10 +4,9 @@
 __author__ = 'ipetrash'
 
 
-from grab import Grab
-from grab.error import GrabNetworkError
 import re
 from abstract_site_ad_parser import AbstractSiteAdParser, get_logger
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
 from urllib.parse import urljoin
 from random import random
 import time
@@ -17,32 +16,12 @@ import os.path
 logger = get_logger('mgnbarnet_parser')
 
 
-# По-моему, костыль, нужно какой-то метод из коробки использовать
-def grab_go(g, url, **kwargs):
-    """Функция повторяет запросы, если во время выполнения случаются ошибки grab"""
-
-    logger.info('Отправляю запрос к %s, kwargs=%s', url, kwargs)
-
-    count = 5
-
-    while count:
-        try:
-            g.go(url, **kwargs)
-            break
-        except GrabNetworkError as e:
-            count -= 1
-            logger.warn('Произошла ошибка "%s" (количество оставшихся попыток %s).', e, count)
-
-
 class MgnBarNet_SiteAdParser(AbstractSiteAdParser):
     """Парсер сайта magnitogorsk.barahla.net"""
 
     def __init__(self):
         super().__init__()
 
-        self.proxy_url = None
-        self.proxy_type = None
-        self.proxy_enabled = None
         self.attempts = None
 
         # Регулярка для получения номера последней страницы из url
@@ -60,11 +39,6 @@ class MgnBarNet_SiteAdParser(AbstractSiteAdParser):
     def process_config(self, file_name):
         super().process_config(file_name)
 
-        proxy = self.config['proxy']
-        self.proxy_url = proxy['url']
-        self.proxy_type = proxy['type']
-        self.proxy_enabled = proxy['enabled']
-
         self.attempts = self.config['attempts']
 
     def get_url_page_category(self, url, page):
@@ -83,41 +57,41 @@ class MgnBarNet_SiteAdParser(AbstractSiteAdParser):
         return url if page == 1 else url + '?page={}'.format(page)
 
     def get_list_ad_from_category(self, category_page_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
 
-        grab_go(g, category_page_url)
+    def parse_list_ad_from_category(self, tree, category_page_url):
+        """Функция вытаскивает адреса объявлений из дерева страницы категории"""
 
         # Запрос для получения адресов объявлений
         xpath = '//table[@class="ob"]//a[@class=" ads-title-link"]'
 
-        select = g.doc.select(xpath)
-        if select.count() == 0:
+        select = tree.xpath(xpath)
+        if not select:
             raise Exception('Не нашлось объявлений! (xpath="{}").'.format(xpath))
 
         ad_urls = []
 
         for a in select:
-            ad_url = urljoin(category_page_url, a.attr('href'))
+            ad_url = urljoin(category_page_url, a.get('href'))
             ad_urls.append(ad_url)
 
         return ad_urls
 
     def get_last_page_category(self, url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
 
-        grab_go(g, url)
+    def parse_last_page_category(self, tree, url):
+        """Функция вытаскивает номер последней страницы из дерева страницы категории"""
 
         # Запрос для получения последней страницы данной категории
         xpath = '//div[@class="page_nav"]//a[last()]'
-        a = g.doc.select(xpath)
-        if a.count() == 0:
+        a = tree.xpath(xpath)
+        if not a:
             raise Exception('Не удалось получить url последней страницы данной категории! (xpath="{}").'.format(xpath))
 
-        last_page_url = urljoin(g.response.url, a.attr('href'))
+        last_page_url = urljoin(url, a[0].get('href'))
 
         page = os.path.split(last_page_url)[-1]
         match = self.re_page.search(page)
@@ -129,27 +103,62 @@ class MgnBarNet_SiteAdParser(AbstractSiteAdParser):
         return int(page)
 
     def get_phones_ad(self, ad_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.http.go(ad_url, resource=RESOURCE_AD)
+
+        post_data = self.parse_phone_post_data(rs.tree, rs.url)
+        if post_data is None:
+            return []
+
+        post_phone_url, post = post_data
+
+        # Количество попыток получения номера телефона
+        count = self.attempts
+
+        logger.debug('Попытаемся получить телефон, количество попыток: %s', count)
+
+        # Не всегда приходит телефон от сервера, в целом, в половину случаев
+        while True:
+            logger.info('POST запрос для получения телефона: %s, %s.', post_phone_url, post)
+            rs = self.http.go(post_phone_url, post=post, resource=RESOURCE_PHONE)
+
+            phones = self.parse_phone_response(rs.body)
+            if phones is not None:
+                return phones
+
+            count -= 1
+            logger.info('Телефон не получен, осталось попыток: %s.', count)
+
+            # Перед отправкой следующего запроса подождем секунду
+            time.sleep(1)
+
+            # Если закончилось количество попыток
+            if count == 0:
+                logger.warn('Закончилось количество попыток, заканчиваю попытки получить телефон.')
+                break
+
+        return []
+
+    def parse_phone_post_data(self, tree, ad_url):
+        """Функция возвращает кортеж из адреса и данных POST запроса, который вернет
+        телефон объявления, или None, если телефон не указан
 
-        grab_go(g, ad_url)
+        """
 
         xpath = '//table[@class="author_ob"]//a[contains(@onclick, "viewphone")]'
-        select = g.doc.select(xpath)
-        if select.count() == 0:
+        select = tree.xpath(xpath)
+        if not select:
             logger.warn('Телефон не указан, адрес объявления: %s, xpath="%s".', ad_url, xpath)
-            return []
+            return
 
         # В атрибуте описан js-скрипт, в котором есть 2 значения, нужных нам: key и br
-        onclick = select.attr('onclick').strip()
+        onclick = select[0].get('onclick').strip()
 
-        logger.info('onclick js-код: "%s".', onclick)
+        logger.debug('onclick js-код: "%s".', onclick)
 
         # Сгенерируем url для получения номера телефона, значение rand не важно, можно любое число
         # но для правдоподобности url все-таки сгенерируем
-        post_phone_url = urljoin(g.response.url, '/ajax/getPhones.php?rand=' + str(random()))
-        logger.info('Сгенерированный POST адрес для получения телефона: ' + post_phone_url)
+        post_phone_url = urljoin(ad_url, '/ajax/getPhones.php?rand=' + str(random()))
+        logger.debug('Сгенерированный POST адрес для получения телефона: %s', post_phone_url)
 
         match = self.re_post_phone.search(onclick)
         if match is None:
@@ -157,69 +166,55 @@ class MgnBarNet_SiteAdParser(AbstractSiteAdParser):
                             'телефона. Регулярка: "%s"', self.re_post_phone.pattern)
 
         data_json = match.group(1)
-        logger.info('Регулярка вытащила строку: "%s".', data_json)
+        logger.debug('Регулярка вытащила строку: "%s".', data_json)
 
         # TODO: использовать yaml для подобного как пушкой по воробьям стрелять
         # TODO: вытащить текст из скобок, и вручную распарсить
         import yaml
-        post = yaml.load(data_json)
+        post = yaml.safe_load(data_json)
 
-        # Количество попыток получения номера телефона
-        count = self.attempts
+        return post_phone_url, post
 
-        logger.debug('Попытаемся получить телефон, количество попыток: %s', count)
+    def parse_phone_response(self, response):
+        """Функция вытаскивает телефон из ответа на POST запрос. Возвращает None, если
+        сервер ответил ошибкой и запрос нужно повторить
 
-        # Не всегда приходит телефон от сервера, в целом, в половину случаев
-        while True:
-            logger.info('POST запрос для получения телефона: %s, %s.', post_phone_url, post)
-            g.go(post_phone_url, post=post)
-
-            # Варианты ответа:
-            # <error>oh, shit</error>
-            # <nobr>+7 921 956-23-24</nobr>
-            # 84951111111
-            response = g.response.body
-            logger.info('Ответ на запрос: "%s".', response)
-
-            if '<error>' in response:
-                match = self.re_response_error.search(response)
-                if match is None:
-                    logger.info('Не получилось вытащить текст ошибки регуляркой: "%s".', self.re_response_error.pattern)
-                else:
-                    text_err = match.group(1)
-                    logger.info('Получена ошибка: "%s".', text_err)
-            else:
-                phone = None
+        """
 
-                # Если телефон пришел в теге nobr, вытаскиваем его регуляркой
-                if '<nobr>' in response:
-                    logger.debug('Вытаскиваю телефон из тега nobr.')
-                    match = self.re_response_phone.search(response)
+        # Варианты ответа:
+        # <error>oh, shit</error>
+        # <nobr>+7 921 956-23-24</nobr>
+        # 84951111111
+        logger.debug('Ответ на запрос: "%s".', response)
 
-                    if match:
-                        phone = match.group(1)
-                    else:
-                        logger.info('Не получилось вытащить телефон регуляркой: "%s".',
-                                    self.re_response_phone.pattern)
-                else:
-                    phone = response
+        if '<error>' in response:
+            match = self.re_response_error.search(response)
+            if match is None:
+                logger.info('Не получилось вытащить текст ошибки регуляркой: "%s".', self.re_response_error.pattern)
+            else:
+                text_err = match.group(1)
+                logger.info('Получена ошибка: "%s".', text_err)
 
-                if phone is None:
-                    logger.warn('Телефон не найден.')
-                    return []
+            return
 
-                logger.info('Телефон: "%s".', phone)
-                return [phone]
+        phone = None
 
-            count -= 1
-            logger.info('Телефон не получен, осталось попыток: %s.', count)
+        # Если телефон пришел в теге nobr, вытаскиваем его регуляркой
+        if '<nobr>' in response:
+            logger.debug('Вытаскиваю телефон из тега nobr.')
+            match = self.re_response_phone.search(response)
 
-            # Перед отправкой следующего запроса подождем секунду
-            time.sleep(1)
+            if match:
+                phone = match.group(1)
+            else:
+                logger.info('Не получилось вытащить телефон регуляркой: "%s".',
+                            self.re_response_phone.pattern)
+        else:
+            phone = response
 
-            # Если закончилось количество попыток
-            if count == 0:
-                logger.warn('Закончилось количество попыток, заканчиваю попытки получить телефон.')
-                break
+        if phone is None:
+            logger.warn('Телефон не найден.')
+            return []
 
-        return []
+        logger.info('Телефон: "%s".', phone)
+        return [phone]
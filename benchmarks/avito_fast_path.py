@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Проверка получения телефонов авито без браузера (AvitoPhoneFastPath) на локальном сервере-заглушке:
+# сервер отдает страницы объявлений с ключами телефона и изображения телефонов, собранные из
+# изображений цифр. У части объявлений ключей нет, как у объявлений, для которых нужен браузер.
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/avito_fast_path.py [количество объявлений]
+
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+import base64
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+# Модуль замера разбора изображений настраивает пути к парсеру авито и рисует изображения телефонов
+from avito_phone_ocr import get_phone, make_phone_image
+
+from abstract_site_ad_parser.http_client import HttpClient
+from avito_im_phone_parser import AvitoPhoneImgParser
+from avito_phone_fast_path import AvitoPhoneFastPath, get_pkey
+
+# Сообщения о каждом запросе исказили бы замер
+logging.getLogger('asaparser_http').setLevel(logging.WARNING)
+
+
+# Доля объявлений без ключей телефона на странице
+NO_TOKENS_PROBABILITY = 0.2
+
+AD_PAGE = """<html><head><script>
+    var avito = {{item: {{}}}};
+    avito.item.id = '{id}';
+    avito.item.phone = '{key}';
+</script></head><body><h1>Объявление {id}</h1></body></html>"""
+
+AD_PAGE_WITHOUT_TOKENS = """<html><body><h1>Объявление {id}</h1></body></html>"""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_ads(number, digits):
+    """Функция возвращает словарь объявлений: номер -> (ключ телефона или None, телефон, png телефона)"""
+
+    ads = dict()
+
+    for i in range(number):
+        item_id = random.randrange(10 ** 8, 10 ** 9)
+        key = None if random.random() < NO_TOKENS_PROBABILITY else \
+            '{:x}'.format(random.getrandbits(96)) + 'z' + '{:x}'.format(random.getrandbits(96))
+
+        phone = get_phone()
+        ads[item_id] = key, ''.join(c for c in phone if c.isdigit()), make_phone_image(phone, digits)
+
+    return ads
+
+
+def create_handler(ads):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            split = urlsplit(self.path)
+            parts = split.path.strip('/').split('/')
+
+            if parts[0] == 'ad':
+                item_id = int(parts[1])
+                key = ads[item_id][0]
+                page = AD_PAGE.format(id=item_id, key=key) if key else AD_PAGE_WITHOUT_TOKENS.format(id=item_id)
+                self.send(200, 'text/html; charset=utf-8', page)
+
+            elif parts[:2] == ['items', 'phone']:
+                item_id = int(parts[2])
+                key, _, image = ads[item_id]
+
+                if key is None or parse_qs(split.query).get('pkey') != [get_pkey(item_id, key)]:
+                    self.send(403, 'application/json', '{"error": "forbidden"}')
+                    return
+
+                image64 = 'data:image/png;base64,' + base64.b64encode(image).decode('ascii')
+                self.send(200, 'application/json', json.dumps({'image64': image64}))
+
+            else:
+                self.send(404, 'text/plain', 'not found')
+
+        def send(self, code, content_type, body):
+            body = body.encode('utf-8')
+
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    random.seed(0)
+
+    img_parser = AvitoPhoneImgParser()
+    ads = create_ads(number, img_parser.num_img_list)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), create_handler(ads))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    fast_path = AvitoPhoneFastPath(HttpClient(attempts=1), img_parser)
+
+    errors = 0
+
+    t = time.perf_counter()
+
+    for item_id, (key, phone, _) in ads.items():
+        try:
+            if fast_path.get_phone('http://127.0.0.1:{}/ad/{}'.format(server.server_port, item_id)) != phone:
+                errors += 1
+
+        except Exception:
+            # Для объявлений без ключей телефон получается через браузер
+            if key is not None:
+                errors += 1
+
+    elapsed = time.perf_counter() - t
+    server.shutdown()
+
+    print('Объявлений {}: без браузера получено {}, не получено {} (объявлений без ключей {}), '
+          'ошибок {}, {:.1f} мс на объявление'.format(number, fast_path.successes, fast_path.failures,
+                                                     sum(1 for key, _, _ in ads.values() if key is None),
+                                                     errors, elapsed / number * 1000))
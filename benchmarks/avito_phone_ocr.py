@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Замер скорости разбора изображений телефонов авито разными способами (engine) AvitoPhoneImgParser
+# и сверка их результатов, а также сверка обрезки изображений с прежней попиксельной. Изображения
+# телефонов собираются из изображений цифр папки numbers, как их рисует авито: "8 912 345-67-89",
+# часть цифр -- вплотную друг к другу (слипшиеся символы).
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/avito_phone_ocr.py [количество изображений]
+
+
+from io import BytesIO
+import logging
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+
+AVITO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'avito_ru_phone_parser')
+sys.path.insert(0, AVITO_DIR)
+
+# Папка с изображениями цифр указывается относительно текущей
+os.chdir(AVITO_DIR)
+
+from avito_im_phone_parser import AvitoPhoneImgParser, binarize, crop_im_phone, crop_phone, get_margins, \
+    BLACK_PXL, ENGINES, ENGINE_GLYPH, ENGINE_NUMPY, ENGINE_PIXEL
+
+# Отладочные сообщения на каждое изображение исказили бы замер
+logging.getLogger('avitoru_image_phone_parser').setLevel(logging.INFO)
+
+
+# Отступы вокруг номера и промежутки между символами в пикселях
+PADDING = 8
+SPACE = 4
+GAP = 1
+
+# Вероятность того, что цифра нарисована вплотную к предыдущей
+TOUCH_PROBABILITY = 0.1
+DASH_WIDTH = 4
+
+
+def get_margins_pixels(im):
+    """Прежняя попиксельная функция определения границ номера сотового, для сверки с get_margins"""
+
+    w, h = im.size
+    left, right, top, bottom = w, -1, h, -1
+
+    for y in range(h):
+        for x in range(w):
+            pxl = im.getpixel((x, y))
+
+            if pxl == BLACK_PXL:
+                if left > x:
+                    left = x
+
+                if right < x:
+                    right = x
+
+                if top > y:
+                    top = y
+
+                if bottom < y:
+                    bottom = y
+
+    return left, right, top, bottom
+
+
+def get_phone():
+    """Функция возвращает случайный номер сотового в формате авито"""
+
+    return '8 9{:02} {:03}-{:02}-{:02}'.format(*(random.randrange(10 ** n) for n in (2, 3, 2, 2)))
+
+
+def make_phone_image(phone, digits):
+    """Функция рисует номер телефона изображениями цифр и возвращает png в байтах"""
+
+    height = max(im.size[1] for im in digits.values())
+
+    widths = {' ': SPACE, '-': DASH_WIDTH}
+    gaps = [0 if random.random() < TOUCH_PROBABILITY else GAP for _ in phone]
+    width = sum(widths[c] if c in widths else digits[int(c)].size[0] for c in phone) + sum(gaps)
+
+    # Отступы у изображений разные, чтобы проверить обрезку
+    left, top = random.randint(0, PADDING * 2), random.randint(0, PADDING * 2)
+
+    size = width + left + random.randint(0, PADDING * 2), height + top + random.randint(0, PADDING * 2)
+
+    im = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(im)
+
+    x = left
+    for c, gap in zip(phone, gaps):
+        if c == ' ':
+            x += SPACE
+        elif c == '-':
+            y = top + height // 2
+            draw.line((x, y, x + DASH_WIDTH - 1, y), fill=0)
+            x += DASH_WIDTH
+        else:
+            im.paste(digits[int(c)], (x, top))
+            x += digits[int(c)].size[0]
+
+        x += gap
+
+    data = BytesIO()
+    im.convert('RGB').save(data, 'png')
+    return data.getvalue()
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    random.seed(0)
+
+    parsers = {engine: AvitoPhoneImgParser(engine) for engine in ENGINES}
+
+    phones = [get_phone() for _ in range(number)]
+    images = [make_phone_image(phone, parsers[ENGINE_PIXEL].num_img_list) for phone in phones]
+    expected = [''.join(c for c in phone if c.isdigit()) for phone in phones]
+
+    times = dict()
+    results = dict()
+
+    for engine, parser in parsers.items():
+        t = time.perf_counter()
+        results[engine] = [parser.parse_from_data(data) for data in images]
+        times[engine] = (time.perf_counter() - t) / number
+
+        errors = sum(1 for result, phone in zip(results[engine], expected) if result != phone)
+        differences = sum(1 for result, pixel_result in zip(results[engine], results[ENGINE_PIXEL])
+                          if result != pixel_result)
+
+        print('{:<6} {:>8.3f} мс на изображение, ускорение x{:<8.1f} ошибок {:<4} отличий от pixel {}'.format(
+            engine, times[engine] * 1000, times[ENGINE_PIXEL] / times[engine], errors, differences))
+
+    opened = [Image.open(BytesIO(data)).convert('L') for data in images]
+
+    # Обрезка: границы номера должны совпасть с прежней попиксельной функцией
+    t = time.perf_counter()
+    expected_margins = [get_margins_pixels(im) for im in opened]
+    pixels_time = (time.perf_counter() - t) / number
+
+    t = time.perf_counter()
+    margins = [get_margins(binarize(im)) for im in opened]
+    numpy_time = (time.perf_counter() - t) / number
+
+    print()
+    print('Обрезка: попиксельная {:.3f} мс, по массиву {:.3f} мс на изображение (x{:.1f}), '
+          'совпала у {} из {}'.format(pixels_time * 1000, numpy_time * 1000, pixels_time / numpy_time,
+                                      sum(1 for a, b in zip(margins, expected_margins) if a == b), number))
+
+    # Только сопоставление с цифрами, без открытия и обрезки изображения
+    cropped = [crop_im_phone(im) for im in opened]
+    arrays = [crop_phone(binarize(im)) for im in opened]
+
+    matchers = [
+        (ENGINE_PIXEL, parsers[ENGINE_PIXEL].match_pixels, cropped),
+        (ENGINE_NUMPY, parsers[ENGINE_NUMPY].match_numpy, arrays),
+        (ENGINE_GLYPH, parsers[ENGINE_GLYPH].match_glyphs, arrays),
+    ]
+
+    print()
+    print('Только сопоставление с цифрами:')
+
+    for engine, match, items in matchers:
+        t = time.perf_counter()
+        for item in items:
+            match(item)
+
+        times[engine] = (time.perf_counter() - t) / number
+        print('{:<6} {:>8.3f} мс на изображение, ускорение x{:.1f}'.format(
+            engine, times[engine] * 1000, times[ENGINE_PIXEL] / times[engine]))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Замер разбора страниц парсерами сайтов без сети: сохраненные страницы категорий, страницы объявлений
+# и ответы на запросы телефонов (папка fixtures) передаются в функции разбора парсеров -- те же, что
+# вызывают get_list_ad_from_category, get_last_page_category и get_phones_ad. Для каждого вызова
+# выводится время (лучшее из нескольких повторов) и пик памяти, выделенной python (tracemalloc; память
+# самого lxml он не видит). Результат разбора сверяется с ожидаемым, поэтому сломанный селектор
+# сразу виден как ошибка, а не как подозрительно быстрый вызов.
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/extraction.py [--number N] [--save файл.json] [--compare файл.json]
+#
+# --save сохраняет замеры, --compare сравнивает с сохраненными и завершается с кодом 1, если какой-то
+# вызов стал медленнее в --threshold раз (по умолчанию 1.5). Дерево страницы строится так же, как
+# в HttpResponse.tree, и замеряется отдельной строкой (tree), а функции разбора получают готовое дерево.
+# Для страниц категорий авито нужен PySide (парсер авито импортирует QtWebKit), без него эти вызовы
+# пропускаются; разбор страницы объявления и ответа с изображением телефона (AvitoPhoneFastPath)
+# замеряется всегда.
+
+
+from collections import namedtuple
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARKS_DIR, '..')
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+# Модули парсеров импортируют соседние модули по имени, поэтому папки парсеров добавляются в пути
+for parser_dir in ('avito_ru_phone_parser', 'barahla_net_phone_parser', 'irr_ru_phone_parser',
+                   'olx_ua_phone_parser', 'v_sdelka_ru_phone_parser'):
+    sys.path.insert(0, os.path.join(ROOT_DIR, parser_dir))
+
+from abstract_site_ad_parser.http_response import HttpResponse
+from avito_phone_fast_path import AvitoPhoneFastPath
+from irrru_site_ad_parser import IrrRu_SiteAdParser
+from mgnbarnet_site_ad_parser import MgnBarNet_SiteAdParser
+from olxua_site_ad_parser import OlxUa_SiteAdParser
+from vsdelkaru_site_ad_parser import VSdelkaRu_SiteAdParser
+
+try:
+    from avitoru_site_ad_parser import AvitoRu_SiteAdParser
+
+except ImportError as e:
+    AvitoRu_SiteAdParser = None
+    AVITO_IMPORT_ERROR = e
+
+# Сообщения о каждом разобранном телефоне исказили бы замер
+for name in ('avitoru_site_parser', 'avitoru_phone_fast_path', 'mgnbarnet_parser', 'olxua_parser',
+             'vsdelkaruparser'):
+    logging.getLogger(name).setLevel(logging.WARNING)
+
+
+# Вызов функции разбора: сайт, название, функция без аргументов и проверка ее результата
+Case = namedtuple('Case', 'site name func check')
+
+
+def read_fixture(site, file_name):
+    with open(os.path.join(FIXTURES_DIR, site, file_name), encoding='utf-8') as f:
+        return f.read()
+
+
+def get_tree(url, body):
+    return HttpResponse(url, 200, body).tree
+
+
+def urls_check(count, first_url):
+    """Функция возвращает проверку списка адресов объявлений: их количество и первый адрес"""
+
+    return lambda urls: len(urls) == count and urls[0] == first_url
+
+
+def equals(expected):
+    return lambda result: result == expected
+
+
+def page_cases(site, parser, category_url, ads, first_ad_url, last_page):
+    """Функция возвращает вызовы разбора страницы категории: построение дерева, адреса объявлений
+    и номер последней страницы
+
+    """
+
+    body = read_fixture(site, 'category.html')
+    tree = get_tree(category_url, body)
+
+    return [
+        Case(site, 'category tree', lambda: get_tree(category_url, body), None),
+        Case(site, 'list_ad_from_category', lambda: parser.parse_list_ad_from_category(tree, category_url),
+             urls_check(ads, first_ad_url)),
+        Case(site, 'last_page_category', lambda: parser.parse_last_page_category(tree, category_url),
+             equals(last_page)),
+    ]
+
+
+def ad_tree_case(site, ad_url):
+    """Функция возвращает вызов построения дерева страницы объявления и само дерево"""
+
+    body = read_fixture(site, 'ad.html')
+    return Case(site, 'ad tree', lambda: get_tree(ad_url, body), None), get_tree(ad_url, body)
+
+
+def get_avito_cases():
+    site = 'avito'
+    cases = []
+
+    if AvitoRu_SiteAdParser is not None:
+        cases += page_cases(site, AvitoRu_SiteAdParser(), 'https://www.avito.ru/magnitogorsk/vakansii', 50,
+                            'https://www.avito.ru/magnitogorsk/vakansii/rabota_0_700000000', 100)
+    else:
+        print('Страницы категорий авито пропущены: {}.'.format(AVITO_IMPORT_ERROR))
+
+    fast_path = AvitoPhoneFastPath(None, None)
+    body = read_fixture(site, 'ad.html')
+    phone_body = read_fixture(site, 'phone.json')
+
+    cases += [
+        Case(site, 'phone_tokens', lambda: fast_path.parse_phone_tokens(body),
+             equals(('700023757', '8a1f3c9b0e7d2a54c6f1b8e3a9d07c2f 5b4e1a8c3f9d0b72 e6a1c4f8b2d9037a'))),
+        Case(site, 'phone_image', lambda: fast_path.parse_phone_image(phone_body),
+             lambda data: data.startswith(b'\x89PNG')),
+    ]
+
+    return cases
+
+
+def get_barahla_cases():
+    site = 'barahla'
+    parser = MgnBarNet_SiteAdParser()
+    ad_url = 'http://magnitogorsk.barahla.net/services/220/4503930.html'
+
+    cases = page_cases(site, parser, 'http://magnitogorsk.barahla.net/services/220/', 30,
+                       'http://magnitogorsk.barahla.net/services/220/4500000.html', 25)
+
+    tree_case, tree = ad_tree_case(site, ad_url)
+    phone_body = read_fixture(site, 'phone.txt')
+
+    cases += [
+        tree_case,
+        # Адрес POST запроса содержит случайное число, поэтому проверяются только данные запроса
+        Case(site, 'phone_post_data', lambda: parser.parse_phone_post_data(tree, ad_url),
+             lambda result: result[1] == {'key': '5f2a9c1e7b', 'br': '4503930'}),
+        Case(site, 'phone_response', lambda: parser.parse_phone_response(phone_body), equals(['+7 921 956-23-24'])),
+    ]
+
+    return cases
+
+
+def get_irr_cases():
+    site = 'irr'
+    parser = IrrRu_SiteAdParser()
+    ad_url = 'http://saint-petersburg.irr.ru/computers-devices/notebooks/notebooks/noutbuk-advert560001031.html'
+
+    cases = page_cases(site, parser, 'http://saint-petersburg.irr.ru/computers-devices/notebooks/notebooks/', 30,
+                       'http://saint-petersburg.irr.ru/computers-devices/notebooks/notebooks/'
+                       'noutbuk-advert560000000.html', 42)
+
+    tree_case, tree = ad_tree_case(site, ad_url)
+
+    cases += [
+        tree_case,
+        Case(site, 'phones_ad', lambda: parser.parse_phones_ad(tree), equals(['8 911 123-45-67'])),
+    ]
+
+    return cases
+
+
+def get_olx_cases():
+    site = 'olx'
+    parser = OlxUa_SiteAdParser()
+    ad_url = 'http://kiev.ko.olx.ua/obyavlenie/ohrannik-0-IDa1b2c.html'
+
+    cases = page_cases(site, parser, 'http://olx.ua/rabota/ohrana-bezopasnost/', 44,
+                       'http://kiev.ko.olx.ua/obyavlenie/ohrannik-0-IDa1b2c.html#b9de1eb356', 27)
+
+    tree_case, tree = ad_tree_case(site, ad_url)
+    phone_body = read_fixture(site, 'phone.json')
+
+    cases += [
+        tree_case,
+        Case(site, 'phone_url', lambda: parser.parse_phone_url(tree, ad_url),
+             equals('http://kiev.ko.olx.ua/ajax/misc/contact/phone/b6q05/white')),
+        Case(site, 'phones_response', lambda: parser.parse_phones_response(phone_body),
+             equals(['050 352 3204', '(0612)246448'])),
+    ]
+
+    return cases
+
+
+def get_vsdelka_cases():
+    site = 'vsdelka'
+    parser = VSdelkaRu_SiteAdParser()
+    ad_url = 'http://v-sdelka.ru/advert/nedv/310285.html'
+
+    cases = page_cases(site, parser, 'http://v-sdelka.ru/alladv/nedv/', 20,
+                       'http://v-sdelka.ru/advert/nedv/310000.html', 15)
+
+    # Телефон v-sdelka.ru ищется регуляркой в тексте страницы, дерево не нужно
+    body = read_fixture(site, 'ad.html')
+    phone_body = read_fixture(site, 'phone.txt')
+
+    cases += [
+        Case(site, 'phone_post_data', lambda: parser.parse_phone_post_data(body, ad_url),
+             equals({'id_advert': '310285', 'type_data': 'phone'})),
+        Case(site, 'phone_response', lambda: parser.parse_phone_response(phone_body), equals(['+89049425772'])),
+    ]
+
+    return cases
+
+
+def measure_time(func, number, repeat=5):
+    """Функция возвращает лучшее из repeat повторов среднее время вызова func в секундах"""
+
+    best = None
+
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - t) / number
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def measure_memory(func):
+    """Функция возвращает пик памяти, выделенной python за один вызов func, в байтах"""
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер разбора сохраненных страниц парсерами сайтов.')
+    parser.add_argument('--number', type=int, default=200, help='количество вызовов в одном повторе')
+    parser.add_argument('--save', help='файл json, в который сохраняются замеры')
+    parser.add_argument('--compare', help='файл json с прежними замерами для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='во сколько раз вызов может стать медленнее прежнего')
+    args = parser.parse_args()
+
+    previous = dict()
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    cases = get_avito_cases() + get_barahla_cases() + get_irr_cases() + get_olx_cases() + get_vsdelka_cases()
+
+    results = dict()
+    errors = []
+    slower = []
+
+    print('{:<10} {:<24} {:>12} {:>12} {:>10}'.format('сайт', 'вызов', 'мкс/вызов', 'пик, КБ', 'прежде'))
+
+    for case in cases:
+        key = '{}/{}'.format(case.site, case.name)
+
+        try:
+            result = case.func()
+            if case.check is not None and not case.check(result):
+                raise Exception('неожиданный результат: {!r}'.format(result))
+
+        except Exception as e:
+            errors.append(key)
+            print('{:<10} {:<24} ОШИБКА: {}'.format(case.site, case.name, e))
+            continue
+
+        seconds = measure_time(case.func, args.number)
+        peak = measure_memory(case.func)
+        results[key] = {'seconds': seconds, 'peak_bytes': peak}
+
+        ratio = ''
+        if key in previous:
+            ratio = seconds / previous[key]['seconds']
+            if ratio > args.threshold:
+                slower.append(key)
+            ratio = 'x{:.2f}'.format(ratio)
+
+        print('{:<10} {:<24} {:>12.1f} {:>12.1f} {:>10}'.format(case.site, case.name, seconds * 1e6, peak / 1024,
+                                                               ratio))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if errors:
+        print('Ошибки разбора: {}.'.format(', '.join(errors)))
+
+    if slower:
+        print('Медленнее прежнего больше чем в {} раза: {}.'.format(args.threshold, ', '.join(slower)))
+
+    if errors or slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Запись и воспроизведение полного запуска парсера (HttpArchive): асинхронный парсер barahla.net
+# разбирает страницы категории на локальном сервере-заглушке, который отдает сохраненные страницы
+# из fixtures/barahla с задержкой, как у настоящего сайта. Сначала запуск записывается в архив
+# (archive/mode: record), потом воспроизводится без сети: с записанными задержками ответов и без них.
+# Выводится время запуска, количество запросов и объявлений в секунду, найденные телефоны сверяются
+# с найденными при записи.
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/http_archive.py [количество страниц категории] [задержка сервера, с]
+
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PARSER_DIR = os.path.join(BENCHMARKS_DIR, '..', 'barahla_net_phone_parser')
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures', 'barahla')
+
+sys.path.insert(0, PARSER_DIR)
+
+from abstract_site_ad_parser.http_archive import MODE_RECORD, MODE_REPLAY
+from abstract_site_ad_parser.metrics import ADS_TOTAL, REQUESTS_TOTAL
+from mgnbarnet_async_site_ad_parser import MgnBarNet_AsyncSiteAdParser
+
+
+# Путь категории на сервере-заглушке и номер объявления в сохраненной странице объявления
+CATEGORY_PATH = '/services/220/'
+FIXTURE_AD_ID = '4503930'
+
+# На каждой следующей странице категории номера объявлений сдвигаются на столько
+PAGE_ID_STEP = 10000
+
+
+def read_fixture(file_name):
+    with open(os.path.join(FIXTURES_DIR, file_name), encoding='utf-8') as f:
+        return f.read()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_handler(latency):
+    category = read_fixture('category.html')
+    ad = read_fixture('ad.html')
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_body(self, body):
+            time.sleep(latency)
+
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+
+            if parts.path == CATEGORY_PATH:
+                page = int(parse_qs(parts.query).get('page', ['1'])[0])
+                body = re.sub(r'/services/220/(\d+)\.html',
+                              lambda m: '/services/220/{}.html'.format(int(m.group(1)) + page * PAGE_ID_STEP),
+                              category)
+                self.send_body(body)
+                return
+
+            match = re.match(r'/services/220/(\d+)\.html$', parts.path)
+            if match:
+                self.send_body(ad.replace(FIXTURE_AD_ID, match.group(1)))
+                return
+
+            self.send_error(404)
+
+        def do_POST(self):
+            if urlsplit(self.path).path != '/ajax/getPhones.php':
+                self.send_error(404)
+                return
+
+            post = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            ad_id = int(post['br'][0])
+
+            self.send_body('<nobr>8 9{:02} {:03}-{:02}-{:02}</nobr>'.format(
+                ad_id % 100, ad_id // 100 % 1000, ad_id // 10 % 100, ad_id % 100))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def write_config(file_name, tmp_dir, url, pages, mode, latency):
+    """Функция записывает конфиг парсера barahla.net для запуска на сервере-заглушке с архивом в режиме mode"""
+
+    with open(os.path.join(PARSER_DIR, 'config.yaml'), encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    config['categories']['urls'] = [url]
+    config['categories']['page'] = {'start': 1, 'end': pages, 'max': None}
+    config['ad_urls'] = None
+    config['need_phones'] = None
+    config['visited']['store'] = 'memory'
+    config['cache']['enabled'] = False
+    config['out']['file_name'] = os.path.join(tmp_dir, 'out.txt')
+    config['archive'].update(mode=mode, file_name=os.path.join(tmp_dir, 'archive.sqlite'), latency=latency)
+    config['metrics'] = {'json_file': None, 'prometheus_file': None, 'progress_interval': 0}
+    config['log'].update(out=os.path.join(tmp_dir, 'log.txt'), level='WARNING', console_level='WARNING')
+
+    with open(file_name, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+
+
+def run_parser(name, config_file):
+    parser = MgnBarNet_AsyncSiteAdParser()
+    parser.process_config(config_file)
+
+    t = time.perf_counter()
+    parser.run()
+    elapsed = time.perf_counter() - t
+
+    parser.save()
+    parser.archive.close()
+
+    ads = parser.metrics.total(ADS_TOTAL)
+    print('{:<40} {:7.2f} с, запросов {}, объявлений {} ({:.1f}/с), телефонов {}'.format(
+        name, elapsed, parser.metrics.total(REQUESTS_TOTAL), ads, ads / elapsed, len(parser.list_phones)))
+
+    return parser.list_phones
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    server_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), create_handler(server_latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}{}'.format(server.server_port, CATEGORY_PATH)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = os.path.join(tmp_dir, 'config.yaml')
+
+        write_config(config_file, tmp_dir, url, pages, MODE_RECORD, 0)
+        recorded = run_parser('запись (сервер, задержка {} с)'.format(server_latency), config_file)
+
+        # Дальше сервер не нужен: ответы берутся из архива
+        server.shutdown()
+
+        for latency in 1, 0:
+            write_config(config_file, tmp_dir, url, pages, MODE_REPLAY, latency)
+            phones = run_parser('воспроизведение, задержка x{}'.format(latency), config_file)
+
+            if phones != recorded:
+                print('Телефоны отличаются от записанных!')
+
+        print('Размер архива: {:.1f} КБ.'.format(os.path.getsize(os.path.join(tmp_dir, 'archive.sqlite')) / 1024))
+
+
+if __name__ == '__main__':
+    main()
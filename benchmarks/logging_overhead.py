@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Сколько стоит логирование одного объявления в потоке парсера.
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/logging_overhead.py [количество объявлений]
+#
+# На каждое объявление выполняются такие же вызовы логера, как при разборе объявления:
+# несколько отладочных строк, информационные строки и отладочная строка с ответом сервера.
+# Сравниваются прежние синхронные обработчики (файл и консоль на уровне DEBUG) и очередь
+# с потоком записи (LogManager) с разными настройками секции log конфига. Время "в потоке"
+# -- сколько ждет парсер, "всего" -- вместе с дописыванием очереди в файл.
+# Консоль перенаправляется в /dev/null, чтобы не мерить скорость терминала.
+
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from abstract_site_ad_parser.log import DEFAULT_FORMAT, LogManager
+
+
+# Ответ сервера, который логируется на каждом объявлении
+RESPONSE = '{"phone": "8 961 575-04-04", "html": "' + 'x' * 2000 + '"}'
+
+
+def log_ad(log, i):
+    """Функция логирует одно объявление"""
+
+    url = 'https://www.olx.ua/obyavlenie/prodam-veschi-ID{:x}.html'.format(i)
+
+    log.debug('Выполняю разбор объявления %s.', url)
+    log.info('Отправляю запрос к %s, post=%s.', url, None)
+    log.debug('Попытаемся получить телефон, количество попыток: %s', 5)
+    log.debug('Ответ на запрос: "%s".', RESPONSE)
+    log.debug('Время выполнения js скрипта %.3f секунд', 0.123)
+    log.info('Телефон: "%s".', '8 961 575-04-04')
+    log.debug('Выполняю обработку номера телефона "%s" -> "%s".', '8 961 575-04-04', '89615750404')
+    log.info('Найдено %s телефонов.', 1)
+    log.info('Номер телефона: %s.', '89615750404')
+
+
+def get_sync_logger(file_name):
+    """Функция возвращает логер, настроенный как прежний get_logger: синхронные обработчики файла и консоли"""
+
+    log = logging.getLogger('bench_sync')
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+
+    formatter = logging.Formatter(DEFAULT_FORMAT)
+    for handler in logging.FileHandler(file_name, encoding='utf8'), logging.StreamHandler(stream=sys.stdout):
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(formatter)
+        log.addHandler(handler)
+
+    return log
+
+
+def measure(name, log, ads, stop=None):
+    t = time.perf_counter()
+    for i in range(ads):
+        log_ad(log, i)
+    hot = time.perf_counter() - t
+
+    if stop is not None:
+        stop()
+    total = time.perf_counter() - t
+
+    print('{:<45} в потоке {:8.1f} мкс/объявление, всего {:8.1f} мкс/объявление'.format(
+        name, hot / ads * 1e6, total / ads * 1e6), file=sys.__stdout__)
+
+
+def main():
+    ads = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # Консоль -- в /dev/null
+    sys.stdout = open(os.devnull, 'w')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'log.txt')
+
+        measure('синхронно, DEBUG в файл и консоль', get_sync_logger(file_name), ads)
+
+        configs = [
+            ('очередь, DEBUG в файл и консоль', dict(level='DEBUG', console_level='DEBUG', debug_sample=1)),
+            ('очередь, DEBUG в файл, INFO в консоль', dict(level='DEBUG', console_level='INFO', debug_sample=1)),
+            ('очередь, DEBUG через одно на 10', dict(level='DEBUG', console_level='INFO', debug_sample=10)),
+            ('очередь, INFO в файл и консоль', dict(level='INFO', console_level='INFO', debug_sample=1)),
+        ]
+
+        for i, (name, config) in enumerate(configs):
+            manager = LogManager()
+            log = manager.get_logger('bench_queue_{}'.format(i), file_name)
+            manager.configure(dict(config, out=file_name, format=None, enabled=True))
+
+            measure(name, log, ads, manager.stop)
+
+
+if __name__ == '__main__':
+    main()
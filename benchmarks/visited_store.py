@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+# Сравнение хранилищ посещенных объявлений по памяти и времени проверки адреса.
+#
+# Запуск из корня репозитория:
+#     PYTHONPATH=. python3 benchmarks/visited_store.py [количество адресов ...]
+#
+# По умолчанию: 100000 и 1000000 адресов (на 10000000 адресов список и множество строк
+# занимают несколько гигабайт памяти).
+
+
+import os
+import sys
+import tempfile
+import time
+
+from abstract_site_ad_parser.bloom_filter import ScalableBloomFilter
+
+
+# Сколько адресов проверять в списке -- проверка в списке линейная
+LIST_LOOKUPS = 1000
+
+# Сколько адресов проверять в остальных хранилищах
+LOOKUPS = 100000
+
+
+def get_urls(number, start=0):
+    """Функция возвращает адреса объявлений, похожие на настоящие"""
+
+    return ['https://www.olx.ua/obyavlenie/prodam-veschi-ID{:x}.html#a1b2c3d4e5'.format(i)
+            for i in range(start, start + number)]
+
+
+def get_memory(store):
+    """Функция возвращает память, занятую хранилищем, в байтах"""
+
+    if isinstance(store, ScalableBloomFilter):
+        return store.size_in_bytes
+
+    return sys.getsizeof(store) + sum(sys.getsizeof(url) for url in store)
+
+
+def build(factory, add, urls):
+    """Функция заполняет хранилище адресами. Возвращает хранилище и время заполнения"""
+
+    t = time.perf_counter()
+    store = factory()
+    for url in urls:
+        add(store, url)
+
+    return store, time.perf_counter() - t
+
+
+def lookup(store, urls):
+    """Функция возвращает среднее время проверки адреса в микросекундах и количество найденных"""
+
+    t = time.perf_counter()
+    found = sum(1 for url in urls if url in store)
+    return (time.perf_counter() - t) / len(urls) * 1000000, found
+
+
+def run(number):
+    print('Адресов: {}'.format(number))
+
+    urls = get_urls(number)
+    # Новые адреса, которых нет в хранилище: по ним видно ложные срабатывания фильтра
+    new_urls = get_urls(LOOKUPS, start=number)
+
+    stores = [
+        ('list', list, lambda s, url: url in s or s.append(url), LIST_LOOKUPS, min(number, 20000)),
+        ('set', set, lambda s, url: s.add(url), LOOKUPS, number),
+        ('bloom', ScalableBloomFilter, lambda s, url: s.add(url), LOOKUPS, number),
+    ]
+
+    for name, factory, add, lookups, build_number in stores:
+        store, elapsed = build(factory, add, urls[:build_number])
+        if build_number != number:
+            # Список с проверкой повторов заполняется за O(n^2), поэтому проверяются только первые адреса
+            store += urls[build_number:]
+            elapsed = None
+
+        memory = get_memory(store)
+
+        visited_time, _ = lookup(store, urls[-lookups:])
+        new_time, false_positives = lookup(store, new_urls[:lookups])
+
+        print('    {:<6} память {:>10.1f} Мб ({:>6.1f} байт на адрес), заполнение {}, '
+              'проверка посещенного {:>8.2f} мкс, нового {:>8.2f} мкс, ложных срабатываний {:.4%}'.format(
+                  name, memory / 1024 / 1024, memory / number,
+                  '{:>7.2f} с'.format(elapsed) if elapsed is not None else '      - ',
+                  visited_time, new_time, false_positives / lookups))
+
+        if name == 'bloom':
+            file_name = os.path.join(tempfile.gettempdir(), 'visited_benchmark.bloom')
+
+            t = time.perf_counter()
+            store.save(file_name)
+            save_time = time.perf_counter() - t
+
+            t = time.perf_counter()
+            ScalableBloomFilter.load(file_name)
+            load_time = time.perf_counter() - t
+
+            print('           файл {:.1f} Мб, сохранение {:.3f} с, загрузка {:.3f} с'.format(
+                os.path.getsize(file_name) / 1024 / 1024, save_time, load_time))
+            os.remove(file_name)
+
+        del store
+
+
+if __name__ == '__main__':
+    numbers = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+
+    for number in numbers:
+        run(number)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from abstract_site_ad_parser.abstract_async_site_ad_parser import AbstractAsyncSiteAdParser
+from abstract_site_ad_parser.http_cache import RESOURCE_AD
+from irrru_site_ad_parser import IrrRu_SiteAdParser
+
+
+class IrrRu_AsyncSiteAdParser(AbstractAsyncSiteAdParser, IrrRu_SiteAdParser):
+    """Асинхронный парсер сайта "Из рук в руки" irr.ru"""
+
+    async def get_list_ad_from_category(self, category_page_url):
+        rs = await self.fetch_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
+
+    async def get_last_page_category(self, url):
+        rs = await self.fetch_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
+
+    async def get_phones_ad(self, ad_url):
+        rs = await self.fetch(ad_url, resource=RESOURCE_AD)
+        return self.parse_phones_ad(rs.tree)
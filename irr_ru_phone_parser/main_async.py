@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+if __name__ == '__main__':
+    from irrru_async_site_ad_parser import IrrRu_AsyncSiteAdParser
+
+    # Создаем асинхронный парсер и устанавливаем настройки
+    parser = IrrRu_AsyncSiteAdParser()
+    parser.process_config('config.yaml')
+    parser.run()
+    parser.save()
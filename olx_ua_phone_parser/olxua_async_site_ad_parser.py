@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from abstract_site_ad_parser.abstract_async_site_ad_parser import AbstractAsyncSiteAdParser
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
+from olxua_site_ad_parser import OlxUa_SiteAdParser
+
+
+class OlxUa_AsyncSiteAdParser(AbstractAsyncSiteAdParser, OlxUa_SiteAdParser):
+    """Асинхронный парсер сайта olx.ua"""
+
+    async def get_list_ad_from_category(self, category_page_url):
+        rs = await self.fetch_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
+
+    async def get_last_page_category(self, url):
+        rs = await self.fetch_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
+
+    async def get_phones_ad(self, ad_url):
+        rs = await self.fetch(ad_url, resource=RESOURCE_AD)
+
+        url_phone = self.parse_phone_url(rs.tree, rs.url)
+        if url_phone is None:
+            return []
+
+        rs = await self.fetch(url_phone, resource=RESOURCE_PHONE)
+        return self.parse_phones_response(rs.body)
@@ -4,11 +4,11 @@
 __author__ = 'ipetrash'
 
 
-from grab import Grab
-from grab.error import GrabNetworkError
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import re
 from abstract_site_ad_parser import AbstractSiteAdParser, get_logger
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
+from abstract_site_ad_parser.page_memo import canonical_url
 import json
 import os.path
 
@@ -16,41 +16,9 @@ import os.path
 logger = get_logger('olxua_parser')
 
 
-# По-моему, костыль, нужно какой-то метод из коробки использовать
-def grab_go(g, url, **kwargs):
-    """Функция повторяет запросы, если во время выполнения случаются ошибки grab"""
-
-    logger.info('Отправляю запрос к ' + url + ', kwargs=%s', kwargs)
-
-    count = 5
-
-    while count:
-        try:
-            g.go(url, **kwargs)
-            break
-        except GrabNetworkError as e:
-            count -= 1
-            logger.warn('Произошла ошибка "%s" (количество оставшихся попыток %s)', e, count)
-
-
 class OlxUa_SiteAdParser(AbstractSiteAdParser):
     """Парсер сайта olx.ua"""
 
-    def __init__(self):
-        super().__init__()
-
-        self.proxy_url = None
-        self.proxy_type = None
-        self.proxy_enabled = None
-
-    def process_config(self, file_name):
-        super().process_config(file_name)
-
-        proxy = self.config['proxy']
-        self.proxy_url = proxy['url']
-        self.proxy_type = proxy['type']
-        self.proxy_enabled = proxy['enabled']
-
     def get_url_page_category(self, url, page):
         # Примеры страниц категорий сайта olx.ua:
         # Первая страница (корень) может быть так представлена:
@@ -66,109 +34,125 @@ class OlxUa_SiteAdParser(AbstractSiteAdParser):
 
         return url if page == 1 else url + '?page{}'.format(page)
 
+    def canonical_ad_url(self, url):
+        # Ссылки на одно объявление отличаются фрагментом и пометкой рекламного объявления,
+        # которое повторяется на каждой странице категории:
+        #   http://kiev.ko.olx.ua/obyavlenie/sony-xperia-z3-dual-black-IDeSjxG.html#b9de1eb356
+        #   http://kiev.ko.olx.ua/obyavlenie/sony-xperia-z3-dual-black-IDeSjxG.html#a47512b209;promoted
+        return canonical_url(url.split(';')[0])
+
     def get_list_ad_from_category(self, category_page_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
 
-        grab_go(g, category_page_url)
+    def parse_list_ad_from_category(self, tree, category_page_url):
+        """Функция вытаскивает адреса объявлений из дерева страницы категории"""
 
         # На странице тематики, среди обычных объявлений ищем ссылки из картинок объявлений
         xpath = '//table[@id="offers_table"]//td[contains(@class, "offer")]//a[contains(@class, "thumb")]'
-        select = g.doc.select(xpath)
+        select = tree.xpath(xpath)
 
-        if select.count() == 0:
+        if not select:
             raise Exception('Не нашлось объявлений! (xpath="{}")'.format(xpath))
 
         ad_urls = []
 
         for a in select:
-            ad_url = urljoin(category_page_url, a.attr('href'))
+            ad_url = urljoin(category_page_url, a.get('href'))
             ad_urls.append(ad_url)
 
         return ad_urls
 
     def get_last_page_category(self, url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
 
-        grab_go(g, url)
+    def parse_last_page_category(self, tree, url):
+        """Функция вытаскивает номер последней страницы из дерева страницы категории"""
 
         # Запрос для получения последней страницы данной категории
         # Запрос, который получает список ссылок с вариантами перехода на страницы
         # и возвращает последную -- она и будет адресом последней страницы
         xpath = '(//div[@class="pager rel clr"]/span[contains(@class, "item")]/a)[last()]'
-        a = g.doc.select(xpath)
-        if a.count() == 0:
+        a = tree.xpath(xpath)
+        if not a:
             raise Exception('Не удается получить адрес последней страницы в данной категории ({})'.format(xpath))
 
         # Адрес последней страницы категории объявлений
-        last_page_url = urljoin(g.response.url, a.attr('href'))
+        last_page_url = urljoin(url, a[0].get('href'))
 
         page = os.path.split(last_page_url)[-1]
         page = page.replace('?page=', '')
         return int(page)
 
-
     def get_phones_ad(self, ad_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.http.go(ad_url, resource=RESOURCE_AD)
+
+        url_phone = self.parse_phone_url(rs.tree, rs.url)
+        if url_phone is None:
+            return []
+
+        rs = self.http.go(url_phone, resource=RESOURCE_PHONE)
+        return self.parse_phones_response(rs.body)
+
+    def parse_phone_url(self, tree, ad_url):
+        """Функция возвращает адрес ajax запроса, который вернет телефоны объявления,
+        или None, если объявление не активно или телефона нет
 
-        grab_go(g, ad_url)
+        """
 
         # Проверим наличие тега, сообщающего о том, что объявление не активно
-        select = g.doc.select('//div[@id="offer_removed_by_user"]')
-        if select.count():
+        select = tree.xpath('//div[@id="offer_removed_by_user"]')
+        if select:
             logger.warn('Объявление не активно.')
-            return []
+            return
 
         # В классе хранится информация, нужная для ajax запроса
         # И нас интересует кусок json-текста из класса link-phone
         # Пример: "{'path':'phone', 'id':'b6q05', 'id_raw': '164069613'}
         xpath = '//ul[@id="contact_methods"]/li[contains(@class, "link-phone")]'
-        select = g.doc.select(xpath)
-        if select.count():
-            # Вытаскиваем json текст из атрибута тега
-            m = re.search(r'(\{.+\})', select.attr('class'))
-            if m is None:
-                logger.warn('Не найденные данные о объявлении в ' + xpath)
-                return []
+        select = tree.xpath(xpath)
+        if not select:
+            logger.warn('Не найден телефон (%s).', xpath)
+            return
 
-            # json не хочет парсить строки с одинарными кавычками
-            ad_data = m.group(1).replace("'", '"')
-            ad_data = json.loads(ad_data)
+        # Вытаскиваем json текст из атрибута тега
+        m = re.search(r'(\{.+\})', select[0].get('class'))
+        if m is None:
+            logger.warn('Не найденные данные о объявлении в %s', xpath)
+            return
 
-            # Создаем url GET запроса, возвращающего json с настоящим номером телефона
-            # Пример: http://krivoyrog.dnp.olx.ua/ajax/misc/contact/phone/eWGfv/white
-            split_url = g.response.url_details()
-            host = '{}://{}'.format(split_url.scheme, split_url.netloc)
-            url_phone = host + '/ajax/misc/contact/{path}/{id}/white'.format(**ad_data)
+        # json не хочет парсить строки с одинарными кавычками
+        ad_data = m.group(1).replace("'", '"')
+        ad_data = json.loads(ad_data)
 
-            grab_go(g, url_phone)
-            phones_value = json.loads(g.response.body)['value']
+        # Создаем url GET запроса, возвращающего json с настоящим номером телефона
+        # Пример: http://krivoyrog.dnp.olx.ua/ajax/misc/contact/phone/eWGfv/white
+        split_url = urlsplit(ad_url)
+        host = '{}://{}'.format(split_url.scheme, split_url.netloc)
+        return host + '/ajax/misc/contact/{path}/{id}/white'.format(**ad_data)
 
-            # Если пришел html тег, телефонов несколько
-            if '<span' in phones_value:
-                from io import StringIO
-                from lxml import etree
+    def parse_phones_response(self, body):
+        """Функция вытаскивает телефоны из ответа на ajax запрос"""
 
-                # TODO: можно попробовать ругуляркой выковыривать телефоны
-                # Чтобы распарсилось нормально:
-                phones_xml = '<phones>' + phones_value + '</phones>'
+        phones_value = json.loads(body)['value']
 
-                f = StringIO(phones_xml)
-                tree = etree.parse(f)
-                xpath = '//span[@class="block"]/text()'
+        # Если пришел html тег, телефонов несколько
+        if '<span' in phones_value:
+            from io import StringIO
+            from lxml import etree
 
-                return [phone.strip() for phone in tree.xpath(xpath)]
+            # TODO: можно попробовать ругуляркой выковыривать телефоны
+            # Чтобы распарсилось нормально:
+            phones_xml = '<phones>' + phones_value + '</phones>'
 
-            return [phones_value.strip()]
+            f = StringIO(phones_xml)
+            tree = etree.parse(f)
+            xpath = '//span[@class="block"]/text()'
 
-        else:
-            logger.warn('Не найден телефон (%s).', xpath)
-            return []
+            return [phone.strip() for phone in tree.xpath(xpath)]
+
+        return [phones_value.strip()]
 
     def processing_phones(self, phone):
         # Не будем вызывать processing_phones предка -- наша функция лучше
@@ -195,8 +179,8 @@ class OlxUa_SiteAdParser(AbstractSiteAdParser):
 
         if len(new_phone) != 13:
             # raise Exception('Номер "{}" -> "{}" невалидный: длина должна быть 13 символов.'.format(phone, new_phone))
-            logger.warn('Номер "{}" -> "{}" невалидный: длина должна быть 13 символов.'.format(phone, new_phone))
-            logger.warn('Возвращаю оригинальный номер телефона: ' + phone)
+            logger.warn('Номер "%s" -> "%s" невалидный: длина должна быть 13 символов.', phone, new_phone)
+            logger.warn('Возвращаю оригинальный номер телефона: %s', phone)
             return phone
 
         logger.debug('Выполняю обработку номера телефона "%s" -> "%s".', phone, new_phone)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__author__ = 'ipetrash'
+
+
+from abstract_site_ad_parser.abstract_async_site_ad_parser import AbstractAsyncSiteAdParser
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
+from vsdelkaru_site_ad_parser import VSdelkaRu_SiteAdParser, POST_PHONE_URL
+
+
+class VSdelkaRu_AsyncSiteAdParser(AbstractAsyncSiteAdParser, VSdelkaRu_SiteAdParser):
+    """Асинхронный парсер сайта v-sdelka.ru"""
+
+    async def get_list_ad_from_category(self, category_page_url):
+        rs = await self.fetch_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
+
+    async def get_last_page_category(self, url):
+        rs = await self.fetch_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
+
+    async def get_phones_ad(self, ad_url):
+        rs = await self.fetch(ad_url, resource=RESOURCE_AD)
+
+        post = self.parse_phone_post_data(rs.body, ad_url)
+        if post is None:
+            return []
+
+        # Отправляем post-запрос с данными объявления
+        rs = await self.fetch(POST_PHONE_URL, post=post, resource=RESOURCE_PHONE)
+        return self.parse_phone_response(rs.body)
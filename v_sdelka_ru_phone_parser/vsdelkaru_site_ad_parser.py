@@ -4,32 +4,18 @@
 __author__ = 'ipetrash'
 
 
-from grab import Grab
-from grab.error import GrabNetworkError
 from urllib.parse import unquote, urljoin
 import re
 from abstract_site_ad_parser import AbstractSiteAdParser, get_logger
+from abstract_site_ad_parser.http_cache import RESOURCE_AD, RESOURCE_PHONE
 import os.path
 
 
 logger = get_logger('vsdelkaruparser')
 
 
-# По-моему, костыль, нужно какой-то метод из коробки использовать
-def grab_go(g, url, **kwargs):
-    """Функция повторяет запросы, если во время выполнения случаются ошибки grab"""
-
-    logger.info('Отправляю запрос к ' + url + ', kwargs=%s', kwargs)
-
-    count = 5
-
-    while count:
-        try:
-            g.go(url, **kwargs)
-            break
-        except GrabNetworkError as e:
-            count -= 1
-            logger.warn('Произошла ошибка "%s" (количество оставшихся попыток %s)', e, count)
+# Адрес, на который отправляется POST запрос для получения телефона объявления
+POST_PHONE_URL = 'http://v-sdelka.ru/moduls/doska/include/get_type_data_elm_doska.php'
 
 
 class VSdelkaRu_SiteAdParser(AbstractSiteAdParser):
@@ -38,20 +24,11 @@ class VSdelkaRu_SiteAdParser(AbstractSiteAdParser):
     def __init__(self):
         super().__init__()
 
-        self.proxy_url = None
-        self.proxy_type = None
-        self.proxy_enabled = None
-
         # Регулярка для получения номера последней страницы из url
         self.re_page = re.compile('num(\d+?).html')
 
-    def process_config(self, file_name):
-        super().process_config(file_name)
-
-        proxy = self.config['proxy']
-        self.proxy_url = proxy['url']
-        self.proxy_type = proxy['type']
-        self.proxy_enabled = proxy['enabled']
+        # Регулярка для получения id объявления из js-кода показа телефона
+        self.re_id_ad = re.compile(r'view_mask_phone_advert.action_view\((.+?)\)')
 
     def get_url_page_category(self, url, page):
         # Примеры страниц категорий сайта v-sdelka.ru:
@@ -69,41 +46,41 @@ class VSdelkaRu_SiteAdParser(AbstractSiteAdParser):
         return url if page == 1 else url + 'num{}.html'.format(page)
 
     def get_list_ad_from_category(self, category_page_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(category_page_url)
+        return self.parse_list_ad_from_category(rs.tree, category_page_url)
 
-        grab_go(g, category_page_url)
+    def parse_list_ad_from_category(self, tree, category_page_url):
+        """Функция вытаскивает адреса объявлений из дерева страницы категории"""
 
         # Запрос для получения адресов объявлений
         xpath = '//div[@class="synopsis_advert"]//a[@class="title_synopsis_adv"]'
 
-        select = g.doc.select(xpath)
-        if select.count() == 0:
+        select = tree.xpath(xpath)
+        if not select:
             raise Exception('Не нашлось объявлений! (xpath="{}")'.format(xpath))
 
         ad_urls = []
 
         for a in select:
-            ad_url = urljoin(category_page_url, a.attr('href'))
+            ad_url = urljoin(category_page_url, a.get('href'))
             ad_urls.append(ad_url)
 
         return ad_urls
 
     def get_last_page_category(self, url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.get_category_page(url)
+        return self.parse_last_page_category(rs.tree, rs.url)
 
-        grab_go(g, url)
+    def parse_last_page_category(self, tree, url):
+        """Функция вытаскивает номер последней страницы из дерева страницы категории"""
 
         # Запрос для получения последней страницы данной категории
         xpath = '//div[@class="navigator_page_podcategory"]//a[last()]'
-        a = g.doc.select(xpath)
-        if a.count() == 0:
+        a = tree.xpath(xpath)
+        if not a:
             raise Exception('Не удалось получить url последней страницы данной категории! (xpath="{}")'.format(xpath))
 
-        last_page_url = urljoin(g.response.url, a.attr('href'))
+        last_page_url = urljoin(url, a[0].get('href'))
 
         page = os.path.split(last_page_url)[-1]
 
@@ -116,36 +93,41 @@ class VSdelkaRu_SiteAdParser(AbstractSiteAdParser):
         return int(page)
 
     def get_phones_ad(self, ad_url):
-        g = Grab()
-        if self.proxy_enabled:
-            g.setup(proxy=self.proxy_url, proxy_type=self.proxy_type)
+        rs = self.http.go(ad_url, resource=RESOURCE_AD)
 
-        grab_go(g, ad_url)
+        post = self.parse_phone_post_data(rs.body, ad_url)
+        if post is None:
+            return []
 
-        pattern_text = r'view_mask_phone_advert.action_view\((.+?)\)'
-        pattern = re.compile(pattern_text)
+        logger.info('POST запрос для получения телефона: %s, %s', POST_PHONE_URL, post)
 
-        match = pattern.search(g.response.body)
+        # Отправляем post-запрос с данными объявления
+        rs = self.http.go(POST_PHONE_URL, post=post, resource=RESOURCE_PHONE)
+        return self.parse_phone_response(rs.body)
+
+    def parse_phone_post_data(self, body, ad_url):
+        """Функция возвращает данные POST запроса, который вернет телефон объявления,
+        или None, если телефон не указан
+
+        """
+
+        match = self.re_id_ad.search(body)
         if match is None:
-            logger.warn('Телефон не указан, адрес объявления: ' + ad_url)
-            return []
+            logger.warn('Телефон не указан, адрес объявления: %s', ad_url)
+            return
 
         # id объявления
         id_ad = match.group(1)
 
-        post_phone_url = 'http://v-sdelka.ru/moduls/doska/include/get_type_data_elm_doska.php'
-        post = {'id_advert': id_ad, 'type_data': 'phone'}
-        logger.info('POST запрос для получения телефона: %s, %s', post_phone_url, post)
+        return {'id_advert': id_ad, 'type_data': 'phone'}
 
-        # Отправляем post-запрос с данными объявления
-        grab_go(g, post_phone_url, post=post)
+    def parse_phone_response(self, body):
+        """Функция вытаскивает телефон из ответа на POST запрос"""
 
         # Варианты возврата:
         # { error:{code:1,text:'ошибка с параметрами!'}  }
         # { error:{code:0,text:'no'}  ,  on_data : 1, data : {'phone':'%2B89049425772%20'} }
-        body = g.response.body
-
-        logger.info('Ответ на запрос: %s', body)
+        logger.debug('Ответ на запрос: %s', body)
         logger.debug('Попытка найти в ответе ошибку, и если ее нет, получить телефон')
 
         match = re.search("text:'(.+?)'", body)